@@ -0,0 +1,146 @@
+import numpy as np
+from pypfopt import CLA
+from pypfopt.base_optimizer import BaseOptimizer
+from .covariance import factorize
+
+
+class AnalyticFrontier(BaseOptimizer):
+    """Общий интерфейс аналитических границ: веса по целевой доходности, min-vol и max-Sharpe."""
+
+    def __init__(self, mu, S):
+        self.mu = np.asarray(mu, dtype=float)
+        self.S = np.asarray(S, dtype=float)
+        super().__init__(len(self.mu), list(mu.index))
+
+    def performance(self, weights):
+        return float(self.mu @ weights), float(np.sqrt(max(weights @ self.S @ weights, 0.0)))
+
+    def efficient_return(self, target_return):
+        self.set_weights(dict(zip(self.tickers, self.weights_for_return(target_return))))
+        return self._make_output_weights()
+
+    def min_volatility(self):
+        self.set_weights(dict(zip(self.tickers, self.min_volatility_weights())))
+        return self._make_output_weights()
+
+    def max_sharpe(self, risk_free_rate=0.02):
+        self.set_weights(dict(zip(self.tickers, self.max_sharpe_weights(risk_free_rate))))
+        return self._make_output_weights()
+
+    def portfolio_performance(self, verbose=False, risk_free_rate=0.02):
+        expected_return, risk = self.performance(self.weights)
+        sharpe = (expected_return - risk_free_rate) / risk if risk > 0 else 0.0
+        return expected_return, risk, sharpe
+
+    def frontier(self, target_returns, progress=None):
+        """Точки границы для набора целевых доходностей: список (доходность, риск, веса)."""
+        points = []
+        for index, target_return in enumerate(target_returns, 1):
+            if progress is not None:
+                progress(index, len(target_returns))
+            try:
+                weights = self.weights_for_return(target_return)
+            except ValueError:
+                continue
+            expected_return, risk = self.performance(weights)
+            points.append((expected_return, risk, weights))
+        return points
+
+
+class ClosedFormFrontier(AnalyticFrontier):
+    """Граница без ограничений на знак весов (только Σw = 1) в замкнутой форме.
+
+    Все портфели границы — линейные комбинации S⁻¹1 и S⁻¹μ, поэтому после
+    одного разложения Холецкого (кэшируется в api.covariance) любая точка
+    считается за O(n).
+    """
+
+    def __init__(self, mu, S):
+        super().__init__(mu, S)
+        factorization = factorize(self.S)
+        self.inv_ones = factorization.solve(np.ones(len(self.mu)))
+        self.inv_mu = factorization.solve(self.mu)
+        self.A = self.inv_ones.sum()
+        self.B = self.inv_mu.sum()
+        self.C = self.mu @ self.inv_mu
+        self.D = self.A * self.C - self.B ** 2
+
+    def weights_for_return(self, target_return):
+        if self.D <= 0:
+            return self.min_volatility_weights()
+        lam = (self.C - self.B * target_return) / self.D
+        gamma = (self.A * target_return - self.B) / self.D
+        return lam * self.inv_ones + gamma * self.inv_mu
+
+    def min_volatility_weights(self):
+        return self.inv_ones / self.A
+
+    def max_sharpe_weights(self, risk_free_rate=0.02):
+        excess = self.B - risk_free_rate * self.A
+        if excess <= 0:
+            raise ValueError(
+                "risk-free rate exceeds the minimum-variance return, the unconstrained max-Sharpe portfolio is unbounded"
+            )
+        return (self.inv_mu - risk_free_rate * self.inv_ones) / excess
+
+
+class CriticalLineFrontier(AnalyticFrontier):
+    """Граница без коротких позиций по алгоритму критической линии (CLA).
+
+    Между соседними поворотными точками веса линейны по целевой доходности,
+    поэтому любая точка границы и портфель максимального Шарпа находятся
+    точно, без повторных численных решений.
+    """
+
+    def __init__(self, mu, S, weight_bounds=(0, 1)):
+        super().__init__(mu, S)
+        cla = CLA(mu, S, weight_bounds=weight_bounds)
+        # Публичный min_volatility решает задачу целиком; поворотные точки — документированный атрибут w,
+        # упорядоченный от максимальной доходности к минимальному риску
+        cla.min_volatility()
+        self.turning_points = [np.asarray(w, dtype=float).ravel() for w in cla.w]
+        self.turning_returns = np.array([self.mu @ w for w in self.turning_points])
+
+    def weights_for_return(self, target_return):
+        if target_return > self.turning_returns[0] + 1e-12:
+            raise ValueError(
+                f"target_return must be lower than the maximum possible return {self.turning_returns[0]:.4f}"
+            )
+        if target_return <= self.turning_returns[-1]:
+            return self.min_volatility_weights()
+        i = int(np.searchsorted(-self.turning_returns, -target_return))
+        i = min(max(i, 1), len(self.turning_points) - 1)
+        r0, r1 = self.turning_returns[i - 1], self.turning_returns[i]
+        t = (r0 - target_return) / (r0 - r1) if r0 != r1 else 0.0
+        return (1 - t) * self.turning_points[i - 1] + t * self.turning_points[i]
+
+    def min_volatility_weights(self):
+        return self.turning_points[-1]
+
+    def max_sharpe_weights(self, risk_free_rate=0.02):
+        # На отрезке w(t) = w0 + t(w1 - w0) отношение (r(t) - rf) / σ(t) имеет
+        # единственную стационарную точку t = (αb - βc) / (βb - αa)
+        best_weights, best_sharpe = None, -np.inf
+        for w0, w1 in zip(self.turning_points, self.turning_points[1:] or self.turning_points):
+            dw = w1 - w0
+            alpha, beta = self.mu @ w0 - risk_free_rate, self.mu @ dw
+            a, b, c = dw @ self.S @ dw, w0 @ self.S @ dw, w0 @ self.S @ w0
+            candidates = [0.0, 1.0]
+            denominator = beta * b - alpha * a
+            if denominator != 0:
+                candidates.append(min(max((alpha * b - beta * c) / denominator, 0.0), 1.0))
+            for t in candidates:
+                weights = w0 + t * dw
+                risk = np.sqrt(max(weights @ self.S @ weights, 0.0))
+                sharpe = (self.mu @ weights - risk_free_rate) / risk if risk > 0 else -np.inf
+                if sharpe > best_sharpe:
+                    best_weights, best_sharpe = weights, sharpe
+        return best_weights
+
+
+def analytic_frontier(mu, S, method):
+    if method == 'closed_form':
+        return ClosedFormFrontier(mu, S)
+    if method == 'cla':
+        return CriticalLineFrontier(mu, S)
+    raise ValueError(f"Unknown analytic frontier method: {method}")
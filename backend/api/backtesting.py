@@ -0,0 +1,158 @@
+import logging
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from . import executor
+from .optimization_methods import portfolio_metrics, solve_model
+from .optimization_service import BOND_COUPON_RATE
+from .price_store import load_price_matrix
+
+logger = logging.getLogger(__name__)
+
+BACKTEST_LOOKBACK = getattr(settings, 'BACKTEST_LOOKBACK', 120)
+BACKTEST_REBALANCE_EVERY = getattr(settings, 'BACKTEST_REBALANCE_EVERY', 21)
+BACKTEST_COST_BPS = getattr(settings, 'BACKTEST_COST_BPS', 10.0)
+
+
+class RollingMoments:
+    """Суммы доходностей, логарифмов роста и попарных произведений по скользящему окну.
+
+    При сдвиге окна добавляются новые дни и вычитаются выбывшие, поэтому
+    обновление стоит O(k·n²) для k дней сдвига, а не O(lookback·n²).
+    Оценки совпадают с pypfopt: μ — среднегодовая доходность с
+    капитализацией, S — выборочная ковариация × 252.
+    """
+
+    def __init__(self, returns):
+        self.returns = returns
+        self.log_growth = np.log1p(returns)
+        n = returns.shape[1]
+        self.start = self.end = 0
+        self.sums = np.zeros(n)
+        self.log_sums = np.zeros(n)
+        self.products = np.zeros((n, n))
+
+    def _apply(self, start, end, sign):
+        rows = self.returns[start:end]
+        self.sums += sign * rows.sum(axis=0)
+        self.log_sums += sign * self.log_growth[start:end].sum(axis=0)
+        self.products += sign * (rows.T @ rows)
+
+    def move(self, start, end):
+        """Сдвигает окно на строки [start, end)."""
+        if start >= self.end or end <= self.start or start < self.start:
+            self.sums[:], self.log_sums[:], self.products[:] = 0.0, 0.0, 0.0
+            self._apply(start, end, 1)
+        else:
+            self._apply(self.end, end, 1)
+            self._apply(self.start, start, -1)
+        self.start, self.end = start, end
+
+    def estimate(self):
+        count = self.end - self.start
+        mean = self.sums / count
+        mu = np.expm1(self.log_sums * 252 / count)
+        S = (self.products - count * np.outer(mean, mean)) / (count - 1) * 252
+        return mu, (S + S.T) / 2
+
+
+def _rebalance_weights(mu, S, returns_df, model, target_return, risk_level, sortino_l, method):
+    """Целевые веса на дату ребалансировки в порядке mu.index (выполняется в пуле процессов)."""
+    weights, _ = solve_model(model, mu, S, returns_df, target_return, risk_level, sortino_l, method)
+    return np.array([float(weights.get(ticker, 0.0)) for ticker in mu.index])
+
+
+def walk_forward(prices, model='markowitz', lookback=BACKTEST_LOOKBACK, rebalance_every=BACKTEST_REBALANCE_EVERY,
+                 cost_bps=BACKTEST_COST_BPS, target_return=0.1, risk_level=0.02, sortino_l=0.0, method='qp',
+                 ticker_types=None):
+    """Бэктест со скользящим окном по матрице цен (даты × тикеры).
+
+    Каждые rebalance_every торговых дней модель переоптимизируется по
+    последним lookback дням доходностей; между ребалансировками веса дрейфуют
+    вместе с ценами. Стоимость сделок — cost_bps базисных пунктов от объёма
+    (оборота). Оценки μ и S обновляются инкрементально (RollingMoments), а
+    оптимизации по датам ребалансировки независимы и решаются параллельно.
+    """
+    if lookback < 2 or rebalance_every < 1:
+        raise ValueError("lookback must be at least 2 and rebalance_every positive")
+    prices = prices.ffill().dropna()
+    returns_df = prices.pct_change().iloc[1:]
+    if len(returns_df) <= lookback:
+        raise ValueError(f"Need more than {lookback} days of common price history, got {len(returns_df)}")
+    tickers = list(returns_df.columns)
+    returns = returns_df.to_numpy(dtype=float)
+    coupon = np.array([
+        BOND_COUPON_RATE / 252 if (ticker_types or {}).get(ticker) == 'bonds' else 0.0 for ticker in tickers
+    ])
+
+    # Веса, рассчитанные по окну [day - lookback, day), действуют начиная с дня day
+    rebalance_days = list(range(lookback, len(returns), rebalance_every))
+    moments = RollingMoments(returns)
+    jobs = []
+    for day in rebalance_days:
+        moments.move(day - lookback, day)
+        mu, S = moments.estimate()
+        jobs.append((
+            pd.Series(mu + coupon, index=tickers), pd.DataFrame(S, index=tickers, columns=tickers),
+            returns_df.iloc[day - lookback:day], model, target_return, risk_level, sortino_l, method,
+        ))
+    logger.info(f"Backtesting {model} on {len(tickers)} tickers: {len(jobs)} rebalances")
+    targets = executor.run_many(_rebalance_weights, jobs)
+
+    nav = np.empty(len(returns) - lookback)
+    value, holdings = 1.0, np.zeros(len(tickers))
+    rebalances = []
+    total_turnover = total_costs = 0.0
+    for index, (day, target) in enumerate(zip(rebalance_days, targets)):
+        date = returns_df.index[day]
+        drifted = holdings / value if value > 0 else holdings
+        if isinstance(target, Exception):
+            # Модель не решилась на этом окне: портфель остаётся прежним
+            logger.warning(f"Backtest rebalance on {date} failed: {str(target)}")
+            rebalances.append({'date': str(date), 'error': str(target)})
+            target = drifted
+        else:
+            turnover = float(np.abs(target - drifted).sum())
+            cost = value * turnover * cost_bps / 10000
+            value -= cost
+            total_turnover += turnover
+            total_costs += cost
+            rebalances.append({
+                'date': str(date),
+                'weights': {ticker: float(weight) for ticker, weight in zip(tickers, target)},
+                'turnover': turnover,
+                'cost': cost,
+            })
+        end = rebalance_days[index + 1] if index + 1 < len(rebalance_days) else len(returns)
+        growth = np.cumprod(1 + returns[day:end], axis=0)
+        path = value * (growth @ target) + value * (1 - target.sum())
+        nav[day - lookback:end - lookback] = path
+        holdings = value * target * growth[-1]
+        value = float(path[-1])
+
+    nav_returns = np.diff(np.concatenate([[1.0], nav])) / np.concatenate([[1.0], nav[:-1]])
+    metrics = portfolio_metrics(np.ones((1, 1)), nav_returns[:, None], risk_free_rate=risk_level, L=sortino_l)
+    years = len(nav) / 252
+    return {
+        'model': model,
+        'tickers': tickers,
+        'dates': [str(date) for date in returns_df.index[lookback:]],
+        'nav': nav.tolist(),
+        'rebalances': rebalances,
+        'summary': {
+            'total_return': float(nav[-1] - 1),
+            'annualized_return': float(nav[-1] ** (1 / years) - 1) if nav[-1] > 0 else -1.0,
+            'volatility': float(nav_returns.std() * np.sqrt(252)),
+            'turnover': total_turnover,
+            'costs': total_costs,
+            **{name: float(values[0]) for name, values in metrics.items()},
+        },
+    }
+
+
+def run_backtest(tickers, start_date=None, end_date=None, ticker_types=None, **params):
+    """Бэктест по ценам из HistoricalPrice за [start_date, end_date]; параметры — как у walk_forward."""
+    prices = load_price_matrix(tickers, start_date, end_date).dropna(axis=1, how='all')
+    if len(prices.columns) < 2:
+        raise ValueError("At least 2 tickers with price history are required")
+    return walk_forward(prices, ticker_types=ticker_types, **params)
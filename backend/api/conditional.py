@@ -0,0 +1,34 @@
+import hashlib
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """Сильный ETag по содержимому: строкам и байтовым буферам (например, массивам NumPy)."""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, (bytes, memoryview)) else str(part).encode())
+        digest.update(b'\0')
+    return f'"{digest.hexdigest()}"'
+
+
+def conditional_response(request, build, etag=None, last_modified=None):
+    """Ответ с учётом If-None-Match / If-Modified-Since.
+
+    last_modified — datetime последнего изменения. Если у клиента актуальная
+    версия, возвращается 304 без вызова build(); иначе build() строит ответ,
+    к которому добавляются ETag и Last-Modified.
+    """
+    if last_modified is not None:
+        # HTTP-даты точны до секунды: без отбрасывания долей If-Modified-Since не совпадёт
+        last_modified = int(last_modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = build()
+    if etag is not None:
+        response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    # Клиент может хранить ответ, но обязан перепроверять его при каждом запросе
+    response.headers.setdefault('Cache-Control', 'no-cache')
+    return response
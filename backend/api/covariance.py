@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from pypfopt import expected_returns, risk_models
+from scipy.linalg import LinAlgError, cho_factor, cho_solve
+
+logger = logging.getLogger(__name__)
+
+# sample — выборочная ковариация; ledoit_wolf и oas — сжатие к масштабированной
+# единичной матрице; factor — статистическая факторная модель (главные компоненты)
+COV_ESTIMATORS = ['sample', 'ledoit_wolf', 'oas', 'factor']
+FACTOR_COUNT = getattr(settings, 'COVARIANCE_FACTORS', 3)
+CACHE_SIZE = getattr(settings, 'COVARIANCE_CACHE_SIZE', 64)
+FREQUENCY = 252
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш фиксированного размера."""
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+_estimates = LRUCache(CACHE_SIZE)
+_factorizations = LRUCache(CACHE_SIZE)
+
+
+def factor_covariance(df, factors=FACTOR_COUNT, frequency=FREQUENCY):
+    """Статистическая факторная модель: S = BBᵀ + D по главным компонентам выборочной ковариации."""
+    sample = expected_returns.returns_from_prices(df).cov().to_numpy()
+    k = max(1, min(factors, len(sample) - 1))
+    eigenvalues, eigenvectors = np.linalg.eigh(sample)
+    loadings = eigenvectors[:, -k:] * np.sqrt(np.clip(eigenvalues[-k:], 0.0, None))
+    common = loadings @ loadings.T
+    # Специфическая дисперсия не может быть отрицательной; нижняя граница сохраняет S положительно определённой
+    specific = np.clip(np.diag(sample) - np.diag(common), 1e-12, None)
+    return pd.DataFrame((common + np.diag(specific)) * frequency, index=df.columns, columns=df.columns)
+
+
+def estimate_covariance(df, estimator='sample'):
+    """Годовая ковариационная матрица по матрице цен выбранной оценкой."""
+    if estimator == 'sample':
+        return risk_models.sample_cov(df)
+    if estimator == 'ledoit_wolf':
+        return risk_models.CovarianceShrinkage(df).ledoit_wolf()
+    if estimator == 'oas':
+        return risk_models.CovarianceShrinkage(df).oracle_approximating()
+    if estimator == 'factor':
+        return factor_covariance(df)
+    raise ValueError(f"Unknown covariance estimator: {estimator}")
+
+
+def cached_covariance(df, estimator, version):
+    """estimate_covariance с кэшем по (корзина, оценка, версия данных)."""
+    key = (tuple(df.columns), estimator, version)
+    S = _estimates.get(key)
+    if S is None:
+        S = estimate_covariance(df, estimator)
+        _estimates.set(key, S)
+    return S
+
+
+def _digest(S):
+    values = np.ascontiguousarray(np.asarray(S, dtype=float))
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+class Factorization:
+    """Разложение Холецкого и обратная матрица (матрица точности) ковариации."""
+
+    def __init__(self, S):
+        S = np.asarray(S, dtype=float)
+        try:
+            self.cholesky = cho_factor(S)
+            self.precision = cho_solve(self.cholesky, np.eye(len(S)))
+        except LinAlgError:
+            # Вырожденная выборочная ковариация: разложения нет, остаётся псевдообратная
+            logger.warning("Covariance matrix is not positive definite, using pseudo-inverse")
+            self.cholesky = None
+            self.precision = np.linalg.pinv(S)
+
+    def solve(self, b):
+        """S⁻¹b."""
+        if self.cholesky is not None:
+            return cho_solve(self.cholesky, b)
+        return self.precision @ b
+
+
+def factorize(S):
+    """Разложение ковариации с кэшем в памяти процесса.
+
+    Ключ — содержимое матрицы, которое однозначно задаётся корзиной, оценкой
+    и версией данных, поэтому кэш работает и в процессах пула оптимизации,
+    куда передаётся только сама матрица.
+    """
+    key = _digest(S)
+    factorization = _factorizations.get(key)
+    if factorization is None:
+        factorization = Factorization(S)
+        _factorizations.set(key, factorization)
+    return factorization
@@ -0,0 +1,53 @@
+import numpy as np
+
+DOWNSAMPLING_METHODS = ['lttb', 'ohlc']
+
+
+def lttb(x, y, threshold):
+    """Индексы точек, выбранных алгоритмом Largest-Triangle-Three-Buckets.
+
+    Первая и последняя точки сохраняются; из каждой из остальных корзин
+    берётся точка, образующая наибольший треугольник с точкой, выбранной в
+    предыдущей корзине, и средним следующей корзины. Так сохраняются пики
+    и форма графика.
+    """
+    n = len(y)
+    if threshold < 3:
+        raise ValueError("LTTB needs at least 3 points")
+    if threshold >= n:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean() if next_end > next_start else x[-1]
+        avg_y = y[next_start:next_end].mean() if next_end > next_start else y[-1]
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def ohlc(dates, prices, buckets):
+    """Свёртка ряда в не более чем buckets свечей: (даты начала, open, high, low, close)."""
+    n = len(prices)
+    prices = np.asarray(prices, dtype=float)
+    if n == 0:
+        return dates[:0], prices[:0], prices[:0], prices[:0], prices[:0]
+    starts = np.unique(np.linspace(0, n, min(buckets, n), endpoint=False).astype(int))
+    ends = np.append(starts[1:], n)
+    return (
+        dates[starts],
+        prices[starts],
+        np.maximum.reduceat(prices, starts),
+        np.minimum.reduceat(prices, starts),
+        prices[ends - 1],
+    )
@@ -0,0 +1,210 @@
+import logging
+import math
+import os
+import threading
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures import wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+import django
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 0 — решать в текущем процессе (удобно для отладки)
+WORKERS = getattr(settings, 'OPTIMIZATION_WORKERS', os.cpu_count() or 1)
+JOB_TIMEOUT = getattr(settings, 'OPTIMIZATION_TIMEOUT', 60)
+
+_pool = None
+_pool_lock = threading.Lock()
+# Future вызывающего → задача пула
+_jobs = {}
+
+
+class JobTimeout(Exception):
+    """Задача не уложилась в отведённое время и была отменена."""
+
+
+def _init_worker():
+    # Воркер может стартовать через spawn/forkserver, где Django ещё не настроен
+    django.setup()
+
+
+def get_pool():
+    """Общий пул процессов для расчётов; создаётся при первом обращении."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            logger.info(f"Starting optimization process pool with {WORKERS} workers")
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_worker)
+        return _pool
+
+
+class _Job:
+    """Задача, переданная в пул; future вызывающего переживает перезапуск пула."""
+
+    def __init__(self, fn, args, kwargs):
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.future = Future()
+        self.inner = self.pool = None
+        self.cancelled = False
+        self.retried = False
+
+
+_jobs_lock = threading.Lock()
+# Пулы, остановленные ради отмены задачи: их остальные задачи перезапускаются
+_retired = weakref.WeakSet()
+
+
+def _retire_pool(pool):
+    """Снимает пул с работы и завершает его процессы.
+
+    ProcessPoolExecutor не умеет прерывать уже запущенную задачу, поэтому
+    зависший расчёт останавливается только вместе с процессами пула.
+    Остальные задачи этого пула _finish перезапускает в новом пуле.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+        _retired.add(pool)
+    processes = list((getattr(pool, '_processes', None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def shutdown(wait=True):
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        logger.info("Shutting down optimization process pool")
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def _start(job):
+    while True:
+        pool = get_pool()
+        try:
+            with _jobs_lock:
+                job.pool = pool
+                job.inner = pool.submit(job.fn, *job.args, **job.kwargs)
+            break
+        except RuntimeError:
+            # Пул остановили между get_pool и submit
+            _retire_pool(pool)
+    job.inner.add_done_callback(lambda inner: _finish(job, inner))
+
+
+def _finish(job, inner):
+    """Переносит результат задачи пула в future вызывающего или перезапускает задачу."""
+    with _jobs_lock:
+        if inner is not job.inner or job.cancelled:
+            return
+    error = None if inner.cancelled() else inner.exception()
+    if job.pool in _retired and (inner.cancelled() or isinstance(error, BrokenProcessPool)):
+        # Пул остановлен из-за отмены чужой задачи
+        logger.info(f"Resubmitting {getattr(job.fn, '__name__', job.fn)} after process pool restart")
+        _start(job)
+    elif isinstance(error, BrokenProcessPool) and not job.retried:
+        # Процесс пула упал (например, из-за нехватки памяти): задача повторяется один раз в новом пуле
+        logger.warning(f"Process pool is broken, retrying {getattr(job.fn, '__name__', job.fn)}")
+        job.retried = True
+        _retire_pool(job.pool)
+        _start(job)
+    elif inner.cancelled():
+        job.future.cancel()
+    elif error is not None:
+        job.future.set_exception(error)
+    else:
+        job.future.set_result(inner.result())
+
+
+def submit(fn, *args, **kwargs):
+    """Отправляет задачу в пул и возвращает Future.
+
+    Если пул перезапускается из-за отмены другой задачи, задача
+    выполняется заново в новом пуле, а Future остаётся прежним.
+    """
+    job = _Job(fn, args, kwargs)
+    with _jobs_lock:
+        _jobs[job.future] = job
+    job.future.add_done_callback(_forget)
+    _start(job)
+    return job.future
+
+
+def _forget(future):
+    with _jobs_lock:
+        _jobs.pop(future, None)
+
+
+def cancel(*futures):
+    """Отменяет задачи: ожидающие — из очереди, выполняющиеся — вместе с процессами их пула.
+
+    Задачи других запросов из остановленного пула перезапускаются в новом пуле.
+    """
+    pools = set()
+    with _jobs_lock:
+        jobs = [_jobs[future] for future in futures if future in _jobs]
+        # Сначала помечаем все отменяемые задачи, чтобы _finish не перезапустил их
+        for job in jobs:
+            job.cancelled = True
+    for job in jobs:
+        if not job.inner.cancel() and not job.inner.done():
+            pools.add(job.pool)
+        job.future.cancel()
+    for pool in pools:
+        _retire_pool(pool)
+
+
+def run(fn, *args, timeout=None, **kwargs):
+    """Выполняет fn в пуле процессов и ждёт результат не дольше timeout секунд."""
+    if not WORKERS:
+        return fn(*args, **kwargs)
+    timeout = JOB_TIMEOUT if timeout is None else timeout
+    future = submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        logger.warning(f"Job {getattr(fn, '__name__', fn)} timed out after {timeout}s, cancelling")
+        cancel(future)
+        raise JobTimeout(f'Job timed out after {timeout}s')
+
+
+def run_many(fn, jobs, timeout=None):
+    """Параллельно выполняет fn(*args) для каждого набора аргументов из jobs.
+
+    Возвращает список результатов в порядке jobs; на месте упавшей задачи
+    стоит её исключение. Задачи в очереди стартуют позже, поэтому общий срок
+    растёт с числом «волн» пула.
+    """
+    if not WORKERS:
+        results = []
+        for args in jobs:
+            try:
+                results.append(fn(*args))
+            except Exception as e:
+                results.append(e)
+        return results
+    if not jobs:
+        return []
+    timeout = JOB_TIMEOUT if timeout is None else timeout
+    futures = [submit(fn, *args) for args in jobs]
+    done, pending = wait_futures(futures, timeout=timeout * math.ceil(len(jobs) / WORKERS))
+    if pending:
+        logger.warning(f"{len(pending)} of {len(jobs)} jobs timed out, cancelling")
+        cancel(*pending)
+
+    results = []
+    for future in futures:
+        if future in pending:
+            results.append(JobTimeout(f'Job timed out after {timeout}s'))
+        elif future.exception() is not None:
+            results.append(future.exception())
+        else:
+            results.append(future.result())
+    return results
+
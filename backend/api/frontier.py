@@ -0,0 +1,94 @@
+import logging
+import numpy as np
+import osqp
+import scipy.sparse as sp
+from .analytic_frontier import analytic_frontier
+
+logger = logging.getLogger(__name__)
+
+# Имена параметров OSQP ≥ 1.0 (в старых версиях polishing назывался polish)
+SOLVER_SETTINGS = {
+    'verbose': False,
+    'eps_abs': 1e-9,
+    'eps_rel': 1e-9,
+    'polishing': True,
+    'max_iter': 20000,
+}
+
+
+class FrontierEngine:
+    """Эффективная граница с однократной постановкой и факторизацией QP.
+
+    Задача min wᵀSw при Σw = 1, границах весов и μᵀw ≥ r передаётся в OSQP
+    один раз. Для каждой новой целевой доходности r меняется только нижняя
+    граница ограничения, а решение стартует с предыдущей точки (warm start),
+    поэтому факторизация KKT-матрицы переиспользуется всеми точками.
+    """
+
+    def __init__(self, mu, S, weight_bounds=(0, 1)):
+        self.tickers = list(mu.index)
+        self.mu = np.asarray(mu, dtype=float)
+        self.S = np.asarray(S, dtype=float)
+        n = len(self.mu)
+
+        lower, upper = weight_bounds
+        lower = -np.inf if lower is None else lower
+        upper = np.inf if upper is None else upper
+        constraints = sp.vstack([
+            sp.csc_matrix(np.ones((1, n))),
+            sp.csc_matrix(self.mu.reshape(1, -1)),
+            sp.identity(n, format='csc'),
+        ], format='csc')
+        self._lower = np.concatenate([[1.0, -np.inf], np.full(n, lower, dtype=float)])
+        self._upper = np.concatenate([[1.0, np.inf], np.full(n, upper, dtype=float)])
+
+        self.solver = osqp.OSQP()
+        self.solver.setup(
+            sp.triu(sp.csc_matrix(2 * self.S), format='csc'),
+            np.zeros(n),
+            constraints,
+            self._lower,
+            self._upper,
+            **SOLVER_SETTINGS
+        )
+
+    def solve(self, target_return):
+        """Веса портфеля минимального риска для целевой доходности (None, если решения нет)."""
+        self._lower[1] = float(target_return)
+        self.solver.update(l=self._lower)
+        result = self.solver.solve()
+        if result.info.status not in ('solved', 'solved inaccurate'):
+            logger.warning(f"Skipped frontier point due to: solver status {result.info.status}")
+            return None
+        return np.array(result.x)
+
+    def performance(self, weights):
+        return float(self.mu @ weights), float(np.sqrt(max(weights @ self.S @ weights, 0.0)))
+
+    def sweep(self, target_returns, progress=None):
+        """Решения для последовательности целевых доходностей: список (доходность, риск, веса).
+
+        progress(completed, total) вызывается после каждой точки.
+        """
+        points = []
+        for index, target_return in enumerate(target_returns, 1):
+            weights = self.solve(target_return)
+            if progress is not None:
+                progress(index, len(target_returns))
+            if weights is None:
+                continue
+            expected_return, risk = self.performance(weights)
+            points.append((expected_return, risk, weights))
+        return points
+
+
+def efficient_frontier(mu, S, points=10, method='qp', progress=None):
+    """Точки эффективной границы от min(μ) до max(μ).
+
+    method='qp' решает QP с тёплым стартом, 'cla' и 'closed_form' строят
+    границу аналитически (см. analytic_frontier).
+    """
+    target_returns = np.linspace(min(mu), max(mu), points)
+    if method == 'qp':
+        return FrontierEngine(mu, S).sweep(target_returns, progress)
+    return analytic_frontier(mu, S, method).frontier(target_returns, progress)
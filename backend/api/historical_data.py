@@ -1,24 +1,85 @@
 import requests
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlsplit
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
+BOARDS = {
+    'shares': 'TQBR',
+    'bonds': 'TQCB',
+    'etf': 'TQTD',
+}
+
+REQUEST_TIMEOUT = getattr(settings, 'MOEX_REQUEST_TIMEOUT', 10)
+MAX_CONNECTIONS = getattr(settings, 'MOEX_MAX_CONNECTIONS', 10)
+MAX_WORKERS = getattr(settings, 'MOEX_MAX_WORKERS', 8)
+RATE_LIMIT = getattr(settings, 'MOEX_RATE_LIMIT', 20)
+PAGE_PREFETCH = getattr(settings, 'MOEX_PAGE_PREFETCH', 4)
+
+
+class HostRateLimiter:
+    """Ограничение частоты запросов к одному хосту (не более rate запросов в секунду)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+_session = None
+_page_executor = None
+_session_lock = threading.Lock()
+_rate_limiter = HostRateLimiter(RATE_LIMIT)
+
+
+def get_session():
+    """Общая keep-alive сессия с пулом соединений к ISS MOEX."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def iss_get(url, params=None):
+    """GET-запрос к ISS через общую сессию с таймаутом и ограничением частоты."""
+    _rate_limiter.wait(urlsplit(url).netloc)
+    response = get_session().get(url, params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
 def fetch_current_price(ticker, instrument_type='shares'):
-    boards = {
-        'shares': 'TQBR',
-        'bonds': 'TQCB',
-        'etf': 'TQTD',
-    }
-    board = boards.get(instrument_type, 'TQBR')
+    board = BOARDS.get(instrument_type, 'TQBR')
     logger.info(f"Fetching current price for {ticker} (type: {instrument_type})")
     logger.info(f"Trying board {board} for {ticker}")
 
     url = f"https://iss.moex.com/iss/engines/stock/markets/{instrument_type}/boards/{board}/securities/{ticker}.json"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = iss_get(url)
         market_data = data.get('marketdata', {}).get('data', [])
         if not market_data:
             logger.warning(f"No market data for {ticker} on {board}")
@@ -35,46 +96,139 @@ def fetch_current_price(ticker, instrument_type='shares'):
         logger.error(f"Failed to fetch current price for {ticker}: {str(e)}")
         return None
 
+def _parse_history_rows(ticker, block):
+    columns = block.get('columns', [])
+    date_idx = columns.index('TRADEDATE') if 'TRADEDATE' in columns else 0
+    price_idx = columns.index('CLOSE') if 'CLOSE' in columns else 3
+
+    historical_prices = []
+    for row in block.get('data', []):
+        try:
+            date_str = row[date_idx]
+            price = row[price_idx]
+            if not date_str or price is None:
+                continue
+
+            date = datetime.strptime(date_str, '%Y-%m-%d').date()
+            if price > 0:
+                historical_prices.append({
+                    'date': date,
+                    'price': float(price)
+                })
+        except (ValueError, IndexError) as e:
+            logger.warning(f"Skipping invalid historical data for {ticker}: {str(e)}")
+            continue
+    return historical_prices
+
+
+def _parse_history_cursor(data):
+    cursor = data.get('history.cursor', {})
+    columns = cursor.get('columns', [])
+    rows = cursor.get('data', [])
+    if not rows or 'TOTAL' not in columns or 'PAGESIZE' not in columns:
+        return None, None
+    row = rows[0]
+    return row[columns.index('TOTAL')], row[columns.index('PAGESIZE')]
+
+
+def _get_page_executor():
+    global _page_executor
+    if _page_executor is None:
+        with _session_lock:
+            if _page_executor is None:
+                _page_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='moex-pages')
+    return _page_executor
+
+
+def iter_historical_price_pages(ticker, start_date, end_date, instrument_type='shares'):
+    """Постраничная загрузка истории цен по курсору history.cursor.
+
+    Генератор отдаёт разобранные строки страница за страницей. Следующие
+    страницы запрашиваются заранее (не более PAGE_PREFETCH одновременно),
+    поэтому в памяти держится лишь ограниченное число страниц.
+    """
+    board = BOARDS.get(instrument_type, 'TQBR')
+    url = f"https://iss.moex.com/iss/history/engines/stock/markets/{instrument_type}/boards/{board}/securities/{ticker}.json"
+    params = {'from': str(start_date), 'till': str(end_date)}
+
+    data = iss_get(url, params={**params, 'start': 0})
+    first_page = data.get('history', {})
+    yield _parse_history_rows(ticker, first_page)
+
+    total, page_size = _parse_history_cursor(data)
+    if not total or not page_size:
+        return
+
+    offsets = iter(range(page_size, total, page_size))
+    executor = _get_page_executor()
+    pending = deque()
+    try:
+        for offset in offsets:
+            pending.append(executor.submit(iss_get, url, {**params, 'start': offset}))
+            if len(pending) >= PAGE_PREFETCH:
+                break
+        while pending:
+            page = pending.popleft().result()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append(executor.submit(iss_get, url, {**params, 'start': next_offset}))
+            yield _parse_history_rows(ticker, page.get('history', {}))
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_historical_prices(ticker, start_date, end_date, instrument_type='shares'):
+    """Строки истории цен подряд по всем страницам (для потоковой записи в БД)."""
+    for page in iter_historical_price_pages(ticker, start_date, end_date, instrument_type):
+        yield from page
+
+
 def fetch_historical_prices(ticker, start_date, end_date, instrument_type='shares'):
-    boards = {
-        'shares': 'TQBR',
-        'bonds': 'TQCB',
-        'etf': 'TQTD',
-    }
-    board = boards.get(instrument_type, 'TQBR')
+    board = BOARDS.get(instrument_type, 'TQBR')
     logger.info(f"Fetching historical prices for {ticker} from {start_date} to {end_date}")
     logger.info(f"Trying board {board} for historical prices of {ticker}")
 
-    url = f"https://iss.moex.com/iss/history/engines/stock/markets/{instrument_type}/boards/{board}/securities/{ticker}.json?from={start_date}&till={end_date}"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        history_data = data.get('history', {}).get('data', [])
-        if not history_data:
+        historical_prices = list(iter_historical_prices(ticker, start_date, end_date, instrument_type))
+        if not historical_prices:
             logger.warning(f"No historical data for {ticker} on {board}")
             return []
 
-        historical_prices = []
-        for row in history_data:
-            try:
-                date_str = row[0] 
-                price = row[3]
-                if not date_str or price is None:
-                    continue
-
-                date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                if price > 0:
-                    historical_prices.append({
-                        'date': date,
-                        'price': float(price)
-                    })
-            except (ValueError, IndexError) as e:
-                logger.warning(f"Skipping invalid historical data for {ticker}: {str(e)}")
-                continue
-
         logger.info(f"Fetched {len(historical_prices)} historical prices for {ticker} on {board}")
         return historical_prices
     except requests.RequestException as e:
         logger.error(f"Failed to fetch historical prices for {ticker}: {str(e)}")
-        return []
\ No newline at end of file
+        return []
+
+
+def _fetch_many(fetch, tickers, instrument_types, *args):
+    workers = max(1, min(MAX_WORKERS, len(tickers)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='moex-fetch') as executor:
+        futures = {
+            ticker: executor.submit(fetch, ticker, *args, instrument_types.get(ticker, 'shares'))
+            for ticker in tickers
+        }
+        return {ticker: future.result() for ticker, future in futures.items()}
+
+
+def fetch_current_prices_many(tickers, instrument_types=None):
+    """Параллельная загрузка текущих цен: {тикер: цена или None}."""
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return {}
+    logger.info(f"Fetching current prices for {len(tickers)} tickers")
+    return _fetch_many(fetch_current_price, tickers, instrument_types or {})
+
+
+def fetch_historical_prices_many(tickers, start_date, end_date, instrument_types=None):
+    """Параллельная загрузка исторических цен для нескольких тикеров.
+
+    Возвращает словарь {тикер: список цен}. instrument_types — необязательный
+    словарь {тикер: тип инструмента}, по умолчанию 'shares'.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return {}
+    logger.info(f"Fetching historical prices for {len(tickers)} tickers from {start_date} to {end_date}")
+    return _fetch_many(fetch_historical_prices, tickers, instrument_types or {}, start_date, end_date)
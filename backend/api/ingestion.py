@@ -0,0 +1,91 @@
+import logging
+import requests
+from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from . import table_versions
+from .historical_data import fetch_current_prices_many, iter_historical_prices
+from .models import Asset
+from .price_store import save_historical_prices
+
+logger = logging.getLogger(__name__)
+
+LOOKBACK_DAYS = 180
+
+
+def refresh_current_prices(assets):
+    """Обновляет Asset.current_price для всех активов одним пакетом запросов."""
+    prices = fetch_current_prices_many(
+        [asset.ticker for asset in assets],
+        {asset.ticker: asset.instrument_type for asset in assets},
+    )
+    updated = []
+    now = timezone.now()
+    for asset in assets:
+        price = prices.get(asset.ticker)
+        if price is not None and price > 0:
+            asset.current_price = float(price)
+            asset.price_updated_at = now
+            updated.append(asset)
+    if updated:
+        with transaction.atomic():
+            Asset.objects.bulk_update(updated, ['current_price', 'price_updated_at'])
+            table_versions.bump(table_versions.ASSETS)
+    logger.info(f"Refreshed current prices for {len(updated)} of {len(assets)} assets")
+    return len(updated)
+
+
+def load_history(asset, start_date, end_date, instrument_type=None):
+    """Загружает историю актива из ISS и пишет её в БД по мере получения страниц.
+
+    Строки идут из генератора страниц прямо в save_historical_prices пакетами,
+    поэтому память не зависит от длины истории. При сетевой ошибке транзакция
+    актива откатывается и возвращается None.
+    """
+    rows = iter_historical_prices(asset.ticker, start_date, end_date, instrument_type or asset.instrument_type)
+    try:
+        return save_historical_prices(asset, rows)
+    except requests.RequestException as e:
+        logger.error(f"Failed to load historical prices for {asset.ticker}: {str(e)}")
+        return None
+
+
+def refresh_historical_prices(assets, lookback_days=LOOKBACK_DAYS):
+    """Догружает только недостающие последние дни истории по каждому активу.
+
+    Каждый актив пишется в своей транзакции потоком страниц (load_history).
+    """
+    today = datetime.now().date()
+    last_dates = dict(
+        Asset.objects.filter(pk__in=[asset.pk for asset in assets])
+        .annotate(last_date=Max('historical_prices__date'))
+        .values_list('pk', 'last_date')
+    )
+
+    counts = {'inserted': 0, 'updated': 0}
+    loaded = 0
+    for asset in assets:
+        last_date = last_dates.get(asset.pk)
+        start_date = last_date + timedelta(days=1) if last_date else today - timedelta(days=lookback_days)
+        if start_date > today:
+            continue
+        saved = load_history(asset, start_date, today)
+        if saved is None:
+            continue
+        loaded += 1 if saved['inserted'] or saved['updated'] else 0
+        counts = {key: counts[key] + saved[key] for key in counts}
+
+    logger.info(f"Appended history for {loaded} assets: {counts['inserted']} new rows")
+    return counts
+
+
+def run_ingestion_cycle(lookback_days=LOOKBACK_DAYS):
+    """Один цикл фонового обновления рыночных данных для всех отслеживаемых активов."""
+    assets = list(Asset.objects.all())
+    if not assets:
+        logger.info("No tracked assets, skipping ingestion cycle")
+        return {'assets': 0, 'prices': 0, 'inserted': 0, 'updated': 0}
+    prices = refresh_current_prices(assets)
+    counts = refresh_historical_prices(assets, lookback_days=lookback_days)
+    return {'assets': len(assets), 'prices': prices, **counts}
@@ -0,0 +1,95 @@
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import OptimizationJob
+
+logger = logging.getLogger(__name__)
+
+# Задача в статусе running без обновлений дольше этого срока считается брошенной
+# (воркер упал) и снова попадает в очередь
+STALE_AFTER = getattr(settings, 'OPTIMIZATION_JOB_STALE_AFTER', 600)
+PROGRESS_INTERVAL = 0.5
+
+
+def create_job(params):
+    job = OptimizationJob.objects.create(params=params)
+    logger.info(f"Queued optimization job {job.id}")
+    return job
+
+
+def claim_next_job():
+    """Забирает самую старую задачу из очереди; None, если очередь пуста.
+
+    Захват — условный UPDATE по статусу и времени изменения, поэтому несколько
+    воркеров не возьмут одну задачу даже на SQLite без блокировок строк.
+    """
+    while True:
+        stale_before = timezone.now() - timedelta(seconds=STALE_AFTER)
+        job = (
+            OptimizationJob.objects.filter(status=OptimizationJob.PENDING).order_by('created_at').first()
+            or OptimizationJob.objects.filter(status=OptimizationJob.RUNNING, updated_at__lt=stale_before)
+            .order_by('created_at').first()
+        )
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = OptimizationJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(
+            status=OptimizationJob.RUNNING, started_at=now, updated_at=now, progress=0
+        )
+        if claimed:
+            if job.status == OptimizationJob.RUNNING:
+                logger.warning(f"Requeued stale optimization job {job.id}")
+            job.refresh_from_db()
+            return job
+
+
+class ProgressReporter:
+    """Колбэк progress(completed, total): пишет прогресс в БД не чаще PROGRESS_INTERVAL секунд."""
+
+    def __init__(self, job):
+        self.job = job
+        self.last_write = 0.0
+
+    def __call__(self, completed, total):
+        now = time.monotonic()
+        if completed < total and now - self.last_write < PROGRESS_INTERVAL:
+            return
+        self.last_write = now
+        OptimizationJob.objects.filter(pk=self.job.pk).update(
+            progress=completed, progress_total=total, updated_at=timezone.now()
+        )
+
+
+def finish_job(job, result):
+    job.refresh_from_db(fields=['progress_total'])
+    job.status = OptimizationJob.DONE
+    job.result = result
+    job.progress = job.progress_total = max(job.progress_total, 1)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'progress', 'progress_total', 'finished_at', 'updated_at'])
+
+
+def fail_job(job, error):
+    job.status = OptimizationJob.FAILED
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+
+
+def job_payload(job):
+    """Состояние задачи в формате ответа /api/jobs/<id>/."""
+    payload = {
+        'job_id': str(job.id),
+        'status': job.status,
+        'progress': {'completed': job.progress, 'total': job.progress_total},
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+    if job.status == OptimizationJob.DONE:
+        payload['result'] = job.result
+    elif job.status == OptimizationJob.FAILED:
+        payload['error'] = job.error
+    return payload
@@ -0,0 +1,79 @@
+import json
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from api.backtesting import BACKTEST_COST_BPS, BACKTEST_LOOKBACK, BACKTEST_REBALANCE_EVERY, run_backtest
+from api.optimization_service import FRONTIER_METHODS, MODELS, normalize_ticker, resolve_tickers
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _instrument_type(value):
+    ticker, _, instrument_type = value.partition('=')
+    if instrument_type not in ('shares', 'bonds', 'etf'):
+        raise ValueError(value)
+    return normalize_ticker(ticker), instrument_type
+
+
+class Command(BaseCommand):
+    help = 'Бэктест моделей оптимизации со скользящим окном по сохранённым историческим ценам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tickers', nargs='+', help='Тикеры портфеля.')
+        parser.add_argument(
+            '--model', action='append', choices=MODELS,
+            help='Модель оптимизации; можно указать несколько раз. По умолчанию — все модели.',
+        )
+        parser.add_argument('--lookback', type=int, default=BACKTEST_LOOKBACK, help='Окно оценки, торговых дней.')
+        parser.add_argument(
+            '--rebalance-every', type=int, default=BACKTEST_REBALANCE_EVERY, help='Период ребалансировки, торговых дней.'
+        )
+        parser.add_argument('--cost-bps', type=float, default=BACKTEST_COST_BPS, help='Издержки, б.п. от оборота.')
+        parser.add_argument('--target-return', type=float, default=0.1)
+        parser.add_argument('--risk-level', type=float, default=0.02)
+        parser.add_argument('--sortino-l', type=float, default=0.0, help='Порог доходности для коэффициента Сортино.')
+        parser.add_argument(
+            '--type', dest='instrument_types', action='append', type=_instrument_type, default=[],
+            metavar='TICKER=TYPE',
+            help='Тип инструмента (shares, bonds, etf), если он отличается от определённого по тикеру.',
+        )
+        parser.add_argument('--method', choices=FRONTIER_METHODS, default='qp')
+        parser.add_argument('--from', dest='start_date', type=_date, help='Начало истории, YYYY-MM-DD.')
+        parser.add_argument('--till', dest='end_date', type=_date, help='Конец истории, YYYY-MM-DD.')
+        parser.add_argument('--output', help='Сохранить полный результат (NAV, ребалансировки) в JSON-файл.')
+
+    def handle(self, *args, **options):
+        tickers, ticker_types = resolve_tickers(options['tickers'], [])
+        ticker_types.update(options['instrument_types'])
+        results = {}
+        for model in options['model'] or MODELS:
+            try:
+                results[model] = run_backtest(
+                    tickers,
+                    options['start_date'],
+                    options['end_date'],
+                    ticker_types,
+                    model=model,
+                    lookback=options['lookback'],
+                    rebalance_every=options['rebalance_every'],
+                    cost_bps=options['cost_bps'],
+                    target_return=options['target_return'],
+                    risk_level=options['risk_level'],
+                    sortino_l=options['sortino_l'],
+                    method=options['method'],
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+            summary = results[model]['summary']
+            self.stdout.write(
+                f"{model}: total return {summary['total_return'] * 100:.2f}%, "
+                f"annualized {summary['annualized_return'] * 100:.2f}%, "
+                f"volatility {summary['volatility'] * 100:.2f}%, "
+                f"max drawdown {summary['max_drawdown'] * 100:.2f}%, "
+                f"turnover {summary['turnover']:.2f}, costs {summary['costs'] * 100:.3f}%"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, ensure_ascii=False)
+            self.stdout.write(f"Saved backtest results to {options['output']}")
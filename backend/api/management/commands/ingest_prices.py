@@ -0,0 +1,49 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from api.ingestion import LOOKBACK_DAYS, run_ingestion_cycle
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Фоновое обновление текущих и исторических цен MOEX для всех отслеживаемых активов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=getattr(settings, 'PRICE_INGEST_INTERVAL', 900),
+            help='Пауза между циклами обновления, в секундах.',
+        )
+        parser.add_argument(
+            '--lookback-days',
+            type=int,
+            default=LOOKBACK_DAYS,
+            help='Глубина истории для активов, по которым ещё нет цен.',
+        )
+        parser.add_argument('--once', action='store_true', help='Выполнить один цикл и завершиться.')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            started = time.monotonic()
+            try:
+                summary = run_ingestion_cycle(lookback_days=options['lookback_days'])
+                self.stdout.write(
+                    f"Ingested {summary['assets']} assets: {summary['prices']} prices refreshed, "
+                    f"{summary['inserted']} history rows added, {summary['updated']} updated"
+                )
+            except Exception as e:
+                logger.error(f"Ingestion cycle failed: {str(e)}")
+                if options['once']:
+                    raise
+
+            if options['once']:
+                return
+            try:
+                time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
+            except KeyboardInterrupt:
+                return
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.return_moments import rebuild_return_moments
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчёт накопленных статистик доходностей по всей истории цен.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rows = rebuild_return_moments()
+        self.stdout.write(f"Rebuilt return moments: {rows} rows")
@@ -0,0 +1,69 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from api.jobs import ProgressReporter, claim_next_job, fail_job, finish_job
+from api.models import Asset
+from api.optimization_service import OptimizationError, build_optimization_result
+
+logger = logging.getLogger(__name__)
+
+
+def run_job(job):
+    params = job.params
+    assets = Asset.objects.filter(ticker__in=params['tickers'])
+    try:
+        result = build_optimization_result(
+            assets,
+            params['ticker_types'],
+            params['current_portfolio'],
+            params['model'],
+            params['target_return'],
+            params['risk_level'],
+            params['sortino_l'],
+            params['frontier_points'],
+            params['method'],
+            params.get('cov_estimator', 'sample'),
+            progress=ProgressReporter(job),
+        )
+    except OptimizationError as e:
+        fail_job(job, str(e))
+        return False
+    except Exception as e:
+        logger.error(f"Optimization job {job.id} failed: {str(e)}")
+        fail_job(job, f'Server error: {str(e)}')
+        return False
+    finish_job(job, result)
+    return True
+
+
+class Command(BaseCommand):
+    help = 'Воркер фоновых задач оптимизации (/api/optimize/ с async=true).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Пауза между проверками пустой очереди, в секундах.',
+        )
+        parser.add_argument('--once', action='store_true', help='Выполнить все задачи из очереди и завершиться.')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = claim_next_job()
+            if job is not None:
+                started = time.monotonic()
+                ok = run_job(job)
+                self.stdout.write(
+                    f"Job {job.id} {'done' if ok else 'failed'} in {time.monotonic() - started:.2f}s"
+                )
+                continue
+
+            if options['once']:
+                return
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                return
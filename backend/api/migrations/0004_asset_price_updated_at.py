@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_asset_buy_price_asset_quantity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='price_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
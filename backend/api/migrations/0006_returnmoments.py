@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_optimizationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReturnMoments',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('sum_i', models.FloatField(default=0.0)),
+                ('sum_j', models.FloatField(default=0.0)),
+                ('sum_ij', models.FloatField(default=0.0)),
+                ('sum_log', models.FloatField(default=0.0)),
+                ('asset_i', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.asset')),
+                ('asset_j', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.asset')),
+            ],
+            options={
+                'unique_together': {('asset_i', 'asset_j', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_tableversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='lot_size',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
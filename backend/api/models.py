@@ -1,11 +1,14 @@
+import uuid
 from django.db import models
 
 class Asset(models.Model):
     ticker = models.CharField(max_length=20, unique=True)
     name = models.CharField(max_length=100)
     current_price = models.FloatField(default=0.0)
+    price_updated_at = models.DateTimeField(null=True, blank=True)
     buy_price = models.FloatField(default=0.0)
     quantity = models.IntegerField(default=0) 
+    lot_size = models.PositiveIntegerField(default=1)
     instrument_type = models.CharField(
         max_length=10,
         choices=[
@@ -28,4 +31,69 @@ class HistoricalPrice(models.Model):
         unique_together = ('asset', 'date')
 
     def __str__(self):
-        return f"{self.asset.ticker} - {self.date}"
\ No newline at end of file
+        return f"{self.asset.ticker} - {self.date}"
+
+class TableVersion(models.Model):
+    """Счётчик изменений таблицы: источник дешёвых ETag и Last-Modified."""
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} - {self.version}"
+
+class ReturnMoments(models.Model):
+    """Накопленные суммы дневных доходностей пары активов по дату включительно.
+
+    Суммы по окну (d0, d1] — разность строк на d1 и d0, поэтому среднее и
+    ковариация любой корзины собираются без чтения истории цен. Для asset_i ==
+    asset_j строка хранит статистики одного актива, sum_log — сумма log(1 + r).
+    """
+    asset_i = models.ForeignKey(Asset, related_name='+', on_delete=models.CASCADE)
+    asset_j = models.ForeignKey(Asset, related_name='+', on_delete=models.CASCADE)
+    date = models.DateField()
+    count = models.IntegerField(default=0)
+    sum_i = models.FloatField(default=0.0)
+    sum_j = models.FloatField(default=0.0)
+    sum_ij = models.FloatField(default=0.0)
+    sum_log = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = ('asset_i', 'asset_j', 'date')
+
+    def __str__(self):
+        return f"{self.asset_i_id}/{self.asset_j_id} - {self.date}"
+
+class OptimizationJob(models.Model):
+    """Фоновая задача оптимизации; выполняется командой manage.py run_optimization_jobs."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(
+        max_length=10,
+        choices=[
+            (PENDING, 'Pending'),
+            (RUNNING, 'Running'),
+            (DONE, 'Done'),
+            (FAILED, 'Failed'),
+        ],
+        default=PENDING
+    )
+    params = models.JSONField()
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    progress = models.IntegerField(default=0)
+    progress_total = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.id} - {self.status}"
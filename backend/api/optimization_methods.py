@@ -1,11 +1,25 @@
+from collections import OrderedDict
 import numpy as np
+import osqp
 import pandas as pd
 from pypfopt import EfficientFrontier
-from scipy.optimize import minimize
+import scipy.sparse as sp
+from scipy.optimize import linprog
+from .analytic_frontier import analytic_frontier
+from .frontier import SOLVER_SETTINGS, efficient_frontier
 
-def optimize_markowitz(mu, S, target_return=0.1):
+# qp — численное решение pypfopt; cla — точная граница без коротких позиций;
+# closed_form — граница в замкнутой форме без ограничения на знак весов
+FRONTIER_METHODS = ['qp', 'cla', 'closed_form']
+
+def _frontier_optimizer(mu, S, method):
+    if method == 'qp':
+        return EfficientFrontier(mu, S)
+    return analytic_frontier(mu, S, method)
+
+def optimize_markowitz(mu, S, target_return=0.1, method='qp'):
     """Оптимизация по модели Марковица (минимизация риска при заданной доходности)."""
-    ef = EfficientFrontier(mu, S)
+    ef = _frontier_optimizer(mu, S, method)
     if target_return > 0:
         weights = ef.efficient_return(target_return)
     else:
@@ -14,87 +28,308 @@ def optimize_markowitz(mu, S, target_return=0.1):
     performance = ef.portfolio_performance(risk_free_rate=0.02)
     return cleaned_weights, performance
 
-def optimize_sharpe(mu, S, risk_free_rate=0.02):
+def optimize_sharpe(mu, S, risk_free_rate=0.02, method='qp'):
     """Оптимизация по максимальному коэффициенту Шарпа."""
-    ef = EfficientFrontier(mu, S)
+    ef = _frontier_optimizer(mu, S, method)
     weights = ef.max_sharpe(risk_free_rate=risk_free_rate)
     cleaned_weights = ef.clean_weights()
     performance = ef.portfolio_performance(risk_free_rate=risk_free_rate)
     return cleaned_weights, performance
 
+def _clean_weights(tickers, weights, cutoff=1e-4, rounding=5):
+    """Обнуление малых весов и округление, как в pypfopt clean_weights."""
+    weights = np.where(np.abs(weights) < cutoff, 0.0, weights)
+    return OrderedDict(zip(tickers, np.round(weights, rounding)))
+
+def _scenario_returns(mu, returns_df):
+    return returns_df.reindex(columns=mu.index).fillna(0.0).to_numpy(dtype=float)
+
+def _max_sortino_qp(returns, risk_free_rate=0.02, L=0.0):
+    """Веса с максимальным коэффициентом Сортино по сценариям доходностей.
+
+    После замены Чарнса–Купера y = κw задача сводится к разреженной QP:
+    min (1/T)·Σd_t² при d_t ≥ Lκ - r_t·y, d ≥ 0, (r̄ - rf/252)·y = 1,
+    Σy = κ, y ≥ 0. Размер задачи растёт линейно по числу наблюдений T.
+    """
+    T, n = returns.shape
+    excess = returns.mean(axis=0) - risk_free_rate / 252
+    if excess.max() <= 0:
+        raise ValueError("at least one of the assets must have an expected return exceeding the risk-free rate")
+
+    # Переменные: y (n), κ (1), d (T)
+    P = sp.block_diag([sp.csc_matrix((n + 1, n + 1)), sp.identity(T) * (2.0 / T)], format='csc')
+    A = sp.vstack([
+        sp.hstack([sp.csr_matrix(excess.reshape(1, -1)), sp.csr_matrix((1, 1 + T))]),
+        sp.hstack([sp.csr_matrix(np.ones((1, n))), sp.csr_matrix([[-1.0]]), sp.csr_matrix((1, T))]),
+        sp.hstack([sp.csr_matrix(returns), sp.csr_matrix(np.full((T, 1), -L)), sp.identity(T)]),
+        sp.identity(n + 1 + T),
+    ], format='csc')
+    lower = np.concatenate([[1.0, 0.0], np.zeros(T), np.zeros(n + 1 + T)])
+    upper = np.concatenate([[1.0, 0.0], np.full(T, np.inf), np.full(n + 1 + T, np.inf)])
+
+    solver = osqp.OSQP()
+    solver.setup(P, np.zeros(n + 1 + T), A, lower, upper, **SOLVER_SETTINGS)
+    result = solver.solve()
+    if result.info.status not in ('solved', 'solved inaccurate'):
+        raise ValueError(f"Sortino optimization failed: {result.info.status}")
+    y, kappa = result.x[:n], result.x[n]
+    if kappa <= 0:
+        raise ValueError("Sortino optimization failed: degenerate solution")
+    weights = np.clip(y / kappa, 0, None)
+    return weights / weights.sum()
+
+def _cvar_constraints(returns, beta):
+    """Ограничения CVaR по Рокафеллару–Урясеву для переменных (y, κ, ζ, u)."""
+    T, n = returns.shape
+    # -r_t·y - ζ - u_t <= 0
+    A_ub = sp.hstack([
+        sp.csr_matrix(-returns),
+        sp.csr_matrix((T, 1)),
+        sp.csr_matrix(-np.ones((T, 1))),
+        -sp.identity(T),
+    ], format='csr')
+    # ζ + Σu_t / (βT) <= 1
+    A_cvar = sp.hstack([
+        sp.csr_matrix((1, n + 1)),
+        sp.csr_matrix([[1.0]]),
+        sp.csr_matrix(np.full((1, T), 1.0 / (beta * T))),
+    ], format='csr')
+    return sp.vstack([A_ub, A_cvar], format='csr'), np.concatenate([np.zeros(T), [1.0]])
+
+def _max_rachev_lp(returns, alpha=0.05, beta=0.05, max_iter=20):
+    """Веса с максимальным коэффициентом Рачева ETR_α / ETL_β по сценариям.
+
+    Средняя доходность лучших α·T сценариев выпукла по весам, поэтому на
+    каждой итерации она заменяется линейной минорантой (средним по текущему
+    набору лучших сценариев), и отношение к CVaR_β потерь максимизируется
+    разреженной ЛП (замена Чарнса–Купера). Отношение не убывает по итерациям;
+    расчёт останавливается, когда набор лучших сценариев перестаёт меняться.
+    Если у какого-то портфеля нет хвоста потерь (CVaR_β ≤ 0), ЛП неограничена
+    и отношение не определено; тогда среди таких портфелей тем же способом
+    выбирается портфель с наибольшей ETR_α.
+    """
+    T, n = returns.shape
+    tail = max(1, int(np.ceil(alpha * T)))
+    A_ub, b_ub = _cvar_constraints(returns, beta)
+    # Σy - κ = 0
+    A_eq = sp.hstack([sp.csr_matrix(np.ones((1, n))), sp.csr_matrix([[-1.0]]), sp.csr_matrix((1, 1 + T))], format='csr')
+    bounds = [(0, None)] * (n + 1) + [(None, None)] + [(0, None)] * T
+
+    weights = np.full(n, 1.0 / n)
+    best_set = None
+    no_loss_tail = False
+    for _ in range(max_iter):
+        top_set = np.sort(np.argpartition(returns @ weights, -tail)[-tail:])
+        if best_set is not None and np.array_equal(top_set, best_set):
+            break
+        best_set = top_set
+        c = np.zeros(n + 2 + T)
+        c[:n] = -returns[top_set].mean(axis=0)
+        result = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=[0.0], bounds=bounds, method='highs')
+        if result.status == 3 and not no_loss_tail:
+            # Есть портфель без хвоста потерь: дальше максимизируется ETR при Σw = 1 и CVaR_β ≤ 0
+            no_loss_tail = True
+            bounds[n] = (1.0, 1.0)
+            b_ub = np.concatenate([b_ub[:-1], [0.0]])
+            result = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=[0.0], bounds=bounds, method='highs')
+        if result.status != 0:
+            raise ValueError(f"Rachev optimization failed: {result.message}")
+        y, kappa = result.x[:n], result.x[n]
+        if kappa <= 0:
+            break
+        weights = y / kappa
+    return weights / weights.sum()
+
+def _rachev_ratio(portfolio_returns, alpha=0.05, beta=0.05):
+    ordered = np.sort(portfolio_returns)
+    T = len(ordered)
+    reward = ordered[-max(1, int(np.ceil(alpha * T))):].mean()
+    loss = -ordered[:max(1, int(np.ceil(beta * T)))].mean()
+    return reward / loss if loss > 0 else 0
+
+def _rachev_ratios(portfolio_returns, observations, alpha=0.05, beta=0.05):
+    """_rachev_ratio для каждого столбца T × K с пропусками NaN (та же мера, что в _max_rachev_lp)."""
+    # NaN сортируются в конец столбца, поэтому хвосты берутся из первых observations строк
+    ordered = np.sort(portfolio_returns, axis=0)
+    sums = np.vstack([np.zeros((1, ordered.shape[1])), np.cumsum(np.nan_to_num(ordered), axis=0)])
+    top = np.maximum(1, np.ceil(alpha * observations)).astype(int)
+    bottom = np.maximum(1, np.ceil(beta * observations)).astype(int)
+    rows = np.vstack([observations, np.maximum(observations - top, 0), np.minimum(bottom, observations)])
+    total, before_top, worst = np.take_along_axis(sums, rows, axis=0)
+    reward = (total - before_top) / top
+    loss = -worst / bottom
+    return np.divide(reward, loss, out=np.zeros_like(loss), where=loss > 0)
+
 def optimize_sortino(mu, S, returns_df, risk_free_rate=0.02, L=0.0):
-    """Оптимизация по максимальному коэффициенту Сортино (приближение)."""
-    ef = EfficientFrontier(mu, S)
-    weights = ef.max_sharpe(risk_free_rate=risk_free_rate)  # Приближение
-    cleaned_weights = ef.clean_weights()
-    downside_returns = returns_df[returns_df < L].dropna()
-    downside_risk = np.sqrt(np.mean(downside_returns ** 2)) * np.sqrt(252) if not downside_returns.empty else 0
-    portfolio_returns = returns_df @ [cleaned_weights.get(t, 0) for t in returns_df.columns]
+    """Оптимизация по максимальному коэффициенту Сортино."""
+    returns = _scenario_returns(mu, returns_df)
+    cleaned_weights = _clean_weights(mu.index, _max_sortino_qp(returns, risk_free_rate, L))
+    portfolio_returns = returns @ np.array(list(cleaned_weights.values()))
+    downside_risk = np.sqrt(np.mean(np.minimum(portfolio_returns - L, 0) ** 2)) * np.sqrt(252)
     annualized_return = np.mean(portfolio_returns) * 252
     sortino_ratio = (annualized_return - risk_free_rate) / downside_risk if downside_risk > 0 else 0
     return cleaned_weights, (annualized_return / 100, np.std(portfolio_returns) * np.sqrt(252), sortino_ratio)
 
-def optimize_rachev(mu, S, returns_df, risk_free_rate=0.02):
-    """Оптимизация по максимальному коэффициенту Рачева (приближение)."""
-    ef = EfficientFrontier(mu, S)
-    weights = ef.max_sharpe(risk_free_rate=risk_free_rate)  # Приближение
-    cleaned_weights = ef.clean_weights()
-    portfolio_returns = returns_df @ [cleaned_weights.get(t, 0) for t in returns_df.columns]
-    cvar_positive = -np.percentile(portfolio_returns, 95) * np.sqrt(252)
-    cvar_negative = np.percentile(portfolio_returns, 5) * np.sqrt(252)
-    rachev_ratio = cvar_positive / cvar_negative if cvar_negative > 0 else 0
+def optimize_rachev(mu, S, returns_df, risk_free_rate=0.02, alpha=0.05, beta=0.05):
+    """Оптимизация по максимальному коэффициенту Рачева (ETR_α / CVaR_β)."""
+    returns = _scenario_returns(mu, returns_df)
+    cleaned_weights = _clean_weights(mu.index, _max_rachev_lp(returns, alpha, beta))
+    portfolio_returns = returns @ np.array(list(cleaned_weights.values()))
+    rachev_ratio = _rachev_ratio(portfolio_returns, alpha, beta)
     annualized_return = np.mean(portfolio_returns) * 252
     annualized_volatility = np.std(portfolio_returns) * np.sqrt(252)
     return cleaned_weights, (annualized_return / 100, annualized_volatility, rachev_ratio)
 
+def _max_drawdown_lp(returns):
+    """Веса с минимальной максимальной просадкой (ЛП Чекхлова–Урясева–Забаранкина).
+
+    Просадка считается по накопленной (некомпаундированной) доходности
+    C_t = Σ r_s·w. Переменные: веса w, текущие максимумы u_t и верхняя
+    граница просадки z; все ограничения линейны и разрежены по t.
+    """
+    T, n = returns.shape
+    cumulative = sp.csr_matrix(np.cumsum(returns, axis=0))
+    eye = sp.identity(T, format='csr')
+    # u_{t-1} - u_t <= 0
+    shift = sp.diags([np.ones(T - 1), -np.ones(T - 1)], [0, 1], shape=(T - 1, T), format='csr')
+    zeros_n = sp.csr_matrix((T - 1, n))
+    zeros_z = sp.csr_matrix((T, 1))
+    A_ub = sp.vstack([
+        sp.hstack([cumulative, -eye, zeros_z]),                           # C_t·w - u_t <= 0
+        sp.hstack([zeros_n, shift, sp.csr_matrix((T - 1, 1))]),          # u_{t-1} - u_t <= 0
+        sp.hstack([-cumulative, eye, -sp.csr_matrix(np.ones((T, 1)))]),  # u_t - C_t·w - z <= 0
+    ], format='csr')
+    b_ub = np.zeros(A_ub.shape[0])
+    A_eq = sp.hstack([sp.csr_matrix(np.ones((1, n))), sp.csr_matrix((1, T + 1))], format='csr')
+    c = np.zeros(n + T + 1)
+    c[-1] = 1.0
+    bounds = [(0, 1)] * n + [(0, None)] * T + [(0, None)]
+    result = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=[1.0], bounds=bounds, method='highs')
+    if result.status != 0:
+        raise ValueError(f"Max drawdown optimization failed: {result.message}")
+    return result.x[:n]
+
 def optimize_max_drawdown(mu, S, returns_df):
     """Оптимизация по минимизации максимальной просадки."""
-    def calculate_drawdown(weights):
-        portfolio_returns = returns_df @ weights
-        cum_returns = (1 + portfolio_returns).cumprod()
-        peak = cum_returns.cummax()
-        drawdown = (cum_returns - peak) / peak
-        return drawdown.min()
-
-    initial_weights = np.array([1.0 / len(mu)] * len(mu))
-    bounds = tuple((0, 1) for _ in range(len(mu)))
-    constraints = {'type': 'eq', 'fun': lambda w: np.sum(w) - 1}
-    result = minimize(
-        lambda w: calculate_drawdown(w),
-        initial_weights,
-        method='SLSQP',
-        bounds=bounds,
-        constraints=constraints
-    )
-    weights = {ticker: weight for ticker, weight in zip(mu.index, result.x)}
-    portfolio_returns = returns_df @ result.x
+    returns = _scenario_returns(mu, returns_df)
+    weights_array = _max_drawdown_lp(returns)
+    weights = {ticker: weight for ticker, weight in zip(mu.index, weights_array)}
+    portfolio_returns = returns @ weights_array
     annualized_return = np.mean(portfolio_returns) * 252
     annualized_volatility = np.std(portfolio_returns) * np.sqrt(252)
-    cum_returns = (1 + portfolio_returns).cumprod()
-    peak = cum_returns.cummax()
+    cum_returns = np.cumprod(1 + portfolio_returns)
+    peak = np.maximum.accumulate(cum_returns)
     max_drawdown = ((cum_returns - peak) / peak).min()
     return weights, (annualized_return / 100, annualized_volatility, max_drawdown)
 
+def portfolio_metrics(weights, returns, risk_free_rate=0.02, L=0.0):
+    """Дополнительные метрики сразу для K портфелей.
+
+    weights — матрица весов K × N, returns — доходности T × N (столбцы в том
+    же порядке; пропуски NaN в дни без котировки). Возвращает словарь
+    {метрика: массив длины K}; доходности портфелей считаются одним
+    умножением матриц, остальное — операциями по оси времени.
+    """
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    returns = np.asarray(returns, dtype=float)
+    portfolio_returns = returns @ weights.T
+    valid = ~np.isnan(portfolio_returns)
+    observations = valid.sum(axis=0)
+
+    annualized_return = np.nanmean(portfolio_returns, axis=0) * 252
+    # Нижний частичный момент второго порядка относительно L по всем дням — та же мера, что в _max_sortino_qp
+    shortfall = np.where(valid, np.minimum(portfolio_returns - L, 0.0), 0.0)
+    downside_risk = np.sqrt((shortfall ** 2).sum(axis=0) / np.maximum(observations, 1)) * np.sqrt(252)
+    sortino = np.divide(
+        annualized_return - risk_free_rate, downside_risk, out=np.zeros_like(downside_risk), where=downside_risk > 0
+    )
+
+    rachev = _rachev_ratios(portfolio_returns, observations)
+
+    # Дни без котировки не меняют накопленную доходность
+    cumulative = np.cumprod(1 + np.where(valid, portfolio_returns, 0.0), axis=0)
+    peak = np.maximum.accumulate(cumulative, axis=0)
+    max_drawdown = ((cumulative - peak) / peak).min(axis=0)
+    drawdown = -max_drawdown
+    calmar = np.divide(annualized_return, drawdown, out=np.zeros_like(drawdown), where=drawdown > 0)
+    sterling = np.divide(
+        annualized_return - risk_free_rate, drawdown, out=np.zeros_like(drawdown), where=drawdown > 0
+    )
+    metrics = {
+        'sortino': sortino,
+        'rachev': rachev,
+        'max_drawdown': max_drawdown,
+        'calmar': calmar,
+        'sterling': sterling,
+    }
+    if not observations.all():
+        empty = observations == 0
+        for values in metrics.values():
+            values[empty] = 0.0
+    return metrics
+
 def calculate_additional_metrics(weights, returns_df, risk_free_rate=0.02, L=0.0):
     """Расчёт дополнительных метрик для портфеля."""
-    portfolio_returns = returns_df @ [weights.get(t, 0) for t in returns_df.columns]
-    annualized_return = np.mean(portfolio_returns) * 252
-    annualized_volatility = np.std(portfolio_returns) * np.sqrt(252)
-    downside_returns = portfolio_returns[portfolio_returns < L].dropna()
-    downside_risk = np.sqrt(np.mean(downside_returns ** 2)) * np.sqrt(252) if not downside_returns.empty else 0
-    sortino_ratio = (annualized_return - risk_free_rate) / downside_risk if downside_risk > 0 else 0
-    cvar_positive = -np.percentile(portfolio_returns, 95) * np.sqrt(252)
-    cvar_negative = np.percentile(portfolio_returns, 5) * np.sqrt(252)
-    rachev_ratio = cvar_positive / cvar_negative if cvar_negative > 0 else 0
-    cum_returns = (1 + portfolio_returns).cumprod()
-    peak = cum_returns.cummax()
-    max_drawdown = ((cum_returns - peak) / peak).min()
-    calmar_ratio = annualized_return / (-max_drawdown) if -max_drawdown > 0 else 0
-    sterling_ratio = (annualized_return - risk_free_rate) / (-max_drawdown) if -max_drawdown > 0 else 0
+    metrics = portfolio_metrics(
+        [[weights.get(t, 0) for t in returns_df.columns]], returns_df, risk_free_rate=risk_free_rate, L=L
+    )
+    return {name: float(values[0]) for name, values in metrics.items()}
+
+def solve_model(model, mu, S, returns_df, target_return=0.1, risk_level=0.02, sortino_l=0.0, method='qp'):
+    """Выбор метода оптимизации; возвращает (веса, показатели)."""
+    if model == 'markowitz':
+        return optimize_markowitz(mu, S, target_return, method=method)
+    if model == 'sharpe':
+        return optimize_sharpe(mu, S, risk_free_rate=risk_level, method=method)
+    if model == 'sortino':
+        return optimize_sortino(mu, S, returns_df, risk_free_rate=risk_level, L=sortino_l)
+    if model == 'rachev':
+        return optimize_rachev(mu, S, returns_df, risk_free_rate=risk_level)
+    if model == 'max_drawdown':
+        return optimize_max_drawdown(mu, S, returns_df)
+    raise ValueError("Unknown optimization model")
+
+def build_frontier(mu, S, points=10, method='qp', progress=None, returns_df=None, risk_free_rate=0.02, L=0.0):
+    """Точки эффективной границы (доходность и риск в процентах).
+
+    Если переданы доходности returns_df, каждая точка получает и
+    дополнительные метрики, рассчитанные для всех точек одним вызовом
+    portfolio_metrics.
+    """
+    solutions = efficient_frontier(mu, S, points, method, progress)
+    frontier = [{'return': expected_return * 100, 'risk': risk * 100} for expected_return, risk, _ in solutions]
+    if returns_df is not None and solutions:
+        metrics = portfolio_metrics(
+            np.array([weights for _, _, weights in solutions]),
+            returns_df.reindex(columns=list(mu.index)),
+            risk_free_rate=risk_free_rate,
+            L=L,
+        )
+        for index, point in enumerate(frontier):
+            point['metrics'] = {name: float(values[index]) for name, values in metrics.items()}
+    return frontier
+
+def solve_scenario(mu, S, returns_df, model, target_return=0.1, risk_level=0.02, sortino_l=0.0,
+                   frontier_points=10, method='qp', progress=None):
+    """Оптимизация, дополнительные метрики и эффективная граница для одного набора параметров.
+
+    Функция не обращается к БД, поэтому её можно выполнять в отдельном процессе.
+    progress(completed, total) получает число готовых шагов: решение модели
+    и каждую точку границы.
+    """
+    total = frontier_points + 1
+    weights, performance = solve_model(model, mu, S, returns_df, target_return, risk_level, sortino_l, method)
+    if progress is not None:
+        progress(1, total)
+    cleaned_weights = {k: float(v) for k, v in weights.items()}
+    additional_metrics = calculate_additional_metrics(cleaned_weights, returns_df, risk_free_rate=risk_level, L=sortino_l)
     return {
-        'sortino': sortino_ratio,
-        'rachev': rachev_ratio,
-        'max_drawdown': max_drawdown,
-        'calmar': calmar_ratio,
-        'sterling': sterling_ratio
-    }
\ No newline at end of file
+        'weights': cleaned_weights,
+        'performance': [float(value) for value in performance],
+        'metrics': {name: float(value) for name, value in additional_metrics.items()},
+        'frontier': build_frontier(
+            mu, S, frontier_points, method,
+            progress=(lambda completed, _: progress(completed + 1, total)) if progress is not None else None,
+            returns_df=returns_df, risk_free_rate=risk_level, L=sortino_l,
+        ),
+    }
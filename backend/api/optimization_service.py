@@ -0,0 +1,385 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+import pandas as pd
+from django.conf import settings
+from django.core.cache import caches
+from pypfopt import expected_returns
+from . import executor, simulation
+from .covariance import COV_ESTIMATORS, cached_covariance
+from .historical_data import fetch_historical_prices_many
+from .optimization_methods import FRONTIER_METHODS, solve_scenario
+from .price_store import load_price_matrix, price_data_version, save_historical_prices, save_historical_prices_many
+from .rebalancing import rebalance
+from .return_moments import moments_from_store
+from .simulation import MAX_HORIZON, MAX_PATH_CELLS, SIMULATION_METHODS, SIMULATION_MODES
+
+logger = logging.getLogger(__name__)
+
+# Если цены обновляет фоновый воркер (manage.py ingest_prices), API работает только с локальными данными
+FETCH_ON_REQUEST = getattr(settings, 'MARKET_DATA_FETCH_ON_REQUEST', True)
+
+LOOKBACK_DAYS = 180
+FRONTIER_POINTS = getattr(settings, 'FRONTIER_POINTS', 10)
+MAX_FRONTIER_POINTS = getattr(settings, 'MAX_FRONTIER_POINTS', 300)
+BOND_COUPON_RATE = 0.07
+MODELS = ['markowitz', 'sharpe', 'sortino', 'rachev', 'max_drawdown']
+
+TICKER_MAPPING = {
+    'sberbank': 'SBER',
+    'gazprom': 'GAZP',
+    'lukoil': 'LKOH',
+    'yandex': 'YDEX',
+    'rosneft': 'ROSN',
+    'nornickel': 'GMKN',
+    'tatneft': 'TATN',
+    'novatek': 'NVTK',
+    'ofz26207': 'SU26207RMFS9',
+    'sberbond': 'RU000A0JX0J2',
+    'finamrussia': 'FXRL',
+    'sberetf': 'SBSP',
+}
+
+
+class OptimizationError(Exception):
+    """Ошибка подготовки данных или оптимизации, которую API отдаёт клиенту с кодом 400."""
+
+
+class OptimizationTimeout(OptimizationError):
+    """Расчёт не уложился в OPTIMIZATION_TIMEOUT и был отменён (код 504)."""
+
+
+def _fallback_prices(current_price, days):
+    today = datetime.now().date()
+    factors = [0.99, 1.0, 1.01][:days]
+    return [
+        {'date': today - timedelta(days=2 - offset), 'price': current_price * factor}
+        for offset, factor in enumerate(factors)
+    ]
+
+
+def load_market_data(assets, ticker_types):
+    """Матрица цен и доходностей за последние LOOKBACK_DAYS дней.
+
+    Недостающие истории загружаются из API одним пакетом, а при отсутствии
+    данных подставляются резервные цены.
+    """
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=LOOKBACK_DAYS)
+
+    asset_by_ticker = {asset.ticker: asset for asset in assets}
+    df = load_price_matrix(list(asset_by_ticker), start_date)
+
+    # Недостающие истории загружаем из API одним пакетом, а не по одному тикеру
+    missing_tickers = [ticker for ticker in asset_by_ticker if df[ticker].count() == 0]
+    reload_prices = False
+    if missing_tickers:
+        logger.warning(f"No historical prices for {missing_tickers}, fetching from API")
+        fetched_prices = fetch_historical_prices_many(
+            missing_tickers,
+            start_date,
+            end_date,
+            {ticker: ticker_types.get(ticker, asset_by_ticker[ticker].instrument_type) for ticker in missing_tickers},
+        ) if FETCH_ON_REQUEST else {}
+        fallback_prices = {}
+        for ticker in missing_tickers:
+            if fetched_prices.get(ticker):
+                logger.info(f"Fetched {len(fetched_prices[ticker])} historical prices for {ticker}")
+                continue
+            # Если API не вернул данные, используем резервные данные
+            logger.warning(f"No historical data from API for {ticker}, adding fallback")
+            fallback_prices[ticker] = _fallback_prices(asset_by_ticker[ticker].current_price, 3)
+        save_historical_prices_many({
+            asset_by_ticker[ticker]: prices
+            for ticker, prices in {**fetched_prices, **fallback_prices}.items() if prices
+        })
+        reload_prices = True
+
+    for ticker in asset_by_ticker:
+        if ticker not in missing_tickers and df[ticker].count() < 2:
+            logger.warning(f"Insufficient price data for {ticker}, adding fallback")
+            save_historical_prices(asset_by_ticker[ticker], _fallback_prices(asset_by_ticker[ticker].current_price, 2))
+            reload_prices = True
+
+    if reload_prices:
+        df = load_price_matrix(list(asset_by_ticker), start_date)
+    df = df.dropna(axis=1, how='all')
+    returns_df = pd.DataFrame({
+        ticker: df[ticker].dropna().pct_change().dropna() for ticker in df.columns
+    })
+    logger.info(f"Price matrix for optimization: {df.shape[0]} dates x {df.shape[1]} tickers")
+    if df.empty or len(df.columns) < 2:
+        logger.error("Insufficient historical data for optimization")
+        raise OptimizationError('Insufficient historical data for optimization')
+
+    if len(df) < 2:
+        logger.error("Not enough price data points for optimization")
+        raise OptimizationError('Not enough price data points for optimization')
+    return df, returns_df
+
+
+def _estimate_version(df):
+    version = {'window': [str(df.index[0]), str(df.index[-1])], 'data': price_data_version(df.columns)}
+    return json.dumps(version, sort_keys=True)
+
+
+def estimate_moments(df, ticker_types, cov_estimator='sample'):
+    """Ожидаемые доходности (с купоном для облигаций) и ковариационная матрица.
+
+    μ и выборочная S собираются из накопленных статистик пар
+    (api.return_moments) за O(n²); если статистик по какому-то тикеру нет,
+    они считаются по матрице цен. Оценки со сжатием и факторная модель
+    кэшируются по корзине и версии данных (api.covariance).
+    """
+    moments = moments_from_store(list(df.columns), df.index[0], df.index[-1])
+    if moments is not None:
+        mu, S = moments
+    else:
+        logger.info(f"Return moments store incomplete for {list(df.columns)}, estimating from prices")
+        mu, S = expected_returns.mean_historical_return(df), None
+    if cov_estimator != 'sample' or S is None:
+        S = cached_covariance(df, cov_estimator, _estimate_version(df))
+    for ticker in df.columns:
+        if ticker_types.get(ticker) == "bonds":
+            mu[ticker] += BOND_COUPON_RATE / 252
+    return mu, S
+
+
+def compute_optimization(assets, ticker_types, model, target_return=0.1, risk_level=0.02, sortino_l=0.0,
+                         frontier_points=FRONTIER_POINTS, method='qp', cov_estimator='sample', progress=None):
+    """Полный расчёт: данные, оценки, оптимизация, метрики и эффективная граница.
+
+    Сам расчёт выполняется в пуле процессов (api.executor), поэтому тяжёлые
+    задачи не занимают поток веб-сервера дольше OPTIMIZATION_TIMEOUT.
+    С колбэком progress расчёт идёт в текущем процессе: так его выполняет
+    воркер фоновых задач (manage.py run_optimization_jobs).
+    """
+    df, returns_df = load_market_data(assets, ticker_types)
+    mu, S = estimate_moments(df, ticker_types, cov_estimator)
+
+    params = (mu, S, returns_df, model, target_return, risk_level, sortino_l, frontier_points, method)
+    try:
+        if progress is not None:
+            return solve_scenario(*params, progress=progress)
+        return executor.run(solve_scenario, *params)
+    except executor.JobTimeout as e:
+        logger.error(f"Optimization timed out: {str(e)}")
+        raise OptimizationTimeout(f'Optimization timed out: {str(e)}')
+    except Exception as e:
+        logger.error(f"Optimization failed: {str(e)}")
+        raise OptimizationError(f'Optimization failed: {str(e)}')
+
+
+def run_batch(assets, ticker_types, scenarios):
+    """Пакет сценариев на общих ценах и оценках μ и S.
+
+    Данные загружаются и оцениваются один раз для объединения тикеров (и
+    один раз на каждую оценку ковариации), каждый
+    сценарий работает с подматрицами своих тикеров; сценарии решаются
+    параллельно в общем пуле процессов.
+    """
+    df, returns_df = load_market_data(assets, ticker_types)
+    estimates = {}
+
+    jobs = []
+    for scenario in scenarios:
+        cov_estimator = scenario.get('cov_estimator', 'sample')
+        if cov_estimator not in estimates:
+            estimates[cov_estimator] = estimate_moments(df, ticker_types, cov_estimator)
+        mu, S = estimates[cov_estimator]
+        tickers = [ticker for ticker in scenario.get('tickers') or list(mu.index) if ticker in mu.index]
+        if len(tickers) < 2:
+            jobs.append(None)
+            continue
+        jobs.append((
+            mu[tickers], S.loc[tickers, tickers], returns_df.reindex(columns=tickers),
+            scenario['model'], scenario['target_return'], scenario['risk_level'], scenario['sortino_l'],
+            scenario['frontier_points'], scenario['method'],
+        ))
+
+    runnable = [index for index, job in enumerate(jobs) if job is not None]
+    results = [None] * len(jobs)
+    for index, result in zip(runnable, executor.run_many(solve_scenario, [jobs[index] for index in runnable])):
+        if isinstance(result, Exception):
+            logger.error(f"Batch scenario {index} failed: {str(result)}")
+            result = {'error': f'Optimization failed: {str(result)}'}
+        results[index] = result
+    for index, job in enumerate(jobs):
+        if job is None:
+            results[index] = {'error': 'At least 2 tickers with price data are required'}
+    return results
+
+
+def run_simulation(assets, ticker_types, mode='portfolios', simulations=10000, weights=None, horizon=252,
+                   method='mvn', cov_estimator='sample', risk_free_rate=0.02, concentration=1.0, seed=None):
+    """Моделирование на тех же μ и S, что и оптимизация (api.simulation).
+
+    mode='portfolios' — облако случайных портфелей, mode='paths' — пути
+    стоимости портфеля с весами weights (по умолчанию равные доли).
+    """
+    df, returns_df = load_market_data(assets, ticker_types)
+    mu, S = estimate_moments(df, ticker_types, cov_estimator)
+    try:
+        if mode == 'portfolios':
+            return simulation.random_portfolios(
+                mu, S, returns_df, simulations, risk_free_rate=risk_free_rate, concentration=concentration, seed=seed
+            )
+        if not weights:
+            weights = {ticker: 1 / len(mu) for ticker in mu.index}
+        return simulation.simulate_paths(weights, mu, S, returns_df, simulations, horizon, method, seed)
+    except executor.JobTimeout as e:
+        logger.error(f"Simulation timed out: {str(e)}")
+        raise OptimizationTimeout(f'Simulation timed out: {str(e)}')
+    except Exception as e:
+        logger.error(f"Simulation failed: {str(e)}")
+        raise OptimizationError(f'Simulation failed: {str(e)}')
+
+
+def optimization_cache_key(tickers, ticker_types, model, target_return, risk_level, sortino_l, frontier_points, method,
+                           cov_estimator):
+    """Ключ кэша по входным параметрам и версии исторических данных."""
+    tickers = sorted(tickers)
+    payload = {
+        'tickers': tickers,
+        'types': {ticker: ticker_types.get(ticker) for ticker in tickers},
+        'model': model,
+        'target_return': target_return,
+        'risk_level': risk_level,
+        'sortino_l': sortino_l,
+        'frontier_points': frontier_points,
+        'method': method,
+        'cov_estimator': cov_estimator,
+        'window_end': str(datetime.now().date()),
+        'data': price_data_version(tickers),
+    }
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return f'optimization:{digest}'
+
+
+def run_optimization(assets, ticker_types, model, target_return=0.1, risk_level=0.02, sortino_l=0.0,
+                     frontier_points=FRONTIER_POINTS, method='qp', cov_estimator='sample', progress=None):
+    """compute_optimization с кэшированием результата.
+
+    Ключ включает версию данных, поэтому новые строки HistoricalPrice
+    автоматически делают старые результаты недостижимыми.
+    """
+    result_cache = caches['optimization']
+    tickers = [asset.ticker for asset in assets]
+    params = (ticker_types, model, target_return, risk_level, sortino_l, frontier_points, method, cov_estimator)
+
+    key = optimization_cache_key(tickers, *params)
+    result = result_cache.get(key)
+    if result is not None:
+        logger.info(f"Using cached optimization result for {sorted(tickers)}, model={model}")
+        return result
+
+    result = compute_optimization(assets, *params, progress=progress)
+    # Загрузка недостающей истории меняет версию данных, поэтому ключ пересчитываем
+    result_cache.set(optimization_cache_key(tickers, *params), result)
+    return result
+
+
+def normalize_ticker(ticker):
+    """Тикер MOEX по названию из TICKER_MAPPING или введённому тикеру (без суффикса .ME)."""
+    return TICKER_MAPPING.get(ticker.lower(), ticker.upper().replace('.ME', ''))
+
+
+def resolve_tickers(tickers, current_portfolio):
+    """Нормализованные тикеры и типы инструментов (с учётом текущего портфеля)."""
+    normalized_tickers = [normalize_ticker(t) for t in tickers]
+
+    bond_tickers = ['SU26207RMFS9', 'RU000A0JX0J2']
+    etf_tickers = ['FXRL', 'SBSP']
+    ticker_types = {}
+    for ticker in normalized_tickers:
+        if ticker in bond_tickers:
+            ticker_types[ticker] = "bonds"
+        elif ticker in etf_tickers:
+            ticker_types[ticker] = "etf"
+        else:
+            ticker_types[ticker] = "shares"
+    for item in current_portfolio:
+        ticker = item.get('ticker')
+        if ticker in normalized_tickers and 'instrument_type' in item:
+            ticker_types[ticker] = item['instrument_type']
+    return normalized_tickers, ticker_types
+
+
+def summarize_optimization(model, optimization, risk_level):
+    """Показатели результата оптимизации в формате ответа API."""
+    performance = optimization['performance']
+    additional_metrics = optimization['metrics']
+    return {
+        'tickers': list(optimization['weights'].keys()),
+        'weights': [float(w) for w in optimization['weights'].values()],
+        'expected_return': performance[0] * 100,
+        'risk': performance[1] * 100,
+        'sharpe': performance[2] if model == 'sharpe' else (performance[0] - risk_level) / performance[1] if model == 'markowitz' and performance[1] > 0 else 0,
+        'sortino': additional_metrics['sortino'],
+        'rachev': additional_metrics['rachev'],
+        'max_drawdown': additional_metrics['max_drawdown'] * 100,
+        'calmar': additional_metrics['calmar'],
+        'sterling': additional_metrics['sterling'],
+        'frontier': optimization['frontier'],
+    }
+
+
+def build_optimization_result(assets, ticker_types, current_portfolio, model, target_return, risk_level, sortino_l,
+                              frontier_points, method, cov_estimator='sample', progress=None):
+    """Ответ /api/optimize/: оптимальные веса, метрики, граница и рекомендации.
+
+    Используется и синхронным запросом, и воркером фоновых задач.
+    """
+    # Расчёт реальной доходности портфеля
+    total_value = 0
+    weighted_returns = 0
+    portfolio_details = []
+    for asset in assets:
+        if asset.quantity > 0 and asset.buy_price > 0 and asset.current_price > 0:
+            asset_return = ((asset.current_price - asset.buy_price) / asset.buy_price) * 100
+            asset_value = asset.quantity * asset.current_price
+            total_value += asset_value
+            weighted_returns += asset_return * (asset_value / total_value if total_value > 0 else 0)
+            portfolio_details.append({
+                'ticker': asset.ticker,
+                'buy_price': asset.buy_price,
+                'current_price': asset.current_price,
+                'quantity': asset.quantity,
+                'return': asset_return,
+                'value': asset_value,
+            })
+    
+    actual_portfolio_return = weighted_returns if total_value > 0 else 0
+
+    optimization = run_optimization(
+        assets, ticker_types, model, target_return, risk_level, sortino_l, frontier_points, method, cov_estimator,
+        progress
+    )
+    cleaned_weights = optimization['weights']
+    additional_metrics = optimization['metrics']
+
+    current_prices = {asset.ticker: asset.current_price for asset in assets if asset.current_price > 0}
+    lot_sizes = {asset.ticker: asset.lot_size for asset in assets}
+    try:
+        rebalancing = rebalance(cleaned_weights, current_portfolio, prices=current_prices, lot_sizes=lot_sizes)
+    except ValueError as e:
+        # method=closed_form допускает короткие позиции, которые нельзя купить лотами
+        logger.warning(f"Skipping recommendations: {str(e)}")
+        rebalancing = {'recommendations': [], 'cash': None, 'error': str(e)}
+
+    return {
+        **summarize_optimization(model, optimization, risk_level),
+        'actual_return': actual_portfolio_return,
+        'recommendations': rebalancing['recommendations'],
+        'cash': rebalancing['cash'],
+        **({'recommendations_error': rebalancing['error']} if 'error' in rebalancing else {}),
+        'portfolio_details': portfolio_details,
+        'explanation': (
+            f"Модель {model} оптимизирует портфель. "
+            f"Ожидаемая доходность: {target_return*100}%, уровень риска: {risk_level}. "
+            f"Sortino: {additional_metrics['sortino']:.2f}, Rachev: {additional_metrics['rachev']:.2f}, "
+            f"Max Drawdown: {additional_metrics['max_drawdown']*100:.2f}%, Calmar: {additional_metrics['calmar']:.2f}, "
+            f"Sterling: {additional_metrics['sterling']:.2f}."
+        )
+    }
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Max
+from . import table_versions
+from .models import HistoricalPrice
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Каталог колоночного архива цен; None — архив отключён, цены читаются из БД
+ARCHIVE_DIR = getattr(settings, 'PRICE_ARCHIVE_DIR', None)
+PRICE_DTYPE = np.dtype([('date', 'M8[D]'), ('price', 'f8')])
+# Права файлов архива: запись — владелец (воркер загрузки), чтение — все
+FILE_MODE = getattr(settings, 'PRICE_ARCHIVE_FILE_MODE', 0o644)
+
+
+def is_enabled():
+    return ARCHIVE_DIR is not None
+
+
+def archive_dir():
+    """Каталог архива текущей БД: первичные ключи разных баз (и тестовых) не пересекаются."""
+    name = str(connection.settings_dict['NAME'])
+    digest = hashlib.sha256(name.encode()).hexdigest()[:12]
+    return os.path.join(ARCHIVE_DIR, f'{connection.vendor}-{digest}')
+
+
+def archive_path(asset_id):
+    # Имя по первичному ключу: архив удалённого и заново созданного тикера не подхватится
+    return os.path.join(archive_dir(), f'{asset_id}.npy')
+
+
+def version_path(asset_id):
+    return os.path.join(archive_dir(), f'{asset_id}.json')
+
+
+@contextmanager
+def archive_lock():
+    """Эксклюзивная блокировка каталога архива на время чтения-изменения-записи."""
+    os.makedirs(archive_dir(), exist_ok=True)
+    with open(os.path.join(archive_dir(), '.lock'), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _to_array(rows):
+    """Массив (date, price), отсортированный по дате, из пар (дата, цена)."""
+    array = np.array(list(rows), dtype=PRICE_DTYPE)
+    return array[np.argsort(array['date'], kind='stable')]
+
+
+def _replace(path, write):
+    """Атомарная запись: временный файл в том же каталоге и os.replace."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        # mkstemp создаёт файл с правами 0600, а читать архив может веб-сервер под другим пользователем
+        os.chmod(temp_path, FILE_MODE)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def write_archive(asset_id, array, version):
+    """Записывает архив и версию цен актива, которой он соответствует.
+
+    Версия пишется после данных: читатель, увидевший новую версию, увидит и
+    новый архив, а в обратном случае просто пересоберёт архив.
+    """
+    _replace(archive_path(asset_id), lambda f: np.save(f, np.ascontiguousarray(array, dtype=PRICE_DTYPE)))
+    _replace(version_path(asset_id), lambda f: f.write(json.dumps({'version': version}).encode()))
+
+
+def read_version(asset_id):
+    """Версия цен актива, записанная вместе с архивом, или None."""
+    try:
+        with open(version_path(asset_id)) as f:
+            return json.load(f)['version']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_archive(asset_id):
+    """Архив актива, отображённый в память (только чтение), или None."""
+    try:
+        return np.load(archive_path(asset_id), mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+
+def _read_from_db(asset_ids):
+    rows = {asset_id: [] for asset_id in asset_ids}
+    for asset_id, date, price in (
+        HistoricalPrice.objects.filter(asset_id__in=list(asset_ids)).values_list('asset_id', 'date', 'price')
+    ):
+        rows[asset_id].append((date, price))
+    return {asset_id: _to_array(asset_rows) for asset_id, asset_rows in rows.items()}
+
+
+def rebuild_archive(asset_ids):
+    """Пересобирает архивы активов из таблицы HistoricalPrice.
+
+    Версии читаются до строк: если между запросами зафиксируется новая
+    запись, архив получит старую версию и будет пересобран при следующем
+    чтении, а не наоборот.
+    """
+    versions = table_versions.get_versions([table_versions.asset_prices(asset_id) for asset_id in asset_ids])
+    arrays = _read_from_db(asset_ids)
+    for asset_id, array in arrays.items():
+        write_archive(asset_id, array, versions[table_versions.asset_prices(asset_id)])
+    logger.info(f"Rebuilt price archive for {len(arrays)} assets")
+    return arrays
+
+
+def merge_into_archive(rows_by_asset, versions):
+    """Вносит сохранённые цены {asset_id: {дата: цена}} в архивы; новые значения побеждают.
+
+    Вызывается после фиксации транзакции upsert; versions — {asset_id:
+    версия цен}, полученная этой транзакцией. Дописывать можно только архив
+    предыдущей версии: если между ними были другие изменения (или архива
+    нет), архив собирается из БД целиком.
+    """
+    try:
+        _merge_into_archive(rows_by_asset, versions)
+    except OSError as e:
+        # Цены уже зафиксированы; архив будет пересобран при следующем чтении
+        logger.warning(f"Failed to update price archive: {str(e)}")
+
+
+def _merge_into_archive(rows_by_asset, versions):
+    missing = []
+    with archive_lock():
+        for asset_id, rows in rows_by_asset.items():
+            archived_version = read_version(asset_id)
+            if archived_version is not None and archived_version >= versions[asset_id]:
+                continue
+            existing = read_archive(asset_id) if archived_version == versions[asset_id] - 1 else None
+            if existing is None:
+                missing.append(asset_id)
+                continue
+            new = _to_array(rows.items())
+            kept = existing[~np.isin(existing['date'], new['date'])]
+            merged = np.concatenate([kept, new])
+            write_archive(asset_id, merged[np.argsort(merged['date'], kind='stable')], versions[asset_id])
+        if missing:
+            rebuild_archive(missing)
+
+
+def load_archives(asset_ids):
+    """Архивы активов {asset_id: массив}, сверенные с БД по версии цен актива,
+    числу строк и последней дате.
+
+    Версия ловит изменение цены существующей строки, число строк — удаление.
+    Устаревшие или отсутствующие архивы (например, если процесс упал между
+    фиксацией транзакции и записью архива) пересобираются из БД.
+    """
+    price_versions = table_versions.get_versions([table_versions.asset_prices(asset_id) for asset_id in asset_ids])
+    versions = {
+        asset_id: (count, last_date)
+        for asset_id, count, last_date in HistoricalPrice.objects.filter(asset_id__in=list(asset_ids))
+        .values('asset_id').annotate(rows=Count('id'), last_date=Max('date'))
+        .values_list('asset_id', 'rows', 'last_date')
+    }
+    arrays, stale = {}, []
+    for asset_id in asset_ids:
+        if asset_id not in versions:
+            arrays[asset_id] = np.empty(0, dtype=PRICE_DTYPE)
+            continue
+        array = read_archive(asset_id)
+        count, last_date = versions[asset_id]
+        if (
+            read_version(asset_id) != price_versions[table_versions.asset_prices(asset_id)]
+            or array is None or len(array) != count or array['date'][-1] != np.datetime64(last_date, 'D')
+        ):
+            stale.append(asset_id)
+        else:
+            arrays[asset_id] = array
+    if stale:
+        logger.info(f"Price archive missing or stale for {len(stale)} assets, rebuilding")
+        try:
+            with archive_lock():
+                arrays.update(rebuild_archive(stale))
+        except OSError as e:
+            logger.warning(f"Price archive is not writable: {str(e)}, reading prices from the database")
+            arrays.update(_read_from_db(stale))
+    return arrays
+
+
+def window(array, start_date=None, end_date=None):
+    """Срез архива по датам [start_date, end_date] без копирования данных."""
+    dates = array['date']
+    lo = 0 if start_date is None else int(np.searchsorted(dates, np.datetime64(start_date, 'D'), side='left'))
+    hi = len(array) if end_date is None else int(np.searchsorted(dates, np.datetime64(end_date, 'D'), side='right'))
+    return array[lo:hi]
@@ -0,0 +1,105 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from .historical_data import fetch_current_price
+from .models import Asset
+
+logger = logging.getLogger(__name__)
+
+PRICE_TTL = getattr(settings, 'PRICE_CACHE_TTL', 300)
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='price-refresh')
+
+
+def is_fresh(asset):
+    if asset.current_price <= 0 or asset.price_updated_at is None:
+        return False
+    return timezone.now() - asset.price_updated_at < timedelta(seconds=PRICE_TTL)
+
+
+def _store_price(ticker, instrument_type):
+    price = fetch_current_price(ticker, instrument_type=instrument_type)
+    if price is None:
+        return None
+    asset, created = Asset.objects.get_or_create(
+        ticker=ticker,
+        defaults={
+            'name': ticker,
+            'current_price': price,
+            'price_updated_at': timezone.now(),
+            'buy_price': 0.0,
+            'quantity': 0,
+            'instrument_type': instrument_type
+        }
+    )
+    if not created:
+        asset.current_price = price
+        asset.price_updated_at = timezone.now()
+        asset.instrument_type = instrument_type
+        asset.save(update_fields=['current_price', 'price_updated_at', 'instrument_type'])
+    return price
+
+
+def _run_refresh(ticker, instrument_type, future):
+    try:
+        future.set_result(_store_price(ticker, instrument_type))
+    except Exception as e:
+        logger.error(f"Failed to refresh price for {ticker}: {str(e)}")
+        future.set_exception(e)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(ticker, None)
+
+
+def _run_background_refresh(ticker, instrument_type, future):
+    try:
+        _run_refresh(ticker, instrument_type, future)
+    finally:
+        connections.close_all()
+
+
+def refresh_price(ticker, instrument_type='shares', background=False):
+    """Обновление цены тикера; одновременные обновления одного тикера объединяются.
+
+    Возвращает Future с новой ценой (None, если MOEX не вернул цену). При
+    background=False запрос выполняется в текущем потоке.
+    """
+    with _inflight_lock:
+        future = _inflight.get(ticker)
+        if future is not None:
+            return future
+        future = Future()
+        _inflight[ticker] = future
+
+    if background:
+        _executor.submit(_run_background_refresh, ticker, instrument_type, future)
+    else:
+        _run_refresh(ticker, instrument_type, future)
+    return future
+
+
+def get_current_price(ticker, instrument_type='shares', allow_fetch=True):
+    """Текущая цена с учётом TTL (stale-while-revalidate).
+
+    Свежая цена отдаётся из БД. Устаревшая тоже отдаётся сразу, а обновление
+    запускается в фоне. Если цены нет, она запрашивается у MOEX синхронно.
+    """
+    asset = Asset.objects.filter(ticker=ticker).first()
+    if asset is not None and asset.current_price > 0:
+        if allow_fetch and not is_fresh(asset):
+            logger.info(f"Serving stale price for {ticker}: {asset.current_price}, refreshing in background")
+            refresh_price(ticker, instrument_type, background=True)
+        else:
+            logger.info(f"Using cached price for {ticker}: {asset.current_price}")
+        return float(asset.current_price)
+
+    if not allow_fetch:
+        return None
+    logger.info(f"No cached price for {ticker}, fetching from API")
+    return refresh_price(ticker, instrument_type).result()
@@ -0,0 +1,153 @@
+import logging
+from itertools import islice
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Count, Max
+from . import price_archive, table_versions
+from .models import Asset, HistoricalPrice
+from .return_moments import update_return_moments
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def _batches(prices, size):
+    iterator = iter(prices)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _upsert_batch(asset, batch):
+    # Повторяющиеся даты внутри пакета схлопываем: побеждает последнее значение
+    rows = {entry['date']: float(entry['price']) for entry in batch}
+    existing = HistoricalPrice.objects.filter(asset=asset, date__in=list(rows)).count()
+    HistoricalPrice.objects.bulk_create(
+        [HistoricalPrice(asset=asset, date=date, price=price) for date, price in rows.items()],
+        update_conflicts=True,
+        unique_fields=['asset', 'date'],
+        update_fields=['price'],
+    )
+    return rows, len(rows) - existing, existing
+
+
+def save_historical_prices(asset, prices, batch_size=BATCH_SIZE):
+    """Пакетное сохранение (upsert) исторических цен актива в одной транзакции.
+
+    prices — итерируемый объект словарей {'date': ..., 'price': ...}; он
+    читается пакетами по batch_size, поэтому подходит и генератор страниц.
+    Возвращает {'inserted': ..., 'updated': ...}.
+    """
+    return save_historical_prices_many({asset: prices}, batch_size=batch_size)
+
+
+def save_historical_prices_many(prices_by_asset, batch_size=BATCH_SIZE):
+    """Пакетное сохранение цен нескольких активов в одной транзакции.
+
+    В той же транзакции обновляются накопленные статистики доходностей
+    (api.return_moments) начиная с самой ранней сохранённой даты актива, а
+    после фиксации — колоночный архив цен (api.price_archive).
+    """
+    inserted = updated = 0
+    changed_since = {}
+    saved_rows = {}
+    with transaction.atomic():
+        for asset, prices in prices_by_asset.items():
+            for batch in _batches(prices, batch_size):
+                rows, batch_inserted, batch_updated = _upsert_batch(asset, batch)
+                inserted += batch_inserted
+                updated += batch_updated
+                saved_rows.setdefault(asset.pk, {}).update(rows)
+                first_date = min(rows)
+                changed_since[asset.pk] = min(changed_since.get(asset.pk, first_date), first_date)
+        update_return_moments(changed_since)
+        if inserted or updated:
+            bump_price_generation()
+            versions = {
+                asset_id: table_versions.bump(table_versions.asset_prices(asset_id)) for asset_id in saved_rows
+            }
+    if inserted or updated:
+        if price_archive.is_enabled():
+            transaction.on_commit(lambda: price_archive.merge_into_archive(saved_rows, versions))
+    logger.info(f"Saved historical prices for {len(prices_by_asset)} assets: {inserted} inserted, {updated} updated")
+    return {'inserted': inserted, 'updated': updated}
+
+
+def load_price_matrix(tickers, start_date, end_date=None):
+    """Матрица цен (даты × тикеры, float64) за окно одним запросом к БД.
+
+    start_date=None — с начала истории. Столбцы идут в порядке tickers; дни
+    без котировки заполнены NaN. Если включён архив цен, окна читаются
+    срезами отображённых в память файлов.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if price_archive.is_enabled():
+        return _load_price_matrix_from_archive(tickers, start_date, end_date)
+    queryset = HistoricalPrice.objects.filter(asset__ticker__in=tickers)
+    if start_date is not None:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date is not None:
+        queryset = queryset.filter(date__lte=end_date)
+    rows = queryset.values_list('asset__ticker', 'date', 'price')
+
+    frame = pd.DataFrame.from_records(list(rows), columns=['ticker', 'date', 'price'])
+    matrix = frame.pivot(index='date', columns='ticker', values='price')
+    matrix = matrix.reindex(columns=tickers).sort_index().astype('float64')
+    matrix.columns.name = None
+    matrix.index.name = None
+    return matrix
+
+
+def _load_price_matrix_from_archive(tickers, start_date, end_date=None):
+    ids = dict(Asset.objects.filter(ticker__in=tickers).values_list('ticker', 'id'))
+    archives = price_archive.load_archives(list(ids.values()))
+    windows = {
+        ticker: price_archive.window(archives[ids[ticker]], start_date, end_date)
+        for ticker in tickers if ticker in ids
+    }
+    dates = np.unique(np.concatenate([w['date'] for w in windows.values()] or [np.empty(0, dtype='M8[D]')]))
+    values = np.full((len(dates), len(tickers)), np.nan)
+    for column, ticker in enumerate(tickers):
+        if ticker in windows:
+            values[np.searchsorted(dates, windows[ticker]['date']), column] = windows[ticker]['price']
+    return pd.DataFrame(values, index=pd.Index(dates.astype(object)), columns=tickers)
+
+
+def price_series(asset, start_date=None, end_date=None):
+    """История цен актива за окно: массивы дат (datetime64[D]) и цен по возрастанию даты."""
+    if price_archive.is_enabled():
+        array = price_archive.window(price_archive.load_archives([asset.pk])[asset.pk], start_date, end_date)
+        return array['date'], array['price']
+    queryset = asset.historical_prices.order_by('date')
+    if start_date is not None:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date is not None:
+        queryset = queryset.filter(date__lte=end_date)
+    rows = list(queryset.values_list('date', 'price'))
+    return (
+        np.array([date for date, _ in rows], dtype='M8[D]'),
+        np.array([price for _, price in rows], dtype='float64'),
+    )
+
+
+def bump_price_generation():
+    """Увеличивает счётчик изменений таблицы исторических цен (общий для всех процессов)."""
+    table_versions.bump(table_versions.HISTORICAL_PRICES)
+
+
+def price_data_version(tickers):
+    """Версия данных по тикерам: счётчик изменений и (последняя дата, число строк) по каждому тикеру."""
+    rows = (
+        HistoricalPrice.objects.filter(asset__ticker__in=list(tickers))
+        .values('asset__ticker')
+        .annotate(last_date=Max('date'), rows=Count('id'))
+        .values_list('asset__ticker', 'last_date', 'rows')
+    )
+    return {
+        'generation': table_versions.get_version(table_versions.HISTORICAL_PRICES)[0],
+        'tickers': {ticker: [str(last_date), count] for ticker, last_date, count in rows},
+    }
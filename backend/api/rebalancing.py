@@ -0,0 +1,173 @@
+import logging
+import numpy as np
+from django.conf import settings
+from scipy.optimize import Bounds, LinearConstraint, milp
+from .models import Asset
+
+logger = logging.getLogger(__name__)
+
+# Стоимость портфеля, если текущие позиции не переданы
+DEFAULT_PORTFOLIO_VALUE = 1000
+# Предельное время уточнения целочисленного распределения (MILP) в секундах
+TIME_LIMIT = getattr(settings, 'REBALANCE_TIME_LIMIT', 0.5)
+
+
+def resolve_holdings(current_portfolio, extra_tickers=()):
+    """Позиции {тикер: количество} и активы из БД одним запросом.
+
+    Вместе с тикерами позиций загружаются extra_tickers. Позиции по тикерам,
+    которых нет в БД, отбрасываются; повторяющиеся тикеры суммируются.
+    """
+    tickers = {item['ticker'] for item in current_portfolio if item.get('ticker')} | set(extra_tickers)
+    assets = Asset.objects.in_bulk(list(tickers), field_name='ticker') if tickers else {}
+    holdings = {}
+    for item in current_portfolio:
+        ticker = item.get('ticker')
+        if ticker in assets:
+            holdings[ticker] = holdings.get(ticker, 0) + int(item.get('quantity', 0))
+    return holdings, assets
+
+
+def portfolio_value(holdings, prices):
+    """Стоимость позиций по текущим ценам."""
+    return float(sum(quantity * prices.get(ticker, 0.0) for ticker, quantity in holdings.items()))
+
+
+def _deviation(x, costs, targets):
+    return float(np.abs(x * costs - targets).sum())
+
+
+def _greedy_lots(costs, targets, budget):
+    """Целые лоты: округление вниз, затем докупка по одному лоту на остаток бюджета.
+
+    Каждый раз покупается лот, сильнее всего сокращающий отклонение от
+    целевой стоимости; после округления вниз каждому активу выгоден не более
+    чем один дополнительный лот.
+    """
+    x = np.floor(targets / costs)
+    cash = budget - float(x @ costs)
+    while True:
+        shortfall = targets - x * costs
+        gain = np.abs(shortfall) - np.abs(shortfall - costs)
+        gain[costs > cash + 1e-9] = 0.0
+        best = int(np.argmax(gain))
+        if gain[best] <= 1e-12:
+            return x
+        x[best] += 1
+        cash -= costs[best]
+
+
+def _milp_lots(costs, targets, budget, time_limit):
+    """Целые лоты с минимальным суммарным отклонением стоимости от целевой (HiGHS).
+
+    Переменные: число лотов x и отклонения d >= |x·cost - target|;
+    ограничение бюджета x·cost <= budget. Возвращает None, если за time_limit
+    допустимое решение не найдено.
+    """
+    n = len(costs)
+    eye = np.eye(n)
+    constraints = LinearConstraint(
+        np.block([
+            [np.diag(costs), -eye],
+            [-np.diag(costs), -eye],
+            [costs[None, :], np.zeros((1, n))],
+        ]),
+        -np.inf,
+        np.concatenate([targets, -targets, [budget]]),
+    )
+    result = milp(
+        np.concatenate([np.zeros(n), np.ones(n) / max(budget, 1.0)]),
+        constraints=constraints,
+        integrality=np.concatenate([np.ones(n), np.zeros(n)]),
+        bounds=Bounds(0, np.concatenate([np.floor(budget / costs), np.full(n, np.inf)])),
+        options={'time_limit': time_limit},
+    )
+    if result.x is None:
+        logger.warning(f"Lot allocation MILP found no solution: {result.message}")
+        return None
+    return np.round(result.x[:n])
+
+
+def allocate_lots(costs, targets, budget, time_limit=TIME_LIMIT):
+    """Число лотов каждого актива, ближайшее к целевым стоимостям в пределах бюджета.
+
+    Близость измеряется суммой модулей отклонений стоимости (L1): это
+    линейная замена ошибки слежения (w − w*)ᵀS(w − w*), которая позволяет
+    решать задачу как MILP.
+
+    Жадное решение уточняется MILP с ограничением по времени; берётся лучшее
+    из двух, так что результат не хуже жадного, даже если MILP не успел.
+    """
+    x = _greedy_lots(costs, targets, budget)
+    if time_limit and len(costs) > 1 and _deviation(x, costs, targets) > 1e-9 * max(budget, 1.0):
+        refined = _milp_lots(costs, targets, budget, time_limit)
+        if refined is not None and refined @ costs <= budget + 1e-6 and \
+                _deviation(refined, costs, targets) < _deviation(x, costs, targets):
+            x = refined
+    return x.astype(int)
+
+
+def compute_trades(weights, prices, holdings, total_value, lot_sizes=None, time_limit=TIME_LIMIT):
+    """Сделки для перехода от holdings к целевым весам с учётом лотов и бюджета.
+
+    Целевые позиции — целые лоты, суммарно не дороже total_value, с
+    минимальным отклонением стоимости от целевых долей (allocate_lots).
+    Позиции по тикерам вне weights считаются с нулевым весом и продаются.
+    Активы без положительной цены пропускаются. Возвращает список сделок
+    {'ticker', 'action', 'quantity', 'value'} и остаток денег.
+    """
+    lot_sizes = lot_sizes or {}
+    tickers = [ticker for ticker in dict.fromkeys([*weights, *holdings]) if prices.get(ticker, 0) > 0]
+    if not tickers:
+        return [], float(total_value)
+    w = np.array([weights.get(ticker, 0.0) for ticker in tickers], dtype=float)
+    p = np.array([prices[ticker] for ticker in tickers], dtype=float)
+    lots = np.array([max(int(lot_sizes.get(ticker) or 1), 1) for ticker in tickers])
+    current = np.array([holdings.get(ticker, 0) for ticker in tickers])
+
+    target = allocate_lots(p * lots, total_value * w, total_value, time_limit) * lots
+    diff = target - current
+    trade = np.flatnonzero(diff)
+    trades = [
+        {
+            'ticker': tickers[i],
+            'action': 'Купить' if diff[i] > 0 else 'Продать',
+            'quantity': int(abs(diff[i])),
+            'value': float(abs(diff[i]) * p[i]),
+        }
+        for i in trade
+    ]
+    return trades, float(total_value - target @ p)
+
+
+def rebalance(weights, current_portfolio, prices=None, total_value=None, lot_sizes=None):
+    """Рекомендации по ребалансировке к целевым весам.
+
+    prices и lot_sizes — известные цены и размеры лотов {тикер: значение};
+    недостающие берутся из БД вместе с позициями (всего один запрос).
+    total_value по умолчанию — стоимость текущих позиций или
+    DEFAULT_PORTFOLIO_VALUE, если их нет. Отрицательные веса (короткие
+    позиции) не раскладываются на лоты: ValueError.
+    """
+    short = [ticker for ticker, weight in weights.items() if weight < 0]
+    if short:
+        raise ValueError(f"Short positions are not supported for rebalancing: {', '.join(short)}")
+    prices = dict(prices or {})
+    lot_sizes = dict(lot_sizes or {})
+    holdings, assets = resolve_holdings(
+        current_portfolio, [ticker for ticker in weights if ticker not in prices or ticker not in lot_sizes]
+    )
+    for ticker, asset in assets.items():
+        prices.setdefault(ticker, asset.current_price)
+        lot_sizes.setdefault(ticker, asset.lot_size)
+
+    if total_value is None:
+        total_value = portfolio_value(holdings, prices) if current_portfolio else DEFAULT_PORTFOLIO_VALUE
+    recommendations, cash = compute_trades(weights, prices, holdings, total_value, lot_sizes)
+    return {
+        'total_value': total_value,
+        'recommendations': recommendations,
+        'cash': cash,
+        # Тикеры без цены: их нельзя ни купить, ни оценить, ни продать
+        'missing': [ticker for ticker in dict.fromkeys([*weights, *holdings]) if not prices.get(ticker, 0) > 0],
+    }
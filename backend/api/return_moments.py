@@ -0,0 +1,205 @@
+import logging
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from django.db.models import Max, Min, Q
+from pypfopt import risk_models
+from .models import Asset, HistoricalPrice, ReturnMoments
+
+logger = logging.getLogger(__name__)
+
+FREQUENCY = 252
+BATCH_SIZE = 1000
+
+
+def _asset_returns(asset_ids, since):
+    """Дневные доходности активов по их собственным котировкам начиная с даты since.
+
+    Для доходности первого дня берётся последняя цена до since.
+    Возвращает {asset_id: (даты котировок >= since, доходности)}.
+    """
+    previous_dates = dict(
+        HistoricalPrice.objects.filter(asset_id__in=asset_ids, date__lt=since)
+        .values('asset_id').annotate(last_date=Max('date')).values_list('asset_id', 'last_date')
+    )
+    rows = HistoricalPrice.objects.filter(asset_id__in=asset_ids).filter(
+        Q(date__gte=since) | Q(date__in=set(previous_dates.values()))
+    ).order_by('asset_id', 'date').values_list('asset_id', 'date', 'price')
+
+    series = defaultdict(list)
+    for asset_id, date, price in rows:
+        if date >= since or previous_dates.get(asset_id) == date:
+            series[asset_id].append((date, price))
+
+    returns = {}
+    for asset_id, points in series.items():
+        dates = pd.DatetimeIndex([date for date, _ in points])
+        prices = pd.Series([price for _, price in points], index=dates, dtype='float64')
+        values = prices.pct_change(fill_method=None)
+        if asset_id in previous_dates:
+            dates, values = dates[1:], values.iloc[1:]
+        returns[asset_id] = (dates, values)
+    return returns
+
+
+def _base_rows(pairs, since):
+    """Последние накопленные суммы пар до даты since (без неё)."""
+    asset_ids = {asset_id for pair in pairs for asset_id in pair}
+    last_dates = (
+        ReturnMoments.objects.filter(asset_i_id__in=asset_ids, asset_j_id__in=asset_ids, date__lt=since)
+        .values('asset_i_id', 'asset_j_id').annotate(last_date=Max('date'))
+        .values_list('asset_i_id', 'asset_j_id', 'last_date')
+    )
+    wanted = {(i, j): date for i, j, date in last_dates if (i, j) in pairs}
+    rows = ReturnMoments.objects.filter(
+        asset_i_id__in=asset_ids, asset_j_id__in=asset_ids, date__in=set(wanted.values())
+    ).values_list('asset_i_id', 'asset_j_id', 'date', 'count', 'sum_i', 'sum_j', 'sum_ij', 'sum_log')
+    return {
+        (i, j): np.array(sums, dtype=float)
+        for i, j, date, *sums in rows if wanted.get((i, j)) == date
+    }
+
+
+def _pair_rows(i, j, returns, base, since):
+    """Строки накопленных сумм пары на каждую дату котировки любого из двух активов начиная с since."""
+    dates_i, values_i = returns.get(i, (pd.DatetimeIndex([]), pd.Series(dtype='float64')))
+    dates_j, values_j = returns.get(j, (pd.DatetimeIndex([]), pd.Series(dtype='float64')))
+    dates = dates_i.union(dates_j)
+    dates = dates[dates >= pd.Timestamp(since)]
+    if dates.empty:
+        return []
+    x = values_i.reindex(dates).to_numpy()
+    y = values_j.reindex(dates).to_numpy()
+    both = ~np.isnan(x) & ~np.isnan(y)
+    x, y = np.where(both, x, 0.0), np.where(both, y, 0.0)
+    log = np.log1p(x) if i == j else np.zeros(len(dates))
+
+    totals = np.cumsum(np.column_stack([both.astype(float), x, y, x * y, log]), axis=0)
+    if base is not None:
+        totals += base
+    return [
+        ReturnMoments(
+            asset_i_id=i, asset_j_id=j, date=date.date(), count=int(round(count)),
+            sum_i=sum_i, sum_j=sum_j, sum_ij=sum_ij, sum_log=sum_log,
+        )
+        for date, (count, sum_i, sum_j, sum_ij, sum_log) in zip(dates, totals)
+    ]
+
+
+def _group_by_value(mapping):
+    groups = defaultdict(list)
+    for key, value in mapping.items():
+        groups[value].append(key)
+    return groups
+
+
+def update_return_moments(changed_since):
+    """Пересчитывает накопленные суммы пар после изменения цен.
+
+    changed_since — {asset_id: первая добавленная или изменённая дата}.
+    Пересчитываются только пары с изменившимися активами, и каждая — с
+    min(since[i], since[j]): дозагрузка старой истории одного тикера не
+    переписывает пары остальных. Для ежедневного обновления это одна новая
+    строка на пару.
+    """
+    if not changed_since:
+        return 0
+    universe = set(HistoricalPrice.objects.values_list('asset_id', flat=True).distinct())
+    pair_since = {}
+    for i in changed_since:
+        if i not in universe:
+            continue
+        for j in universe:
+            pair = (min(i, j), max(i, j))
+            since = min(changed_since[a] for a in pair if a in changed_since)
+            pair_since[pair] = min(pair_since.get(pair, since), since)
+
+    # Строки пары удаляются с min(since[i], since[j]): объединение условий по каждому изменённому активу.
+    # Для актива, у которого не осталось цен, строки только удаляются
+    stale = Q()
+    for since, assets in _group_by_value(changed_since).items():
+        stale |= (Q(asset_i_id__in=assets) | Q(asset_j_id__in=assets)) & Q(date__gte=since)
+    ReturnMoments.objects.filter(stale).delete()
+    if not pair_since:
+        return 0
+
+    asset_since = {}
+    for pair, since in pair_since.items():
+        for asset_id in pair:
+            asset_since[asset_id] = min(asset_since.get(asset_id, since), since)
+    returns = {}
+    for since, assets in _group_by_value(asset_since).items():
+        returns.update(_asset_returns(assets, since))
+
+    rows = []
+    for since, pairs in _group_by_value(pair_since).items():
+        base_rows = _base_rows(set(pairs), since)
+        for i, j in sorted(pairs):
+            rows.extend(_pair_rows(i, j, returns, base_rows.get((i, j)), since))
+    ReturnMoments.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    logger.info(
+        f"Updated return moments for {len(pair_since)} asset pairs since {min(changed_since.values())}: {len(rows)} rows"
+    )
+    return len(rows)
+
+
+def rebuild_return_moments():
+    """Полный пересчёт хранилища по всей истории цен."""
+    first_dates = dict(
+        HistoricalPrice.objects.values('asset_id').annotate(first_date=Min('date'))
+        .values_list('asset_id', 'first_date')
+    )
+    ReturnMoments.objects.all().delete()
+    return update_return_moments(first_dates)
+
+
+def moments_from_store(tickers, start_date, end_date=None, frequency=FREQUENCY):
+    """Годовые μ (с компаундингом) и S по котировкам окна [start_date, end_date].
+
+    Считает то же, что mean_historical_return и sample_cov, по доходностям
+    между соседними котировками каждого актива. Возвращает None, если в
+    хранилище нет данных по какому-либо тикеру.
+    """
+    ids = dict(Asset.objects.filter(ticker__in=tickers).values_list('ticker', 'id'))
+    if len(ids) < len(tickers):
+        return None
+    prices = HistoricalPrice.objects.filter(asset_id__in=ids.values(), date__gte=start_date)
+    if end_date is not None:
+        prices = prices.filter(date__lte=end_date)
+    bounds = {
+        asset_id: (first_date, last_date)
+        for asset_id, first_date, last_date in prices.values('asset_id')
+        .annotate(first_date=Min('date'), last_date=Max('date'))
+        .values_list('asset_id', 'first_date', 'last_date')
+    }
+    if len(bounds) < len(ids):
+        return None
+
+    dates = {date for first_last in bounds.values() for date in first_last}
+    rows = {
+        (i, j, date): np.array(sums, dtype=float)
+        for i, j, date, *sums in ReturnMoments.objects.filter(
+            asset_i_id__in=ids.values(), asset_j_id__in=ids.values(), date__in=dates
+        ).values_list('asset_i_id', 'asset_j_id', 'date', 'count', 'sum_i', 'sum_j', 'sum_ij', 'sum_log')
+    }
+
+    n = len(tickers)
+    mu = np.empty(n)
+    cov = np.empty((n, n))
+    for a in range(n):
+        for b in range(a, n):
+            i, j = sorted((ids[tickers[a]], ids[tickers[b]]))
+            start = rows.get((i, j, max(bounds[i][0], bounds[j][0])))
+            end = rows.get((i, j, max(bounds[i][1], bounds[j][1])))
+            if start is None or end is None:
+                return None
+            count, sum_i, sum_j, sum_ij, sum_log = end - start
+            if count < 2:
+                return None
+            cov[a, b] = cov[b, a] = (sum_ij - sum_i * sum_j / count) / (count - 1) * frequency
+            if a == b:
+                mu[a] = np.expm1(sum_log * frequency / count)
+
+    mu = pd.Series(mu, index=tickers)
+    S = risk_models.fix_nonpositive_semidefinite(pd.DataFrame(cov, index=tickers, columns=tickers))
+    return mu, S
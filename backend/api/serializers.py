@@ -19,7 +19,7 @@ TICKER_MAPPING = {
 class AssetSerializer(serializers.ModelSerializer):
     class Meta:
         model = Asset
-        fields = ['id', 'ticker', 'name', 'buy_price', 'current_price', 'quantity', 'instrument_type']
+        fields = ['id', 'ticker', 'name', 'buy_price', 'current_price', 'quantity', 'lot_size', 'instrument_type']
 
     def validate_ticker(self, value):
         ticker_lower = value.lower()
@@ -41,6 +41,9 @@ class AssetSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         ret = super().to_representation(instance)
+        # Компактный режим (?lean=1): только данные, без служебных ключей для формы
+        if self.context.get('lean'):
+            return ret
         for field_name in self.fields:
             ret[field_name] = ret.get(field_name, None) or ''
             ret.update({
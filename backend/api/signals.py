@@ -0,0 +1,42 @@
+import threading
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from . import table_versions
+from .models import Asset, HistoricalPrice
+from .return_moments import update_return_moments
+
+# Изменённые в текущей транзакции активы: {asset_id: самая ранняя изменённая дата}
+_pending = threading.local()
+
+
+@receiver(post_save, sender=Asset)
+@receiver(post_delete, sender=Asset)
+def bump_asset_version(sender, **kwargs):
+    # bulk_update сигналов не отправляет, такие места вызывают table_versions.bump сами
+    table_versions.bump(table_versions.ASSETS)
+
+
+def _flush_return_moments():
+    changed_since, _pending.changed_since = getattr(_pending, 'changed_since', {}), {}
+    if changed_since:
+        update_return_moments(changed_since)
+
+
+@receiver(post_save, sender=HistoricalPrice)
+@receiver(post_delete, sender=HistoricalPrice)
+def historical_price_changed(sender, instance, **kwargs):
+    # Правка или удаление отдельной строки (например, из админки или ORM). Пакетный upsert
+    # (price_store.save_historical_prices_many) сигналов не отправляет и обновляет всё сам
+    table_versions.bump(table_versions.asset_prices(instance.asset_id))
+    table_versions.bump(table_versions.HISTORICAL_PRICES)
+    if isinstance(kwargs.get('origin'), Asset) or getattr(kwargs.get('origin'), 'model', None) is Asset:
+        # Каскадное удаление актива: его статистики пар удаляются тем же каскадом
+        return
+    # Статистики пересчитываются после фиксации одним вызовом на транзакцию,
+    # а не на каждую строку удаляемого QuerySet
+    date = HistoricalPrice._meta.get_field('date').to_python(instance.date)
+    changed_since = getattr(_pending, 'changed_since', {})
+    changed_since[instance.asset_id] = min(changed_since.get(instance.asset_id, date), date)
+    _pending.changed_since = changed_since
+    transaction.on_commit(_flush_return_moments)
@@ -0,0 +1,283 @@
+import logging
+import math
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from . import executor
+from .optimization_methods import portfolio_metrics
+
+logger = logging.getLogger(__name__)
+
+# mvn — дневные доходности из нормального распределения с μ и S;
+# bootstrap — случайная выборка исторических дней с возвращением
+SIMULATION_METHODS = ['mvn', 'bootstrap']
+SIMULATION_MODES = ['portfolios', 'paths']
+
+# Число значений (строк × столбцов) в одной порции: ограничивает память процесса
+CHUNK_CELLS = getattr(settings, 'SIMULATION_CHUNK_CELLS', 2_000_000)
+MAX_SIMULATIONS = getattr(settings, 'MAX_SIMULATIONS', 1_000_000)
+# Ограничения режима paths: длина пути в днях и общее число значений simulations × horizon
+MAX_HORIZON = getattr(settings, 'MAX_SIMULATION_HORIZON', 2520)
+MAX_PATH_CELLS = getattr(settings, 'MAX_SIMULATION_CELLS', 100_000_000)
+BINS = 1000
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+CONFIDENCE_LEVELS = [0.95, 0.99]
+# Сколько случайных портфелей возвращается точками для графика облака
+SAMPLE_POINTS = 500
+# Ширина диапазона гистограммы доходности в стандартных отклонениях
+RANGE_SIGMAS = 8
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами: частичные результаты порций складываются.
+
+    Кроме числа значений в корзине хранится их сумма, поэтому CVaR
+    считается без хранения самих значений. Значения за пределами диапазона
+    попадают в крайние корзины; точные минимум и максимум хранятся отдельно.
+    """
+
+    def __init__(self, lo, hi, bins=BINS):
+        self.edges = np.linspace(lo, hi, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.sums = np.zeros(bins)
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        index = np.clip(np.searchsorted(self.edges, values, side='right') - 1, 0, len(self.counts) - 1)
+        self.counts += np.bincount(index, minlength=len(self.counts))
+        self.sums += np.bincount(index, weights=values, minlength=len(self.counts))
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.total_sq += float(values @ values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.sums += other.sums
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.count
+
+    def std(self):
+        return math.sqrt(max(self.total_sq / self.count - self.mean() ** 2, 0.0))
+
+    def quantile(self, q):
+        """Квантиль с линейной интерполяцией внутри корзины."""
+        position = q * self.count
+        cumulative = np.cumsum(self.counts)
+        b = min(int(np.searchsorted(cumulative, position, side='left')), len(self.counts) - 1)
+        before = cumulative[b] - self.counts[b]
+        fraction = (position - before) / self.counts[b] if self.counts[b] else 0.0
+        value = self.edges[b] + fraction * (self.edges[b + 1] - self.edges[b])
+        return float(min(max(value, self.min), self.max))
+
+    def tail_mean(self, q):
+        """Среднее значений ниже квантиля q (для CVaR); частичная корзина берётся пропорционально."""
+        needed = max(q * self.count, 1.0)
+        cumulative = np.cumsum(self.counts)
+        b = min(int(np.searchsorted(cumulative, needed, side='left')), len(self.counts) - 1)
+        before = cumulative[b] - self.counts[b]
+        partial = self.sums[b] * (needed - before) / self.counts[b] if self.counts[b] else 0.0
+        return float((self.sums[:b].sum() + partial) / needed)
+
+    def summary(self):
+        return {
+            'mean': self.mean(),
+            'std': self.std(),
+            'min': self.min,
+            'max': self.max,
+            'quantiles': {str(q): self.quantile(q) for q in QUANTILES},
+            'histogram': {'edges': self.edges.tolist(), 'counts': self.counts.tolist()},
+        }
+
+
+def _chunks(total, chunk_size, seed):
+    """Размеры порций и независимые генераторы для них (воспроизводимо при заданном seed)."""
+    sizes = [min(chunk_size, total - start) for start in range(0, total, chunk_size)]
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+
+def _run_chunks(fn, jobs):
+    results = executor.run_many(fn, jobs)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+def _check_simulations(simulations):
+    if not 1 <= simulations <= MAX_SIMULATIONS:
+        raise ValueError(f"simulations must be between 1 and {MAX_SIMULATIONS}")
+
+
+def check_paths_size(simulations, horizon):
+    """Проверяет размер задачи paths: длина пути ограничена, чтобы порция вмещала много путей."""
+    if not 1 <= horizon <= MAX_HORIZON:
+        raise ValueError(f"horizon must be between 1 and {MAX_HORIZON}")
+    if simulations * horizon > MAX_PATH_CELLS:
+        raise ValueError(f"simulations × horizon must not exceed {MAX_PATH_CELLS}")
+
+
+def _paths_chunk(size, seed, horizon, method, params, return_range):
+    """Порция путей: гистограммы итоговой доходности и максимальной просадки."""
+    rng = np.random.default_rng(seed)
+    if method == 'mvn':
+        mean, std = params
+        daily = rng.normal(mean, std, (size, horizon))
+    else:
+        daily = params[rng.integers(0, len(params), (size, horizon))]
+    wealth = np.cumprod(1 + daily, axis=1)
+    # Пик считается с начального капитала 1
+    peak = np.maximum.accumulate(np.maximum(wealth, 1.0), axis=1)
+    returns = Histogram(*return_range)
+    returns.add(wealth[:, -1] - 1)
+    drawdowns = Histogram(0.0, 1.0)
+    drawdowns.add((1 - wealth / peak).max(axis=1))
+    return returns, drawdowns
+
+
+def simulate_paths(weights, mu, S, returns_df, simulations=10000, horizon=252, method='mvn', seed=None):
+    """Распределение итоговой доходности и просадки портфеля с весами weights за horizon дней.
+
+    Портфель ежедневно ребалансируется к weights, поэтому для mvn его дневная
+    доходность нормальна с параметрами w·μ/252 и wᵀSw/252 и моделируется
+    сразу на уровне портфеля. bootstrap берёт исторические дни returns_df.
+    Пути генерируются порциями в пуле процессов; из порций возвращаются
+    только гистограммы, так что память не зависит от числа путей.
+    """
+    _check_simulations(simulations)
+    if method not in SIMULATION_METHODS:
+        raise ValueError(f"Unknown simulation method: {method}")
+    check_paths_size(simulations, horizon)
+    w = pd.Series(weights, dtype=float).reindex(mu.index).fillna(0.0)
+    if method == 'mvn':
+        mean = float(w @ mu) / 252
+        std = math.sqrt(max(float(w @ S @ w), 0.0) / 252)
+        params = (mean, std)
+    else:
+        params = returns_df.reindex(columns=mu.index).dropna(how='all').fillna(0.0).to_numpy() @ w.to_numpy()
+        if not len(params):
+            raise ValueError("No historical returns for bootstrap")
+        mean, std = float(params.mean()), float(params.std())
+    spread = RANGE_SIGMAS * std * math.sqrt(horizon)
+    return_range = (max(math.expm1(mean * horizon - spread), -1.0), math.expm1(mean * horizon + spread) + 1e-9)
+
+    chunk_size = max(1, CHUNK_CELLS // horizon)
+    jobs = [
+        (size, child, horizon, method, params, return_range)
+        for size, child in _chunks(simulations, chunk_size, seed)
+    ]
+    logger.info(f"Simulating {simulations} {method} paths over {horizon} days in {len(jobs)} chunks")
+    results = _run_chunks(_paths_chunk, jobs)
+    returns, drawdowns = results[0]
+    for chunk_returns, chunk_drawdowns in results[1:]:
+        returns.merge(chunk_returns)
+        drawdowns.merge(chunk_drawdowns)
+
+    return {
+        'simulations': simulations,
+        'horizon': horizon,
+        'method': method,
+        'weights': {ticker: float(value) for ticker, value in w.items()},
+        'terminal_return': returns.summary(),
+        'var': {str(level): -returns.quantile(1 - level) for level in CONFIDENCE_LEVELS},
+        'cvar': {str(level): -returns.tail_mean(1 - level) for level in CONFIDENCE_LEVELS},
+        'max_drawdown': drawdowns.summary(),
+    }
+
+
+def _portfolios_chunk(size, seed, concentration, mu, S, risk_free_rate, risk_edges, return_edges, sample):
+    """Порция случайных портфелей: двумерная гистограмма облака и лучшие портфели."""
+    rng = np.random.default_rng(seed)
+    weights = rng.dirichlet(np.full(len(mu), concentration), size)
+    expected = weights @ mu
+    risk = np.sqrt(np.maximum(np.einsum('ij,ij->i', weights @ S, weights), 0.0))
+    sharpe = np.divide(expected - risk_free_rate, risk, out=np.full_like(risk, -np.inf), where=risk > 0)
+    counts = np.histogram2d(
+        np.clip(risk, risk_edges[0], risk_edges[-1]), np.clip(expected, return_edges[0], return_edges[-1]),
+        [risk_edges, return_edges],
+    )[0].astype(np.int64)
+    best, safest = int(np.argmax(sharpe)), int(np.argmin(risk))
+    return {
+        'counts': counts,
+        'points': np.column_stack([expected[:sample], risk[:sample]]),
+        'max_sharpe': (float(sharpe[best]), weights[best]),
+        'min_volatility': (float(risk[safest]), weights[safest]),
+    }
+
+
+def random_portfolios(mu, S, returns_df=None, simulations=10000, risk_free_rate=0.02, concentration=1.0, seed=None,
+                      bins=50):
+    """Облако риск/доходность случайных портфелей с весами из распределения Дирихле.
+
+    Возвращает двумерную гистограмму облака (в процентах), до SAMPLE_POINTS
+    точек для графика и лучшие найденные портфели (максимум Шарпа и минимум
+    риска) с дополнительными метриками по returns_df.
+    """
+    _check_simulations(simulations)
+    if concentration <= 0:
+        raise ValueError("concentration must be positive")
+    mu_values, S_values = mu.to_numpy(dtype=float), S.to_numpy(dtype=float)
+    # Доходность выпуклой комбинации лежит между min(μ) и max(μ), риск — не выше риска самого рискованного актива
+    return_edges = np.linspace(mu_values.min(), mu_values.max() + 1e-12, bins + 1)
+    risk_edges = np.linspace(0.0, math.sqrt(max(float(np.diag(S_values).max()), 0.0)) + 1e-12, bins + 1)
+
+    chunk_size = max(1, CHUNK_CELLS // len(mu_values))
+    chunks = _chunks(simulations, chunk_size, seed)
+    jobs = []
+    remaining = SAMPLE_POINTS
+    for size, child in chunks:
+        jobs.append((size, child, concentration, mu_values, S_values, risk_free_rate, risk_edges, return_edges,
+                     min(remaining, size)))
+        remaining -= min(remaining, size)
+    logger.info(f"Sampling {simulations} random portfolios over {len(mu_values)} assets in {len(jobs)} chunks")
+    results = _run_chunks(_portfolios_chunk, jobs)
+
+    counts = sum(result['counts'] for result in results)
+    points = np.concatenate([result['points'] for result in results])
+    best = {
+        'max_sharpe': max((result['max_sharpe'] for result in results), key=lambda item: item[0])[1],
+        'min_volatility': min((result['min_volatility'] for result in results), key=lambda item: item[0])[1],
+    }
+    metrics = None
+    if returns_df is not None:
+        metrics = portfolio_metrics(
+            np.array(list(best.values())), returns_df.reindex(columns=list(mu.index)), risk_free_rate=risk_free_rate
+        )
+
+    portfolios = {}
+    for index, (name, weights) in enumerate(best.items()):
+        expected, risk = float(weights @ mu_values), math.sqrt(max(float(weights @ S_values @ weights), 0.0))
+        portfolios[name] = {
+            'weights': {ticker: float(value) for ticker, value in zip(mu.index, weights)},
+            'return': expected * 100,
+            'risk': risk * 100,
+            'sharpe': (expected - risk_free_rate) / risk if risk > 0 else 0.0,
+        }
+        if metrics is not None:
+            portfolios[name]['metrics'] = {metric: float(values[index]) for metric, values in metrics.items()}
+
+    return {
+        'simulations': simulations,
+        'cloud': {
+            'risk_edges': (risk_edges * 100).tolist(),
+            'return_edges': (return_edges * 100).tolist(),
+            'counts': counts.tolist(),
+        },
+        'points': [{'return': expected * 100, 'risk': risk * 100} for expected, risk in points],
+        **portfolios,
+    }
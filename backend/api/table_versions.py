@@ -0,0 +1,38 @@
+from django.db.models import F
+from django.utils import timezone
+from .models import TableVersion
+
+ASSETS = 'asset'
+HISTORICAL_PRICES = 'historical_price'
+
+
+def asset_prices(asset_id):
+    """Имя счётчика изменений исторических цен одного актива."""
+    return f'{HISTORICAL_PRICES}:{asset_id}'
+
+
+def bump(name):
+    """Увеличивает версию таблицы и возвращает новую.
+
+    Вызывается в той же транзакции, что и изменение данных: строка счётчика
+    остаётся заблокированной до фиксации, поэтому версии идут подряд.
+    """
+    now = timezone.now()
+    if not TableVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=now):
+        _, created = TableVersion.objects.get_or_create(name=name, defaults={'version': 1, 'updated_at': now})
+        if not created:
+            # Строку одновременно создал другой процесс
+            TableVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=now)
+    return get_version(name)[0]
+
+
+def get_version(name):
+    """(версия, время последнего изменения) таблицы; (0, None), если она ещё не менялась."""
+    row = TableVersion.objects.filter(name=name).values_list('version', 'updated_at').first()
+    return row if row is not None else (0, None)
+
+
+def get_versions(names):
+    """Версии нескольких счётчиков одним запросом: {имя: версия}, 0 для не менявшихся."""
+    versions = dict(TableVersion.objects.filter(name__in=list(names)).values_list('name', 'version'))
+    return {name: versions.get(name, 0) for name in names}
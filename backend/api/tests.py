@@ -1 +1,751 @@
+import os
+import tempfile
+import threading
+import time
+import types
+import zlib
+from unittest import mock
+import numpy as np
+import pandas as pd
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+from pypfopt import EfficientFrontier, expected_returns, risk_models
+from . import executor, jobs, middleware, price_archive, price_cache, simulation
+from .analytic_frontier import ClosedFormFrontier, CriticalLineFrontier
+from .frontier import efficient_frontier
+from .backtesting import RollingMoments, walk_forward
+from .covariance import Factorization, cached_covariance, estimate_covariance, factor_covariance
+import requests
+from .ingestion import refresh_historical_prices
+from .management.commands.backtest import _instrument_type
+from .models import Asset, HistoricalPrice, OptimizationJob, ReturnMoments
+from .return_moments import moments_from_store, rebuild_return_moments
+from .optimization_methods import _max_drawdown_lp, _max_rachev_lp, _max_sortino_qp, calculate_additional_metrics, portfolio_metrics, solve_scenario
+from .price_store import load_price_matrix, save_historical_prices, save_historical_prices_many
+from .rebalancing import _deviation, _greedy_lots, allocate_lots, compute_trades, rebalance, resolve_holdings
+
+
+class RebalanceTests(TestCase):
+    def setUp(self):
+        Asset.objects.create(ticker='SBER', name='SBER', current_price=100.0)
+        Asset.objects.create(ticker='GAZP', name='GAZP', current_price=71.0)
+        Asset.objects.create(ticker='LKOH', name='LKOH', current_price=150.0)
+
+    def test_holdings_and_prices_in_one_query(self):
+        portfolio = [{'ticker': 'SBER', 'quantity': 1}, {'ticker': 'SBER', 'quantity': 2}, {'ticker': 'NOPE', 'quantity': 5}]
+        with self.assertNumQueries(1):
+            result = rebalance({'SBER': 0.5, 'LKOH': 0.5}, portfolio)
+        self.assertEqual(result['total_value'], 300.0)
+        self.assertEqual(result['missing'], [])
+
+    def test_duplicate_tickers_are_summed(self):
+        holdings, _ = resolve_holdings([{'ticker': 'SBER', 'quantity': 1}, {'ticker': 'SBER', 'quantity': 2}])
+        self.assertEqual(holdings, {'SBER': 3})
+
+
+class LotAllocationTests(TestCase):
+    def test_allocation_fits_budget_and_beats_greedy(self):
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            costs = rng.uniform(1000, 20000, 6)
+            budget = 40000.0
+            targets = budget * rng.dirichlet(np.ones(6))
+            lots = allocate_lots(costs, targets, budget)
+            self.assertTrue((lots >= 0).all())
+            self.assertLessEqual(lots @ costs, budget + 1e-6)
+            greedy = _greedy_lots(costs, targets, budget)
+            self.assertLessEqual(_deviation(lots, costs, targets), _deviation(greedy, costs, targets) + 1e-6)
+
+    def test_off_target_holdings_are_sold(self):
+        prices = {'SBER': 100.0, 'GAZP': 71.0, 'LKOH': 150.0}
+        holdings = {'SBER': 3, 'GAZP': 2}
+        trades, cash = compute_trades({'SBER': 0.5, 'LKOH': 0.5}, prices, holdings, 442.0)
+        by_ticker = {trade['ticker']: trade for trade in trades}
+        self.assertEqual(by_ticker['GAZP']['action'], 'Продать')
+        self.assertEqual(by_ticker['GAZP']['quantity'], 2)
+
+        final = dict(holdings)
+        for trade in trades:
+            sign = 1 if trade['action'] == 'Купить' else -1
+            final[trade['ticker']] = final.get(trade['ticker'], 0) + sign * trade['quantity']
+        invested = sum(quantity * prices[ticker] for ticker, quantity in final.items())
+        self.assertEqual(final['GAZP'], 0)
+        self.assertLessEqual(invested, 442.0)
+        self.assertAlmostEqual(cash, 442.0 - invested)
+
+    def test_whole_lots(self):
+        trades, _ = compute_trades({'SBER': 1.0}, {'SBER': 100.0}, {}, 2500.0, lot_sizes={'SBER': 10})
+        self.assertEqual(trades[0]['quantity'], 20)
+
+    def test_short_weights_are_rejected(self):
+        with self.assertRaises(ValueError):
+            rebalance({'SBER': 1.2, 'GAZP': -0.2}, [], prices={'SBER': 100.0, 'GAZP': 71.0}, lot_sizes={'SBER': 1, 'GAZP': 1})
+
+
+def reference_metrics(weights, returns_df, risk_free_rate, L):
+    """Метрики одного портфеля средствами pandas — эталон для пакетного расчёта."""
+    portfolio_returns = returns_df @ weights
+    annualized_return = portfolio_returns.mean() * 252
+    downside_risk = np.sqrt((np.minimum(portfolio_returns - L, 0) ** 2).mean()) * np.sqrt(252)
+    ordered = np.sort(portfolio_returns.dropna().to_numpy())
+    reward = ordered[-int(np.ceil(0.05 * len(ordered))):].mean()
+    loss = -ordered[:int(np.ceil(0.05 * len(ordered)))].mean()
+    cumulative = (1 + portfolio_returns).cumprod()
+    max_drawdown = ((cumulative - cumulative.cummax()) / cumulative.cummax()).min()
+    return {
+        'sortino': (annualized_return - risk_free_rate) / downside_risk if downside_risk > 0 else 0,
+        'rachev': reward / loss if loss > 0 else 0,
+        'max_drawdown': max_drawdown,
+        'calmar': annualized_return / -max_drawdown if max_drawdown < 0 else 0,
+        'sterling': (annualized_return - risk_free_rate) / -max_drawdown if max_drawdown < 0 else 0,
+    }
+
+
+class PortfolioMetricsTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.returns = pd.DataFrame(rng.normal(0.0005, 0.02, (300, 5)), columns=list('ABCDE'))
+        self.weights = rng.dirichlet(np.ones(5), 40)
+
+    def test_batch_matches_single_portfolios(self):
+        for L in (0.0, 0.001):
+            batch = portfolio_metrics(self.weights, self.returns, risk_free_rate=0.02, L=L)
+            for k, weights in enumerate(self.weights):
+                expected = reference_metrics(weights, self.returns, 0.02, L)
+                single = calculate_additional_metrics(dict(zip('ABCDE', weights)), self.returns, 0.02, L)
+                for name, value in expected.items():
+                    self.assertAlmostEqual(batch[name][k], value, places=9)
+                    self.assertAlmostEqual(single[name], value, places=9)
+
+    def test_missing_days_are_skipped(self):
+        returns = self.returns.copy()
+        returns.iloc[:3, 0] = np.nan
+        batch = portfolio_metrics(self.weights[:1], returns)
+        expected = reference_metrics(self.weights[0], returns.iloc[3:], 0.02, 0.0)
+        self.assertAlmostEqual(batch['max_drawdown'][0], expected['max_drawdown'], places=9)
+        self.assertAlmostEqual(batch['sortino'][0], expected['sortino'], places=9)
+        self.assertAlmostEqual(batch['rachev'][0], expected['rachev'], places=9)
+
+    def test_reported_ratios_match_optimised_objective(self):
+        mu = self.returns.mean() * 252
+        S = self.returns.cov() * 252
+        for model in ('sortino', 'rachev'):
+            result = solve_scenario(mu, S, self.returns, model, frontier_points=0)
+            self.assertAlmostEqual(result['metrics'][model], result['performance'][2], places=9)
+            self.assertGreater(result['metrics'][model], 0)
+
+
+class SortinoOptimizationTests(TestCase):
+    def sortino(self, returns, weights, risk_free_rate, L):
+        portfolio_returns = returns @ weights
+        downside = np.sqrt(np.mean(np.minimum(portfolio_returns - L, 0) ** 2))
+        return (portfolio_returns.mean() - risk_free_rate / 252) / downside
+
+    def test_qp_ratio_is_not_beaten_by_feasible_portfolios(self):
+        rng = np.random.default_rng(12)
+        returns = rng.normal([0.0008, 0.0004, 0.0006, 0.0002], 0.015, (400, 4)) + rng.normal(0, 0.008, (400, 1))
+        candidates = np.vstack([np.eye(4), rng.dirichlet(np.ones(4), 2000)])
+        for L in (0.0, 0.0005):
+            weights = _max_sortino_qp(returns, risk_free_rate=0.02, L=L)
+            self.assertAlmostEqual(weights.sum(), 1.0)
+            self.assertGreaterEqual(weights.min(), 0.0)
+            best = max(self.sortino(returns, candidate, 0.02, L) for candidate in candidates)
+            self.assertGreaterEqual(self.sortino(returns, weights, 0.02, L), best - 1e-6)
+
+    def test_no_asset_above_risk_free_rate(self):
+        with self.assertRaises(ValueError):
+            _max_sortino_qp(np.full((20, 2), -0.001))
+
+
+class RachevOptimizationTests(TestCase):
+    def test_baskets_without_loss_tail_fall_back_to_max_reward(self):
+        returns = np.abs(np.random.default_rng(6).normal(0.01, 0.01, (50, 3)))
+        for scenarios in (returns, returns[:1]):
+            weights = _max_rachev_lp(scenarios)
+            self.assertAlmostEqual(weights.sum(), 1.0)
+            self.assertTrue((weights >= 0).all())
+
+    def test_single_losing_row(self):
+        weights = _max_rachev_lp(np.array([[0.01, -0.02, 0.03]]))
+        np.testing.assert_allclose(weights, [0.0, 0.0, 1.0], atol=1e-9)
+
+
+def max_drawdown(returns, weights):
+    # Просадка некомпаундированной накопленной доходности, как в постановке ЛП
+    cumulative = np.concatenate([[0.0], np.cumsum(returns @ weights)])
+    return float((np.maximum.accumulate(cumulative) - cumulative).max())
+
+
+class MaxDrawdownOptimizationTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(10)
+        self.returns = rng.normal(0.0005, 0.012, (300, 4)) + rng.normal(0, 0.008, (300, 1))
+
+    def test_lp_drawdown_is_not_beaten_by_feasible_portfolios(self):
+        weights = _max_drawdown_lp(self.returns)
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        self.assertGreaterEqual(weights.min(), -1e-9)
+        optimum = max_drawdown(self.returns, weights)
+        candidates = np.vstack([np.eye(4), np.random.default_rng(11).dirichlet(np.ones(4), 2000)])
+        best = min(max_drawdown(self.returns, candidate) for candidate in candidates)
+        self.assertLessEqual(optimum, best + 1e-9)
+
+    def test_asset_without_losses_gives_zero_drawdown(self):
+        returns = self.returns.copy()
+        returns[:, 2] = 0.001
+        weights = _max_drawdown_lp(returns)
+        self.assertAlmostEqual(max_drawdown(returns, weights), 0.0, places=9)
+        self.assertGreater(weights[2], 0.5)
+
+
+class SimulationTests(TestCase):
+    def test_merged_histograms_match_single_pass(self):
+        values = np.random.default_rng(2).normal(0.05, 0.2, 30000)
+        single = simulation.Histogram(-1.0, 1.0)
+        single.add(values)
+        merged = simulation.Histogram(-1.0, 1.0)
+        for chunk in np.array_split(values, 7):
+            part = simulation.Histogram(-1.0, 1.0)
+            part.add(chunk)
+            merged.merge(part)
+        np.testing.assert_array_equal(merged.counts, single.counts)
+        np.testing.assert_allclose(merged.sums, single.sums)
+        self.assertEqual((merged.count, merged.min, merged.max), (single.count, single.min, single.max))
+        self.assertAlmostEqual(merged.mean(), single.mean())
+        self.assertAlmostEqual(merged.std(), single.std())
+        for q in simulation.QUANTILES:
+            self.assertAlmostEqual(merged.quantile(q), single.quantile(q))
+        self.assertAlmostEqual(merged.tail_mean(0.05), single.tail_mean(0.05))
+
+    def test_histogram_risk_measures_are_close_to_exact(self):
+        values = np.random.default_rng(3).normal(0.05, 0.2, 100000)
+        histogram = simulation.Histogram(-1.0, 1.0)
+        histogram.add(values)
+        var = np.quantile(values, 0.05)
+        self.assertAlmostEqual(histogram.quantile(0.05), var, delta=2e-3)
+        self.assertAlmostEqual(histogram.tail_mean(0.05), values[values <= var].mean(), delta=2e-3)
+
+    def test_paths_are_split_into_chunks(self):
+        rng = np.random.default_rng(4)
+        returns = pd.DataFrame(rng.normal(0.0005, 0.01, (250, 2)), columns=['A', 'B'])
+        mu, S = returns.mean() * 252, returns.cov() * 252
+        with mock.patch.object(simulation, 'CHUNK_CELLS', 20 * 300), \
+                mock.patch.object(simulation.executor, 'WORKERS', 0):
+            result = simulation.simulate_paths({'A': 0.5, 'B': 0.5}, mu, S, returns, 1000, 20, 'bootstrap', seed=1)
+            again = simulation.simulate_paths({'A': 0.5, 'B': 0.5}, mu, S, returns, 1000, 20, 'bootstrap', seed=1)
+        self.assertEqual(sum(result['terminal_return']['histogram']['counts']), 1000)
+        self.assertEqual(sum(result['max_drawdown']['histogram']['counts']), 1000)
+        self.assertEqual(result, again)
+
+
+    def test_path_size_is_bounded(self):
+        returns = pd.DataFrame(np.zeros((10, 2)), columns=['A', 'B'])
+        mu, S = returns.mean(), returns.cov()
+        for simulations, horizon in ((10, simulation.MAX_HORIZON + 1), (simulation.MAX_SIMULATIONS, 252), (10, 0)):
+            with self.assertRaises(ValueError):
+                simulation.simulate_paths({'A': 1.0}, mu, S, returns, simulations, horizon)
+
+    def test_api_rejects_oversized_paths(self):
+        for payload in ({'horizon': 1_000_000}, {'horizon': 252, 'simulations': 1_000_000}):
+            response = self.client.post(
+                '/api/simulate/', {'tickers': 'SBER,GAZP', 'mode': 'paths', **payload}, content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class BacktestTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.prices = pd.DataFrame(
+            100 * np.cumprod(1 + rng.normal(0.0005, 0.015, (300, 3)), axis=0),
+            columns=['A', 'B', 'C'],
+            index=pd.bdate_range('2023-01-02', periods=300).date,
+        )
+
+    def test_rolling_moments_match_full_estimates(self):
+        returns = self.prices.pct_change().iloc[1:].to_numpy()
+        moments = RollingMoments(returns)
+        for start in (0, 20, 40, 150):
+            moments.move(start, start + 100)
+            mu, S = moments.estimate()
+            window = self.prices.iloc[start:start + 101]
+            np.testing.assert_allclose(mu, expected_returns.mean_historical_return(window).to_numpy())
+            np.testing.assert_allclose(S, risk_models.sample_cov(window).to_numpy())
+
+    def test_command_resolves_types_like_the_api(self):
+        self.assertEqual(_instrument_type('sberbond=bonds'), ('RU000A0JX0J2', 'bonds'))
+        self.assertEqual(_instrument_type('sber.me=etf'), ('SBER', 'etf'))
+        with self.assertRaises(ValueError):
+            _instrument_type('SBER=futures')
+
+    def test_no_lookahead(self):
+        params = {'model': 'max_drawdown', 'lookback': 60, 'rebalance_every': 20}
+        with mock.patch('api.executor.WORKERS', 0):
+            base = walk_forward(self.prices, **params)
+            for k in (1, 4, 8):
+                cutoff = base['rebalances'][k]['date']
+                shocked = self.prices.copy()
+                after = np.array([str(date) >= cutoff for date in shocked.index])
+                shocked.loc[after] *= np.linspace(0.5, 2.0, after.sum())[:, None] * [1.0, 0.7, 1.3]
+                result = walk_forward(shocked, **params)
+                # Решения по дату cutoff включительно не зависят от цен начиная с неё
+                self.assertEqual(result['rebalances'][:k + 1], base['rebalances'][:k + 1])
+                self.assertEqual(result['rebalances'][k + 1:][0]['date'], base['rebalances'][k + 1]['date'])
+                self.assertNotEqual(result['rebalances'][k + 1]['weights'], base['rebalances'][k + 1]['weights'])
+
+
+class PriceStoreTests(TestCase):
+    def setUp(self):
+        self.asset = Asset.objects.create(ticker='SBER', name='SBER', current_price=1.0)
+        self.dates = pd.bdate_range('2024-01-01', periods=4).date
+
+    def test_upsert_counts_inserted_and_updated_rows(self):
+        counts = save_historical_prices(self.asset, [{'date': date, 'price': 100.0} for date in self.dates[:3]])
+        self.assertEqual(counts, {'inserted': 3, 'updated': 0})
+        # Пакеты по 2 строки; повтор даты внутри пакета схлопывается, побеждает последнее значение
+        prices = [
+            {'date': self.dates[1], 'price': 1.0},
+            {'date': self.dates[1], 'price': 2.0},
+            {'date': self.dates[2], 'price': 3.0},
+            {'date': self.dates[3], 'price': 4.0},
+        ]
+        counts = save_historical_prices(self.asset, iter(prices), batch_size=2)
+        self.assertEqual(counts, {'inserted': 1, 'updated': 2})
+        stored = dict(HistoricalPrice.objects.filter(asset=self.asset).values_list('date', 'price'))
+        self.assertEqual(stored, {self.dates[0]: 100.0, self.dates[1]: 2.0, self.dates[2]: 3.0, self.dates[3]: 4.0})
+
+
+class PriceCacheTests(TestCase):
+    def test_fresh_price_is_served_without_fetching(self):
+        Asset.objects.create(ticker='SBER', name='SBER', current_price=300.0, price_updated_at=timezone.now())
+        with mock.patch('api.price_cache.fetch_current_price') as fetch, \
+                mock.patch('api.price_cache.refresh_price') as refresh:
+            self.assertEqual(price_cache.get_current_price('SBER'), 300.0)
+        fetch.assert_not_called()
+        refresh.assert_not_called()
+
+    def test_stale_price_is_served_and_refreshed_in_background(self):
+        updated_at = timezone.now() - pd.Timedelta(seconds=price_cache.PRICE_TTL + 1)
+        Asset.objects.create(ticker='SBER', name='SBER', current_price=300.0, price_updated_at=updated_at)
+        with mock.patch('api.price_cache.refresh_price') as refresh:
+            self.assertEqual(price_cache.get_current_price('SBER'), 300.0)
+            self.assertEqual(price_cache.get_current_price('SBER', allow_fetch=False), 300.0)
+        refresh.assert_called_once_with('SBER', 'shares', background=True)
+
+    def test_missing_price_is_fetched_and_stored(self):
+        with mock.patch('api.price_cache.fetch_current_price', return_value=135.0) as fetch:
+            self.assertIsNone(price_cache.get_current_price('GAZP', allow_fetch=False))
+            self.assertEqual(price_cache.get_current_price('GAZP'), 135.0)
+            self.assertEqual(price_cache.get_current_price('GAZP'), 135.0)
+        fetch.assert_called_once_with('GAZP', instrument_type='shares')
+        self.assertTrue(price_cache.is_fresh(Asset.objects.get(ticker='GAZP')))
+
+    def test_concurrent_refreshes_share_one_request(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_store(ticker, instrument_type):
+            started.set()
+            release.wait(5)
+            return 42.0
+
+        with mock.patch('api.price_cache._store_price', side_effect=slow_store) as store:
+            first = {}
+            thread = threading.Thread(target=lambda: first.setdefault('future', price_cache.refresh_price('SBER')))
+            thread.start()
+            self.assertTrue(started.wait(5))
+            second = price_cache.refresh_price('SBER', background=True)
+            release.set()
+            thread.join(5)
+        self.assertIs(second, first['future'])
+        self.assertEqual(second.result(5), 42.0)
+        store.assert_called_once()
+        self.assertNotIn('SBER', price_cache._inflight)
+
+
+class CovarianceTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(16)
+        returns = rng.normal(0.0005, 0.01, (260, 5)) + rng.normal(0, 0.01, (260, 1))
+        self.prices = pd.DataFrame(100 * np.cumprod(1 + returns, axis=0), columns=list('ABCDE'))
+
+    def test_estimators_match_pypfopt(self):
+        shrinkage = risk_models.CovarianceShrinkage(self.prices)
+        pd.testing.assert_frame_equal(estimate_covariance(self.prices, 'sample'), risk_models.sample_cov(self.prices))
+        pd.testing.assert_frame_equal(estimate_covariance(self.prices, 'ledoit_wolf'), shrinkage.ledoit_wolf())
+        pd.testing.assert_frame_equal(estimate_covariance(self.prices, 'oas'), shrinkage.oracle_approximating())
+        with self.assertRaises(ValueError):
+            estimate_covariance(self.prices, 'unknown')
+
+    def test_factor_model_keeps_variances_and_is_positive_definite(self):
+        sample = risk_models.sample_cov(self.prices)
+        for factors in (1, 2, 10):
+            S = factor_covariance(self.prices, factors=factors)
+            np.testing.assert_allclose(S.to_numpy(), S.to_numpy().T)
+            np.testing.assert_allclose(np.diag(S), np.diag(sample))
+            self.assertGreater(np.linalg.eigvalsh(S).min(), 0.0)
+
+    def test_cache_is_keyed_by_data_version(self):
+        with mock.patch('api.covariance.estimate_covariance', wraps=estimate_covariance) as estimate:
+            first = cached_covariance(self.prices, 'oas', 'covariance-test-1')
+            self.assertIs(cached_covariance(self.prices, 'oas', 'covariance-test-1'), first)
+            cached_covariance(self.prices, 'oas', 'covariance-test-2')
+        self.assertEqual(estimate.call_count, 2)
+
+    def test_factorization_solves_and_falls_back_on_singular_matrix(self):
+        S = risk_models.sample_cov(self.prices).to_numpy()
+        b = np.arange(1.0, 6.0)
+        np.testing.assert_allclose(Factorization(S).solve(b), np.linalg.solve(S, b))
+        singular = np.ones((3, 3))
+        factorization = Factorization(singular)
+        self.assertIsNone(factorization.cholesky)
+        np.testing.assert_allclose(factorization.solve(np.ones(3)), np.full(3, 1 / 3))
+
+
+class ReturnMomentsTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.dates = pd.bdate_range('2024-01-01', periods=60).date
+        self.prices = pd.DataFrame(
+            100 * np.cumprod(1 + rng.normal(0.0005, 0.02, (60, 3)), axis=0), index=self.dates, columns=['A', 'B', 'C']
+        )
+        self.assets = {ticker: Asset.objects.create(ticker=ticker, name=ticker, current_price=1.0) for ticker in 'ABC'}
+        # Первая половина истории, затем дозагрузка — как при ежедневном обновлении
+        for rows in (self.prices.iloc[:40], self.prices.iloc[40:]):
+            save_historical_prices_many({
+                self.assets[ticker]: [{'date': date, 'price': price} for date, price in rows[ticker].items()]
+                for ticker in 'ABC'
+            })
+
+    def assertStoreMatchesPrices(self):
+        mu, S = moments_from_store(['A', 'B', 'C'], self.dates[0], self.dates[-1])
+        np.testing.assert_allclose(mu, expected_returns.mean_historical_return(self.prices).to_numpy())
+        np.testing.assert_allclose(S, risk_models.sample_cov(self.prices).to_numpy())
+
+    def test_incremental_updates_match_full_estimates(self):
+        self.assertStoreMatchesPrices()
+        stored = ReturnMoments.objects.count()
+        rebuild_return_moments()
+        self.assertEqual(ReturnMoments.objects.count(), stored)
+        self.assertStoreMatchesPrices()
+
+    def test_orm_edit_updates_store(self):
+        row = HistoricalPrice.objects.get(asset=self.assets['B'], date=self.dates[10])
+        row.price *= 3
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+        self.prices.loc[self.dates[10], 'B'] = row.price
+        self.assertStoreMatchesPrices()
+
+    def test_orm_delete_updates_store(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            HistoricalPrice.objects.filter(date=self.dates[20]).delete()
+        self.prices = self.prices.drop(index=self.dates[20])
+        self.assertStoreMatchesPrices()
+
+
+def sleep_and_return(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+@mock.patch.object(executor, 'WORKERS', 2)
+class ExecutorTests(TestCase):
+    def tearDown(self):
+        executor.shutdown(wait=False)
+
+    def test_run_many_returns_results_in_order(self):
+        self.assertEqual(executor.run_many(sleep_and_return, [(0.01, k) for k in range(5)]), list(range(5)))
+
+    def test_timeout_does_not_fail_other_jobs(self):
+        collateral = executor.submit(sleep_and_return, 1.0, 'other request')
+        with self.assertRaises(executor.JobTimeout):
+            executor.run(sleep_and_return, 30, 'hung', timeout=0.3)
+        # Пул с зависшей задачей остановлен, чужая задача перезапущена в новом пуле
+        self.assertEqual(collateral.result(timeout=10), 'other request')
+
+    def test_run_many_cancels_only_timed_out_jobs(self):
+        results = []
+        worker = threading.Thread(target=lambda: results.append(
+            executor.run_many(sleep_and_return, [(0.8, 'other request')], timeout=5)
+        ))
+        with mock.patch.object(executor, 'WORKERS', 3):
+            worker.start()
+            time.sleep(0.2)
+            timed_out = executor.run_many(sleep_and_return, [(30, 'hung'), (0.01, 'fast')], timeout=0.5)
+            worker.join(10)
+        self.assertIsInstance(timed_out[0], executor.JobTimeout)
+        self.assertEqual(timed_out[1], 'fast')
+        self.assertEqual(results, [['other request']])
+
+    def test_queued_job_is_cancelled_without_restarting_pool(self):
+        with mock.patch.object(executor, 'WORKERS', 1):
+            # ProcessPoolExecutor заранее передаёт процессам max_workers + 1 задач, их уже не отменить
+            started = [executor.submit(sleep_and_return, 0.3, k) for k in range(2)]
+            queued = executor.submit(sleep_and_return, 0.3, 'queued')
+            pool = executor.get_pool()
+            executor.cancel(queued)
+            self.assertTrue(queued.cancelled())
+            self.assertIs(executor.get_pool(), pool)
+            self.assertEqual([future.result(timeout=10) for future in started], [0, 1])
+
+
+class JobQueueTests(TestCase):
+    def test_jobs_are_claimed_oldest_first_once(self):
+        first, second = jobs.create_job({'n': 1}), jobs.create_job({'n': 2})
+        claimed = jobs.claim_next_job()
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual(claimed.status, OptimizationJob.RUNNING)
+        self.assertIsNotNone(claimed.started_at)
+        self.assertEqual(jobs.claim_next_job().pk, second.pk)
+        self.assertIsNone(jobs.claim_next_job())
+
+    def test_stale_running_job_is_requeued(self):
+        job = jobs.create_job({'n': 1})
+        self.assertEqual(jobs.claim_next_job().pk, job.pk)
+        self.assertIsNone(jobs.claim_next_job())
+        stale = timezone.now() - pd.Timedelta(seconds=jobs.STALE_AFTER + 1)
+        OptimizationJob.objects.filter(pk=job.pk).update(updated_at=stale, progress=3)
+        requeued = jobs.claim_next_job()
+        self.assertEqual(requeued.pk, job.pk)
+        self.assertEqual(requeued.progress, 0)
+        self.assertGreater(requeued.updated_at, stale)
+
+    def test_job_taken_by_another_worker_is_skipped(self):
+        first, second = jobs.create_job({'n': 1}), jobs.create_job({'n': 2})
+        original_update = type(OptimizationJob.objects.none()).update
+
+        def race(queryset, **kwargs):
+            # Другой воркер успевает забрать первую задачу между чтением и условным UPDATE
+            if not race.done:
+                race.done = True
+                OptimizationJob.objects.filter(pk=first.pk).update(status=OptimizationJob.RUNNING)
+            return original_update(queryset, **kwargs)
+
+        race.done = False
+        with mock.patch.object(type(OptimizationJob.objects.none()), 'update', race):
+            self.assertEqual(jobs.claim_next_job().pk, second.pk)
+
+    def test_finished_and_failed_payloads(self):
+        job = jobs.create_job({'n': 1})
+        jobs.finish_job(job, {'weights': {'SBER': 1.0}})
+        payload = jobs.job_payload(OptimizationJob.objects.get(pk=job.pk))
+        self.assertEqual(payload['status'], OptimizationJob.DONE)
+        self.assertEqual(payload['result'], {'weights': {'SBER': 1.0}})
+        self.assertEqual(payload['progress'], {'completed': 1, 'total': 1})
+        jobs.fail_job(job, 'boom')
+        self.assertEqual(jobs.job_payload(OptimizationJob.objects.get(pk=job.pk))['error'], 'boom')
+
+
+class PriceArchiveTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(price_archive, 'ARCHIVE_DIR', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dates = pd.bdate_range('2024-01-01', periods=10).date
+        self.assets = [Asset.objects.create(ticker=ticker, name=ticker, current_price=1.0) for ticker in ('A', 'B')]
+        self.save({asset: [{'date': date, 'price': 100.0 + k} for k, date in enumerate(self.dates)] for asset in self.assets})
+
+    def save(self, prices):
+        with self.captureOnCommitCallbacks(execute=True):
+            save_historical_prices_many(prices)
+
+    def assertMatchesDatabase(self):
+        archived = load_price_matrix(['A', 'B'], None)
+        with mock.patch.object(price_archive, 'ARCHIVE_DIR', None):
+            pd.testing.assert_frame_equal(archived, load_price_matrix(['A', 'B'], None))
+
+    def test_merged_archive_matches_database(self):
+        self.save({self.assets[0]: [{'date': self.dates[3], 'price': 1.0}, {'date': self.dates[-1] + pd.Timedelta(days=3), 'price': 2.0}]})
+        self.assertEqual(price_archive.read_archive(self.assets[0].pk)['price'][3], 1.0)
+        self.assertMatchesDatabase()
+
+    def test_orm_edit_invalidates_archive(self):
+        load_price_matrix(['A', 'B'], None)
+        row = HistoricalPrice.objects.get(asset=self.assets[1], date=self.dates[5])
+        row.price = 7.0
+        row.save()
+        self.assertEqual(load_price_matrix(['B'], None)['B'].iloc[5], 7.0)
+
+    def test_files_are_readable_by_other_users(self):
+        for path in (price_archive.archive_path(self.assets[0].pk), price_archive.version_path(self.assets[0].pk)):
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+    def test_unwritable_archive_falls_back_to_database(self):
+        os.remove(price_archive.archive_path(self.assets[0].pk))
+        with mock.patch.object(price_archive, 'archive_lock', side_effect=PermissionError('read-only')):
+            self.assertMatchesDatabase()
+        with mock.patch.object(price_archive, 'read_archive', side_effect=lambda asset_id: None), \
+                mock.patch.object(price_archive, '_replace', side_effect=PermissionError('read-only')):
+            self.save({self.assets[0]: [{'date': self.dates[0], 'price': 5.0}]})
+
+    def test_databases_do_not_share_files(self):
+        with mock.patch.dict(connection.settings_dict, {'NAME': 'other.sqlite3'}):
+            other = price_archive.archive_dir()
+        self.assertNotEqual(other, price_archive.archive_dir())
+        self.assertTrue(price_archive.archive_path(1).startswith(price_archive.archive_dir()))
+
+
+def iss_history_pages(dates, page_size=100, fail_at=None):
+    """Ответы ISS history с курсором: по page_size строк начиная с params['start']."""
+    def iss_get(url, params=None):
+        start = params['start']
+        if fail_at is not None and start >= fail_at:
+            raise requests.ConnectionError('connection reset')
+        rows = [[str(date), 0, 0, 100.0 + k] for k, date in enumerate(dates)][start:start + page_size]
+        return {
+            'history': {'columns': ['TRADEDATE', 'BOARDID', 'SECID', 'CLOSE'], 'data': rows},
+            'history.cursor': {'columns': ['INDEX', 'TOTAL', 'PAGESIZE'], 'data': [[start, len(dates), page_size]]},
+        }
+    return iss_get
+
+
+class IngestionTests(TestCase):
+    def setUp(self):
+        self.asset = Asset.objects.create(ticker='SBER', name='SBER', current_price=1.0)
+        self.dates = pd.bdate_range(end=pd.Timestamp.now().normalize() - pd.Timedelta(days=1), periods=350).date
+
+    def test_history_is_streamed_page_by_page(self):
+        with mock.patch('api.historical_data.iss_get', side_effect=iss_history_pages(self.dates)) as iss_get, \
+                mock.patch('api.ingestion.save_historical_prices', wraps=save_historical_prices) as save:
+            counts = refresh_historical_prices([self.asset], lookback_days=600)
+        self.assertEqual(counts, {'inserted': 350, 'updated': 0})
+        self.assertEqual(iss_get.call_count, 4)
+        # В save_historical_prices уходит генератор строк, а не собранный список
+        self.assertIsInstance(save.call_args.args[1], types.GeneratorType)
+        self.assertEqual(HistoricalPrice.objects.filter(asset=self.asset).count(), 350)
+
+    def test_network_error_rolls_back_only_that_asset(self):
+        other = Asset.objects.create(ticker='GAZP', name='GAZP', current_price=1.0)
+        pages = iss_history_pages(self.dates)
+        failing = iss_history_pages(self.dates, fail_at=200)
+        with mock.patch('api.historical_data.iss_get', side_effect=lambda url, params=None: (
+            failing if 'SBER' in url else pages
+        )(url, params)):
+            counts = refresh_historical_prices([self.asset, other], lookback_days=600)
+        self.assertEqual(counts['inserted'], 350)
+        self.assertFalse(HistoricalPrice.objects.filter(asset=self.asset).exists())
+
+
+class HistoricalPricesBulkTests(TestCase):
+    def setUp(self):
+        self.dates = pd.bdate_range('2024-01-01', periods=5).date
+        self.assets = [Asset.objects.create(ticker=ticker, name=ticker, current_price=1.0) for ticker in ('SBER', 'GAZP')]
+        save_historical_prices_many({
+            asset: [{'date': date, 'price': 100.0 + k} for k, date in enumerate(self.dates)] for asset in self.assets
+        })
+        self.url = '/api/historical-prices/bulk/?tickers=SBER,GAZP&fill=ffill'
+
+    def test_unchanged_data_is_not_modified_without_loading_prices(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['prices']['SBER'][0], 100.0)
+        with mock.patch('api.views.load_price_matrix') as load, self.assertNumQueries(2):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        load.assert_not_called()
+
+    def test_price_changes_and_params_change_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertNotEqual(self.client.get(self.url + '&from=2024-01-02')['ETag'], etag)
+        row = HistoricalPrice.objects.get(asset=self.assets[1], date=self.dates[2])
+        row.price = 1.0
+        row.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['prices']['GAZP'][2], 1.0)
+
+
+class ConditionalResponseTests(TestCase):
+    def setUp(self):
+        self.asset = Asset.objects.create(ticker='SBER', name='SBER', current_price=300.0, price_updated_at=timezone.now())
+
+    def test_asset_list_is_not_modified_until_assets_change(self):
+        response = self.client.get('/api/assets/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        cached = self.client.get('/api/assets/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        cached = self.client.get('/api/assets/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertNotEqual(self.client.get('/api/assets/?lean=1')['ETag'], response['ETag'])
+        self.asset.current_price = 310.0
+        self.asset.save()
+        changed = self.client.get('/api/assets/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()[0]['current_price'], 310.0)
+
+    def test_price_is_not_modified_until_assets_change(self):
+        response = self.client.get('/api/price/?ticker=sber')
+        self.assertEqual(response.json(), {'ticker': 'SBER', 'price': 300.0})
+        self.assertEqual(self.client.get('/api/price/?ticker=SBER', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Asset.objects.create(ticker='GAZP', name='GAZP', current_price=135.0, price_updated_at=timezone.now())
+        self.assertNotEqual(self.client.get('/api/price/?ticker=GAZP')['ETag'], response['ETag'])
+        self.assertEqual(self.client.get('/api/price/?ticker=SBER', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class AnalyticFrontierTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(8)
+        returns = pd.DataFrame(rng.normal(0.0006, 0.015, (250, 6)) + rng.normal(0, 0.01, (250, 1)), columns=list('ABCDEF'))
+        self.mu, self.S = returns.mean() * 252, returns.cov() * 252
+
+    def test_critical_line_matches_long_only_qp(self):
+        frontier = CriticalLineFrontier(self.mu, self.S)
+        for target in np.linspace(self.mu.min() + 0.01, self.mu.max() - 0.01, 5):
+            weights = frontier.weights_for_return(target)
+            ef = EfficientFrontier(self.mu, self.S)
+            ef.efficient_return(target)
+            self.assertGreaterEqual(weights.min(), -1e-9)
+            self.assertAlmostEqual(frontier.performance(weights)[1], ef.portfolio_performance()[1], places=5)
+        ef = EfficientFrontier(self.mu, self.S)
+        ef.max_sharpe(risk_free_rate=0.02)
+        frontier.max_sharpe(risk_free_rate=0.02)
+        self.assertAlmostEqual(
+            frontier.portfolio_performance(risk_free_rate=0.02)[2], ef.portfolio_performance(risk_free_rate=0.02)[2],
+            places=5,
+        )
+
+    def test_warm_started_qp_sweep_matches_independent_solves(self):
+        points = efficient_frontier(self.mu, self.S, 8, 'qp')
+        self.assertEqual(len(points), 8)
+        cla_points = efficient_frontier(self.mu, self.S, 8, 'cla')
+        for (expected_return, risk, weights), (_, cla_risk, _) in zip(points, cla_points):
+            self.assertAlmostEqual(weights.sum(), 1.0, places=6)
+            self.assertGreaterEqual(weights.min(), -1e-6)
+            self.assertAlmostEqual(risk, cla_risk, places=5)
+
+    def test_closed_form_frontier_is_budget_constrained_minimum_variance(self):
+        frontier = ClosedFormFrontier(self.mu, self.S)
+        target = float(self.mu.mean())
+        weights = frontier.weights_for_return(target)
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        self.assertAlmostEqual(float(self.mu @ weights), target)
+        # Градиент дисперсии лежит в линейной оболочке ограничений (1, μ)
+        gradient = self.S.to_numpy() @ weights
+        basis = np.column_stack([np.ones(len(self.mu)), self.mu])
+        residual = gradient - basis @ np.linalg.lstsq(basis, gradient, rcond=None)[0]
+        np.testing.assert_allclose(residual, 0.0, atol=1e-10)
+
+
+class CompressionTests(TestCase):
+    def setUp(self):
+        Asset.objects.bulk_create([Asset(ticker=f'T{k}', name=f'Asset {k}', current_price=100.0 + k) for k in range(20)])
+
+    def test_gzip_without_brotli(self):
+        with mock.patch.object(middleware, 'brotli', None):
+            response = self.client.get('/api/assets/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_brotli_when_accepted(self):
+        fake_brotli = mock.Mock(compress=lambda content, quality: zlib.compress(content))
+        with mock.patch.object(middleware, 'brotli', fake_brotli):
+            response = self.client.get('/api/assets/', HTTP_ACCEPT_ENCODING='gzip, br')
+            plain = self.client.get('/api/assets/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(plain['Content-Encoding'], 'gzip')
@@ -2,9 +2,15 @@ from django.urls import path
 from .views import (
     AssetListCreate,
     AssetDetail,
+    backtest_portfolio,
     get_price,
     optimize_portfolio,
+    optimize_portfolio_batch,
     get_historical_prices,
+    get_historical_prices_bulk,
+    get_optimization_job,
+    rebalance_portfolio,
+    simulate_portfolio,
 )
 
 urlpatterns = [
@@ -12,5 +18,11 @@ urlpatterns = [
     path('assets/<int:pk>/', AssetDetail.as_view(), name='asset-detail'),
     path('price/', get_price, name='get-price'),
     path('optimize/', optimize_portfolio, name='optimize-portfolio'),
+    path('optimize/batch/', optimize_portfolio_batch, name='optimize-portfolio-batch'),
+    path('rebalance/', rebalance_portfolio, name='rebalance-portfolio'),
+    path('simulate/', simulate_portfolio, name='simulate-portfolio'),
+    path('backtest/', backtest_portfolio, name='backtest-portfolio'),
     path('historical-prices/', get_historical_prices, name='get-historical-prices'),
+    path('historical-prices/bulk/', get_historical_prices_bulk, name='get-historical-prices-bulk'),
+    path('jobs/<uuid:job_id>/', get_optimization_job, name='optimization-job'),
 ]
\ No newline at end of file
@@ -1,46 +1,63 @@
-import requests
 from datetime import datetime, timedelta
-import pandas as pd
 import logging
 import numpy as np
 from rest_framework import generics
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Asset, HistoricalPrice
+from .models import Asset, OptimizationJob
 from .serializers import AssetSerializer
-from .historical_data import fetch_current_price, fetch_historical_prices
-from pypfopt import expected_returns, risk_models, EfficientFrontier
-from .optimization_methods import (
-    optimize_markowitz,
-    optimize_sharpe,
-    optimize_sortino,
-    optimize_rachev,
-    optimize_max_drawdown,
-    calculate_additional_metrics
+from . import table_versions
+from .conditional import conditional_response, make_etag
+from .downsampling import DOWNSAMPLING_METHODS, lttb, ohlc
+from .ingestion import load_history
+from .optimization_service import (
+    COV_ESTIMATORS,
+    FETCH_ON_REQUEST,
+    FRONTIER_METHODS,
+    FRONTIER_POINTS,
+    MAX_FRONTIER_POINTS,
+    MAX_HORIZON,
+    MAX_PATH_CELLS,
+    MODELS,
+    SIMULATION_METHODS,
+    SIMULATION_MODES,
+    TICKER_MAPPING,
+    OptimizationError,
+    OptimizationTimeout,
+    build_optimization_result,
+    resolve_tickers,
+    run_batch,
+    run_simulation,
+    summarize_optimization,
 )
+from .backtesting import BACKTEST_COST_BPS, BACKTEST_LOOKBACK, BACKTEST_REBALANCE_EVERY, run_backtest
+from .jobs import create_job, job_payload
+from .price_cache import get_current_price
+from .price_store import load_price_matrix, price_series
+from .rebalancing import rebalance
 
 logger = logging.getLogger(__name__)
 
-TICKER_MAPPING = {
-    'sberbank': 'SBER',
-    'gazprom': 'GAZP',
-    'lukoil': 'LKOH',
-    'yandex': 'YDEX',
-    'rosneft': 'ROSN',
-    'nornickel': 'GMKN',
-    'tatneft': 'TATN',
-    'novatek': 'NVTK',
-    'ofz26207': 'SU26207RMFS9',
-    'sberbond': 'RU000A0JX0J2',
-    'finamrussia': 'FXRL',
-    'sberetf': 'SBSP',
-}
+def _is_lean(request):
+    return request.GET.get('lean', '').lower() in ('1', 'true', 'yes')
 
 class AssetListCreate(generics.ListCreateAPIView):
     queryset = Asset.objects.all()
     serializer_class = AssetSerializer
 
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'lean': _is_lean(self.request)}
+
+    def list(self, request, *args, **kwargs):
+        # Версия таблицы читается до данных: при гонке с записью клиент просто получит данные ещё раз
+        version, updated_at = table_versions.get_version(table_versions.ASSETS)
+        etag = make_etag(table_versions.ASSETS, version, request.GET.urlencode())
+        return conditional_response(
+            request, lambda: super(AssetListCreate, self).list(request, *args, **kwargs), etag=etag,
+            last_modified=updated_at,
+        )
+
     def create(self, request, *args, **kwargs):
         ticker = request.data.get('ticker')
         logger.info(f"Received request to create/update asset with data: {request.data}")
@@ -73,6 +90,9 @@ class AssetDetail(generics.RetrieveUpdateDestroyAPIView):
     queryset = Asset.objects.all()
     serializer_class = AssetSerializer
 
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'lean': _is_lean(self.request)}
+
     def get_object(self):
         try:
             return super().get_object()
@@ -103,15 +123,8 @@ def get_price(request):
             instrument_type = "shares"
 
     try:
-        asset = Asset.objects.get(ticker=normalized_ticker)
-        if asset.current_price > 0:
-            logger.info(f"Using cached price for {normalized_ticker}: {asset.current_price}")
-            return Response({'ticker': normalized_ticker, 'price': float(asset.current_price)})
-    except Asset.DoesNotExist:
-        logger.info(f"Asset {normalized_ticker} not found in database, fetching from API")
-
-    try:
-        price = fetch_current_price(normalized_ticker, instrument_type=instrument_type)
+        version, updated_at = table_versions.get_version(table_versions.ASSETS)
+        price = get_current_price(normalized_ticker, instrument_type, allow_fetch=FETCH_ON_REQUEST)
         if price is None:
             logger.error(f"No valid price data for {normalized_ticker}")
             fallback_prices = {
@@ -132,27 +145,23 @@ def get_price(request):
             if price is None:
                 return Response({'error': f'No price data for {normalized_ticker}'}, status=404)
             logger.warning(f"Using fallback price for {normalized_ticker}: {price}")
-        else:
-            asset, created = Asset.objects.get_or_create(
-                ticker=normalized_ticker,
-                defaults={
-                    'name': normalized_ticker,
-                    'current_price': price,
-                    'buy_price': 0.0,
-                    'quantity': 0,
-                    'instrument_type': instrument_type
-                }
-            )
-            if not created:
-                asset.current_price = price
-                asset.instrument_type = instrument_type
-                asset.save()
         logger.info(f"Price for {normalized_ticker}: {price}")
-        return Response({'ticker': normalized_ticker, 'price': float(price)})
+        return conditional_response(
+            request, lambda: Response({'ticker': normalized_ticker, 'price': float(price)}),
+            etag=make_etag(table_versions.ASSETS, version, normalized_ticker),
+            last_modified=updated_at,
+        )
     except Exception as e:
         logger.error(f"Failed to fetch price for {normalized_ticker}: {str(e)}")
         return Response({'error': f'Failed to fetch price for {normalized_ticker}: {str(e)}'}, status=500)
 
+def parse_frontier_points(value):
+    """Число точек эффективной границы из запроса: целое от 0 до MAX_FRONTIER_POINTS."""
+    frontier_points = int(value)
+    if not 0 <= frontier_points <= MAX_FRONTIER_POINTS:
+        raise ValueError(f"frontier_points must be between 0 and {MAX_FRONTIER_POINTS}")
+    return frontier_points
+
 @api_view(['POST'])
 def optimize_portfolio(request):
     try:
@@ -162,6 +171,9 @@ def optimize_portfolio(request):
         target_return = float(request.data.get("target_return", 0.1))
         risk_level = float(request.data.get("risk_level", 0.02))
         sortino_l = float(request.data.get("sortino_l", 0.0))
+        method = request.data.get("method", "qp").lower()
+        cov_estimator = request.data.get("cov_estimator", "sample").lower()
+        frontier_points = parse_frontier_points(request.data.get("frontier_points", FRONTIER_POINTS))
         current_portfolio = request.data.get("current_portfolio", [])
 
         logger.info(f"Received optimization request: tickers={tickers}, model={model}, target_return={target_return}, risk_level={risk_level}, sortino_l={sortino_l}")
@@ -170,26 +182,17 @@ def optimize_portfolio(request):
             logger.error("Less than 2 valid tickers provided for optimization")
             return Response({'error': 'At least 2 valid tickers are required'}, status=400)
 
-        if model not in ['markowitz', 'sharpe', 'sortino', 'rachev', 'max_drawdown']:
+        if model not in MODELS:
             return Response({'error': 'Invalid model. Use "markowitz", "sharpe", "sortino", "rachev", or "max_drawdown"'}, status=400)
 
-        normalized_tickers = [TICKER_MAPPING.get(t.lower(), t.upper().replace('.ME', '')) for t in tickers]
-        logger.info(f"Normalized tickers: {normalized_tickers}")
+        if method not in FRONTIER_METHODS:
+            return Response({'error': 'Invalid method. Use "qp", "cla", or "closed_form"'}, status=400)
 
-        bond_tickers = ['SU26207RMFS9', 'RU000A0JX0J2']
-        etf_tickers = ['FXRL', 'SBSP']
-        ticker_types = {}
-        for ticker in normalized_tickers:
-            if ticker in bond_tickers:
-                ticker_types[ticker] = "bonds"
-            elif ticker in etf_tickers:
-                ticker_types[ticker] = "etf"
-            else:
-                ticker_types[ticker] = "shares"
-        for item in current_portfolio:
-            ticker = item.get('ticker')
-            if ticker in normalized_tickers and 'instrument_type' in item:
-                ticker_types[ticker] = item['instrument_type']
+        if cov_estimator not in COV_ESTIMATORS:
+            return Response({'error': 'Invalid cov_estimator. Use "sample", "ledoit_wolf", "oas", or "factor"'}, status=400)
+
+        normalized_tickers, ticker_types = resolve_tickers(tickers, current_portfolio)
+        logger.info(f"Normalized tickers: {normalized_tickers}")
 
         assets = Asset.objects.filter(ticker__in=normalized_tickers)
         logger.info(f"Found assets: {[asset.ticker for asset in assets]}")
@@ -198,223 +201,282 @@ def optimize_portfolio(request):
             logger.error(f"Need at least 2 assets for optimization, found: {len(assets)}")
             return Response({'error': 'Need at least 2 assets for optimization'}, status=400)
 
-        # Расчёт реальной доходности портфеля
-        total_value = 0
-        weighted_returns = 0
-        portfolio_details = []
-        for asset in assets:
-            if asset.quantity > 0 and asset.buy_price > 0 and asset.current_price > 0:
-                asset_return = ((asset.current_price - asset.buy_price) / asset.buy_price) * 100
-                asset_value = asset.quantity * asset.current_price
-                total_value += asset_value
-                weighted_returns += asset_return * (asset_value / total_value if total_value > 0 else 0)
-                portfolio_details.append({
-                    'ticker': asset.ticker,
-                    'buy_price': asset.buy_price,
-                    'current_price': asset.current_price,
-                    'quantity': asset.quantity,
-                    'return': asset_return,
-                    'value': asset_value,
-                })
-        
-        actual_portfolio_return = weighted_returns if total_value > 0 else 0
-
-        # Сбор исторических данных
-        data = {}
-        returns_data = {}
-        for asset in assets:
-            instrument_type = ticker_types.get(asset.ticker, asset.instrument_type)
-            prices = asset.historical_prices.filter(
-                date__gte=datetime.now().date() - timedelta(days=180)
-            ).values('date', 'price')
-            logger.info(f"Historical prices for {asset.ticker}: {list(prices)}")
-
-            # Если исторических цен нет, пытаемся загрузить их из API
-            if not prices:
-                logger.warning(f"No historical prices for {asset.ticker}, fetching from API")
-                end_date = datetime.now().date()
-                start_date = end_date - timedelta(days=180)
-                historical_prices = fetch_historical_prices(asset.ticker, start_date, end_date, instrument_type)
-                
-                if historical_prices:
-                    for price_entry in historical_prices:
-                        HistoricalPrice.objects.update_or_create(
-                            asset=asset,
-                            date=price_entry['date'],
-                            defaults={'price': price_entry['price']}
-                        )
-                    prices = asset.historical_prices.filter(
-                        date__gte=start_date
-                    ).values('date', 'price')
-                    logger.info(f"Fetched {len(prices)} historical prices for {asset.ticker}")
-                else:
-                    # Если API не вернул данные, используем резервные данные
-                    logger.warning(f"No historical data from API for {asset.ticker}, adding fallback")
-                    dates = [
-                        (datetime.now() - timedelta(days=2)).date(),
-                        (datetime.now() - timedelta(days=1)).date(),
-                        datetime.now().date()
-                    ]
-                    prices = [
-                        {'date': dates[0], 'price': asset.current_price * 0.99},
-                        {'date': dates[1], 'price': asset.current_price},
-                        {'date': dates[2], 'price': asset.current_price * 1.01}
-                    ]
-                    for price_entry in prices:
-                        HistoricalPrice.objects.update_or_create(
-                            asset=asset,
-                            date=price_entry['date'],
-                            defaults={'price': price_entry['price']}
-                        )
-                    prices = asset.historical_prices.filter(
-                        date__gte=dates[0]
-                    ).values('date', 'price')
-
-            price_series = pd.Series(
-                {p['date']: p['price'] for p in prices},
-                name=asset.ticker
-            )
-            if len(price_series) < 2:
-                logger.warning(f"Insufficient price data for {asset.ticker}, adding fallback")
-                dates = [
-                    (datetime.now() - timedelta(days=2)).date(),
-                    (datetime.now() - timedelta(days=1)).date()
-                ]
-                prices = [
-                    {'date': dates[0], 'price': asset.current_price * 0.99},
-                    {'date': dates[1], 'price': asset.current_price}
-                ]
-                for price_entry in prices:
-                    HistoricalPrice.objects.update_or_create(
-                        asset=asset,
-                        date=price_entry['date'],
-                        defaults={'price': price_entry['price']}
-                    )
-                price_series = pd.Series(
-                    [price_entry['price'] for price_entry in prices],
-                    index=[price_entry['date'] for price_entry in prices],
-                    name=asset.ticker
-                )
-            data[asset.ticker] = price_series
-            returns = price_series.pct_change().dropna()
-            returns_data[asset.ticker] = returns
-
-        df = pd.DataFrame(data)
-        returns_df = pd.DataFrame(returns_data)
-        logger.info(f"DataFrame for optimization: {df}")
-        if df.empty or len(df.columns) < 2:
-            logger.error("Insufficient historical data for optimization")
-            return Response({'error': 'Insufficient historical data for optimization'}, status=400)
-
-        if len(df) < 2:
-            logger.error("Not enough price data points for optimization")
-            return Response({'error': 'Not enough price data points for optimization'}, status=400)
-
-        mu = expected_returns.mean_historical_return(df)
-        for ticker in df.columns:
-            if ticker_types.get(ticker) == "bonds":
-                coupon_rate = 0.07
-                mu[ticker] += coupon_rate / 252
-
-        S = risk_models.sample_cov(df)
-
-        # Выбор метода оптимизации
+        if str(request.data.get("async", "")).lower() in ('1', 'true', 'yes'):
+            job = create_job({
+                'tickers': [asset.ticker for asset in assets],
+                'ticker_types': ticker_types,
+                'current_portfolio': current_portfolio,
+                'model': model,
+                'target_return': target_return,
+                'risk_level': risk_level,
+                'sortino_l': sortino_l,
+                'frontier_points': frontier_points,
+                'method': method,
+                'cov_estimator': cov_estimator,
+            })
+            return Response(job_payload(job), status=202)
+
         try:
-            if model == 'markowitz':
-                weights, performance = optimize_markowitz(mu, S, target_return)
-            elif model == 'sharpe':
-                weights, performance = optimize_sharpe(mu, S, risk_free_rate=risk_level)
-            elif model == 'sortino':
-                weights, performance = optimize_sortino(mu, S, returns_df, risk_free_rate=risk_level, L=sortino_l)
-            elif model == 'rachev':
-                weights, performance = optimize_rachev(mu, S, returns_df, risk_free_rate=risk_level)
-            elif model == 'max_drawdown':
-                weights, performance = optimize_max_drawdown(mu, S, returns_df)
-            else:
-                raise ValueError("Unknown optimization model")
-        except Exception as e:
-            logger.error(f"Optimization failed: {str(e)}")
-            return Response({'error': f'Optimization failed: {str(e)}'}, status=400)
+            result = build_optimization_result(
+                assets, ticker_types, current_portfolio, model, target_return, risk_level, sortino_l,
+                frontier_points, method, cov_estimator
+            )
+        except OptimizationTimeout as e:
+            return Response({'error': str(e)}, status=504)
+        except OptimizationError as e:
+            return Response({'error': str(e)}, status=400)
+        logger.info(f"Optimization result: {result}")
+        return Response(result)
+
+    except ValueError as e:
+        logger.error(f"Invalid input in optimize_portfolio: {str(e)}")
+        return Response({'error': f'Invalid input: {str(e)}'}, status=400)
+    except Exception as e:
+        logger.error(f"Server error in optimize_portfolio: {str(e)}")
+        return Response({'error': f'Server error: {str(e)}'}, status=500)
 
-        cleaned_weights = weights if model == 'max_drawdown' else {k: v for k, v in weights.items()}
-        additional_metrics = calculate_additional_metrics(cleaned_weights, returns_df, risk_free_rate=risk_level, L=sortino_l)
+def _scenario_shape_error(scenario):
+    """Описание ошибки формы сценария пакета или None."""
+    if not isinstance(scenario, dict):
+        return 'scenario must be an object'
+    tickers = scenario.get("tickers")
+    if tickers is not None and not isinstance(tickers, str) and not (
+        isinstance(tickers, list) and all(isinstance(ticker, str) for ticker in tickers)
+    ):
+        return 'tickers must be a comma-separated string or a list of strings'
+    return None
+
+def _ticker_list(value):
+    if isinstance(value, str):
+        value = value.split(",")
+    return [ticker.strip() for ticker in value or [] if ticker and ticker.strip()]
 
-        # Эффективная граница
-        ef_frontier = []
-        returns = np.linspace(min(mu), max(mu), 10)
-        for ret in returns:
+@api_view(['POST'])
+def optimize_portfolio_batch(request):
+    try:
+        tickers = _ticker_list(request.data.get("tickers", ""))
+        current_portfolio = request.data.get("current_portfolio", [])
+        raw_scenarios = request.data.get("scenarios", [])
+        default_cov_estimator = str(request.data.get("cov_estimator", "sample")).lower()
+
+        logger.info(f"Received batch optimization request: tickers={tickers}, scenarios={len(raw_scenarios)}")
+
+        if not isinstance(raw_scenarios, list) or not raw_scenarios:
+            return Response({'error': 'At least one scenario is required'}, status=400)
+
+        for index, scenario in enumerate(raw_scenarios):
+            error = _scenario_shape_error(scenario)
+            if error:
+                return Response({'error': f'Scenario {index}: {error}'}, status=400)
+
+        scenario_tickers = [_ticker_list(scenario.get("tickers")) for scenario in raw_scenarios]
+        universe = list(dict.fromkeys(tickers + [t for subset in scenario_tickers for t in subset]))
+        if len(universe) < 2:
+            return Response({'error': 'At least 2 valid tickers are required'}, status=400)
+
+        normalized_tickers, ticker_types = resolve_tickers(universe, current_portfolio)
+        normalize = dict(zip(universe, normalized_tickers))
+
+        scenarios = []
+        for index, (scenario, subset) in enumerate(zip(raw_scenarios, scenario_tickers)):
+            model = str(scenario.get("model", "markowitz")).lower()
+            method = str(scenario.get("method", "qp")).lower()
+            cov_estimator = str(scenario.get("cov_estimator", default_cov_estimator)).lower()
+            if model not in MODELS:
+                return Response({'error': f'Invalid model "{model}". Use "markowitz", "sharpe", "sortino", "rachev", or "max_drawdown"'}, status=400)
+            if method not in FRONTIER_METHODS:
+                return Response({'error': f'Invalid method "{method}". Use "qp", "cla", or "closed_form"'}, status=400)
+            if cov_estimator not in COV_ESTIMATORS:
+                return Response({'error': f'Invalid cov_estimator "{cov_estimator}". Use "sample", "ledoit_wolf", "oas", or "factor"'}, status=400)
             try:
-                ef_new = EfficientFrontier(mu, S)
-                ef_new.efficient_return(ret)
-                perf = ef_new.portfolio_performance()
-                ef_frontier.append({
-                    'return': perf[0] * 100,
-                    'risk': perf[1] * 100
-                })
-            except ValueError as e:
-                logger.warning(f"Skipped frontier point due to: {str(e)}")
-                continue
-
-        total_value = sum(
-            item['quantity'] * Asset.objects.get(ticker=item['ticker']).current_price
-            for item in current_portfolio if Asset.objects.filter(ticker=item['ticker']).exists()
-        ) if current_portfolio else 1000
-
-        current_holdings = {item['ticker']: item['quantity'] for item in current_portfolio if Asset.objects.filter(ticker=item['ticker']).exists()}
-        current_prices = {asset.ticker: asset.current_price for asset in assets if asset.current_price > 0}
-
-        recommendations = []
-        for ticker, weight in cleaned_weights.items():
-            if ticker not in current_prices or current_prices[ticker] <= 0:
-                continue
-            optimal_value = total_value * weight
-            current_price = current_prices[ticker]
-            optimal_quantity = int(optimal_value / current_price)
-            current_quantity = current_holdings.get(ticker, 0)
-            quantity_diff = optimal_quantity - current_quantity
-
-            if quantity_diff != 0:
-                action = 'Купить' if quantity_diff > 0 else 'Продать'
-                recommendations.append({
-                    'ticker': ticker,
-                    'action': action,
-                    'quantity': abs(quantity_diff),
-                    'value': abs(quantity_diff) * current_price
+                scenarios.append({
+                    'tickers': [normalize[t] for t in subset],
+                    'model': model,
+                    'method': method,
+                    'cov_estimator': cov_estimator,
+                    'target_return': float(scenario.get("target_return", 0.1)),
+                    'risk_level': float(scenario.get("risk_level", 0.02)),
+                    'sortino_l': float(scenario.get("sortino_l", 0.0)),
+                    'frontier_points': parse_frontier_points(scenario.get("frontier_points", FRONTIER_POINTS)),
                 })
+            except (ValueError, TypeError) as e:
+                return Response({'error': f'Scenario {index}: invalid input: {str(e)}'}, status=400)
 
-        result = {
-            'tickers': list(cleaned_weights.keys()),
-            'weights': [float(w) for w in cleaned_weights.values()],
-            'expected_return': performance[0] * 100 if model in ['markowitz', 'sharpe'] else performance[0] * 100,
-            'actual_return': actual_portfolio_return,
-            'risk': performance[1] * 100 if model in ['markowitz', 'sharpe'] else performance[1] * 100,
-            'sharpe': performance[2] if model == 'sharpe' else (performance[0] - risk_level) / performance[1] if model == 'markowitz' and performance[1] > 0 else 0,
-            'sortino': additional_metrics['sortino'],
-            'rachev': additional_metrics['rachev'],
-            'max_drawdown': additional_metrics['max_drawdown'] * 100,
-            'calmar': additional_metrics['calmar'],
-            'sterling': additional_metrics['sterling'],
-            'frontier': ef_frontier,
-            'recommendations': recommendations,
-            'portfolio_details': portfolio_details,
-            'explanation': (
-                f"Модель {model} оптимизирует портфель. "
-                f"Ожидаемая доходность: {target_return*100}%, уровень риска: {risk_level}. "
-                f"Sortino: {additional_metrics['sortino']:.2f}, Rachev: {additional_metrics['rachev']:.2f}, "
-                f"Max Drawdown: {additional_metrics['max_drawdown']*100:.2f}%, Calmar: {additional_metrics['calmar']:.2f}, "
-                f"Sterling: {additional_metrics['sterling']:.2f}."
-            )
+        assets = Asset.objects.filter(ticker__in=normalized_tickers)
+        if len(assets) < 2:
+            logger.error(f"Need at least 2 assets for optimization, found: {len(assets)}")
+            return Response({'error': 'Need at least 2 assets for optimization'}, status=400)
+
+        try:
+            optimizations = run_batch(assets, ticker_types, scenarios)
+        except OptimizationTimeout as e:
+            return Response({'error': str(e)}, status=504)
+        except OptimizationError as e:
+            return Response({'error': str(e)}, status=400)
+
+        results = []
+        for scenario, optimization in zip(scenarios, optimizations):
+            summary = {'model': scenario['model'], 'method': scenario['method'], 'cov_estimator': scenario['cov_estimator']}
+            if 'error' in optimization:
+                summary['error'] = optimization['error']
+            else:
+                summary.update(summarize_optimization(scenario['model'], optimization, scenario['risk_level']))
+            results.append(summary)
+        return Response({'tickers': [asset.ticker for asset in assets], 'results': results})
+
+    except ValueError as e:
+        logger.error(f"Invalid input in optimize_portfolio_batch: {str(e)}")
+        return Response({'error': f'Invalid input: {str(e)}'}, status=400)
+    except Exception as e:
+        logger.error(f"Server error in optimize_portfolio_batch: {str(e)}")
+        return Response({'error': f'Server error: {str(e)}'}, status=500)
+
+@api_view(['POST'])
+def rebalance_portfolio(request):
+    try:
+        weights = request.data.get("weights", {})
+        if isinstance(weights, list):
+            weights = dict(zip(_ticker_list(request.data.get("tickers", "")), weights))
+        weights = {
+            TICKER_MAPPING.get(ticker.lower(), ticker.upper()): float(weight) for ticker, weight in weights.items()
         }
-        logger.info(f"Optimization result: {result}")
+        current_portfolio = request.data.get("current_portfolio", [])
+        total_value = request.data.get("total_value")
+        total_value = float(total_value) if total_value is not None else None
+        lot_sizes = {ticker: int(lot) for ticker, lot in (request.data.get("lot_sizes") or {}).items()}
+
+        if not weights:
+            return Response({'error': 'Target weights are required'}, status=400)
+
+        return Response(rebalance(weights, current_portfolio, total_value=total_value, lot_sizes=lot_sizes))
+
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Invalid input in rebalance_portfolio: {str(e)}")
+        return Response({'error': f'Invalid input: {str(e)}'}, status=400)
+    except Exception as e:
+        logger.error(f"Server error in rebalance_portfolio: {str(e)}")
+        return Response({'error': f'Server error: {str(e)}'}, status=500)
+
+@api_view(['POST'])
+def simulate_portfolio(request):
+    try:
+        tickers = _ticker_list(request.data.get("tickers", ""))
+        mode = request.data.get("mode", "portfolios").lower()
+        method = request.data.get("method", "mvn").lower()
+        cov_estimator = request.data.get("cov_estimator", "sample").lower()
+        simulations = int(request.data.get("simulations", 10000))
+        horizon = int(request.data.get("horizon", 252))
+        risk_level = float(request.data.get("risk_level", 0.02))
+        concentration = float(request.data.get("concentration", 1.0))
+        seed = request.data.get("seed")
+        seed = int(seed) if seed is not None else None
+        weights = request.data.get("weights") or {}
+        if isinstance(weights, list):
+            weights = dict(zip(tickers, weights))
+        weights = {
+            TICKER_MAPPING.get(ticker.lower(), ticker.upper()): float(weight) for ticker, weight in weights.items()
+        }
+
+        if mode not in SIMULATION_MODES:
+            return Response({'error': 'Invalid mode. Use "portfolios" or "paths"'}, status=400)
+
+        if method not in SIMULATION_METHODS:
+            return Response({'error': 'Invalid method. Use "mvn" or "bootstrap"'}, status=400)
+
+        if cov_estimator not in COV_ESTIMATORS:
+            return Response({'error': 'Invalid cov_estimator. Use "sample", "ledoit_wolf", "oas", or "factor"'}, status=400)
+
+        if mode == 'paths':
+            if not 1 <= horizon <= MAX_HORIZON:
+                return Response({'error': f'horizon must be between 1 and {MAX_HORIZON}'}, status=400)
+            if simulations * horizon > MAX_PATH_CELLS:
+                return Response({'error': f'simulations × horizon must not exceed {MAX_PATH_CELLS}'}, status=400)
+
+        normalized_tickers, ticker_types = resolve_tickers(tickers or list(weights), [])
+        assets = Asset.objects.filter(ticker__in=normalized_tickers)
+        if len(assets) < 2:
+            return Response({'error': 'Need at least 2 assets for simulation'}, status=400)
+
+        try:
+            result = run_simulation(
+                assets, ticker_types, mode, simulations, weights, horizon, method, cov_estimator, risk_level,
+                concentration, seed
+            )
+        except OptimizationTimeout as e:
+            return Response({'error': str(e)}, status=504)
+        except OptimizationError as e:
+            return Response({'error': str(e)}, status=400)
         return Response(result)
 
-    except ValueError as e:
-        logger.error(f"Invalid input in optimize_portfolio: {str(e)}")
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Invalid input in simulate_portfolio: {str(e)}")
         return Response({'error': f'Invalid input: {str(e)}'}, status=400)
     except Exception as e:
-        logger.error(f"Server error in optimize_portfolio: {str(e)}")
+        logger.error(f"Server error in simulate_portfolio: {str(e)}")
         return Response({'error': f'Server error: {str(e)}'}, status=500)
 
+@api_view(['POST'])
+def backtest_portfolio(request):
+    try:
+        tickers = _ticker_list(request.data.get("tickers", ""))
+        model = request.data.get("model", "markowitz").lower()
+        method = request.data.get("method", "qp").lower()
+        lookback = int(request.data.get("lookback", BACKTEST_LOOKBACK))
+        rebalance_every = int(request.data.get("rebalance_every", BACKTEST_REBALANCE_EVERY))
+        cost_bps = float(request.data.get("cost_bps", BACKTEST_COST_BPS))
+        target_return = float(request.data.get("target_return", 0.1))
+        risk_level = float(request.data.get("risk_level", 0.02))
+        sortino_l = float(request.data.get("sortino_l", 0.0))
+        start_date = request.data.get("from")
+        end_date = request.data.get("till")
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+
+        if len(tickers) < 2:
+            return Response({'error': 'At least 2 valid tickers are required'}, status=400)
+
+        if model not in MODELS:
+            return Response({'error': 'Invalid model. Use "markowitz", "sharpe", "sortino", "rachev", or "max_drawdown"'}, status=400)
+
+        if method not in FRONTIER_METHODS:
+            return Response({'error': 'Invalid method. Use "qp", "cla", or "closed_form"'}, status=400)
+
+        normalized_tickers, ticker_types = resolve_tickers(tickers, [])
+        result = run_backtest(
+            normalized_tickers, start_date, end_date, ticker_types,
+            model=model, lookback=lookback, rebalance_every=rebalance_every, cost_bps=cost_bps,
+            target_return=target_return, risk_level=risk_level, sortino_l=sortino_l, method=method,
+        )
+        return Response(result)
+
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Invalid input in backtest_portfolio: {str(e)}")
+        return Response({'error': f'Invalid input: {str(e)}'}, status=400)
+    except Exception as e:
+        logger.error(f"Server error in backtest_portfolio: {str(e)}")
+        return Response({'error': f'Server error: {str(e)}'}, status=500)
+
+def history_payload(dates, prices, max_points=None, downsample='lttb', columnar=False):
+    """Ряд цен в формате ответа: записи или столбцы, при необходимости с прореживанием."""
+    dates = np.asarray(dates)
+    if max_points is not None and len(prices) > max_points and downsample == 'ohlc':
+        dates, open_, high, low, close = ohlc(dates, prices, max_points)
+        columns = {'open': open_, 'high': high, 'low': low, 'close': close}
+    else:
+        if max_points is not None and len(prices) > max_points:
+            selected = lttb(dates.astype('int64'), prices, max_points)
+            dates, prices = dates[selected], np.asarray(prices)[selected]
+        columns = {'price': prices}
+
+    dates = dates.astype(str).tolist()
+    columns = {name: np.asarray(values, dtype=float).tolist() for name, values in columns.items()}
+    if columnar:
+        return {'dates': dates, **{'prices' if name == 'price' else name: values for name, values in columns.items()}}
+    return {'prices': [
+        {'date': date, **{name: values[i] for name, values in columns.items()}}
+        for i, date in enumerate(dates)
+    ]}
+
 @api_view(['GET'])
 def get_historical_prices(request):
     ticker = request.GET.get('ticker')
@@ -423,29 +485,88 @@ def get_historical_prices(request):
         logger.warning("Ticker parameter is missing in get_historical_prices")
         return Response({'error': 'Ticker parameter is required'}, status=400)
 
+    try:
+        start_date = datetime.strptime(request.GET['from'], '%Y-%m-%d').date() if request.GET.get('from') else None
+        end_date = datetime.strptime(request.GET['till'], '%Y-%m-%d').date() if request.GET.get('till') else None
+        max_points = int(request.GET['max_points']) if request.GET.get('max_points') else None
+    except ValueError as e:
+        return Response({'error': f'Invalid input: {str(e)}'}, status=400)
+    downsample = request.GET.get('downsample', 'lttb').lower()
+    if downsample not in DOWNSAMPLING_METHODS:
+        return Response({'error': 'Invalid downsample. Use "lttb" or "ohlc"'}, status=400)
+    if max_points is not None and max_points < 3:
+        return Response({'error': 'max_points must be at least 3'}, status=400)
+    # Параметр format занят DRF (выбор рендерера), поэтому форма ответа задаётся через layout
+    columnar = request.GET.get('layout', 'records').lower() == 'columnar'
+
     asset = Asset.objects.filter(ticker=ticker).first()
     if not asset:
         logger.warning(f"Asset not found for ticker: {ticker}")
         return Response({'error': 'Asset not found'}, status=404)
 
-    prices = asset.historical_prices.values('date', 'price')
-    if not prices:
+    dates, prices = price_series(asset, start_date, end_date)
+    has_history = len(prices) > 0 or asset.historical_prices.exists()
+    if not has_history and not FETCH_ON_REQUEST:
+        logger.warning(f"No historical data available for ticker: {ticker}")
+        return Response({'error': 'No historical data available'}, status=404)
+    if not has_history:
         logger.warning(f"No historical data available for ticker: {ticker}, fetching from API")
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=180)
-        historical_prices = fetch_historical_prices(ticker, start_date, end_date, instrument_type)
-        if historical_prices:
-            for price_entry in historical_prices:
-                HistoricalPrice.objects.update_or_create(
-                    asset=asset,
-                    date=price_entry['date'],
-                    defaults={'price': price_entry['price']}
-                )
-            prices = asset.historical_prices.values('date', 'price')
+        fetch_end = datetime.now().date()
+        fetch_start = fetch_end - timedelta(days=180)
+        saved = load_history(asset, fetch_start, fetch_end, instrument_type)
+        if saved and saved['inserted']:
+            dates, prices = price_series(asset, start_date, end_date)
         else:
             return Response({'error': 'No historical data available'}, status=404)
 
     return Response({
         'ticker': ticker,
-        'prices': list(prices)
-    })
\ No newline at end of file
+        **history_payload(dates, prices, max_points, downsample, columnar)
+    })
+
+@api_view(['GET'])
+def get_historical_prices_bulk(request):
+    tickers = list(dict.fromkeys(_ticker_list(request.GET.get('tickers', ''))))
+    if not tickers:
+        return Response({'error': 'Tickers parameter is required'}, status=400)
+    try:
+        start_date = datetime.strptime(request.GET['from'], '%Y-%m-%d').date() if request.GET.get('from') else None
+        end_date = datetime.strptime(request.GET['till'], '%Y-%m-%d').date() if request.GET.get('till') else None
+    except ValueError as e:
+        return Response({'error': f'Invalid input: {str(e)}'}, status=400)
+    fill = request.GET.get('fill', 'mask').lower()
+    if fill not in ['mask', 'ffill']:
+        return Response({'error': 'Invalid fill. Use "mask" or "ffill"'}, status=400)
+
+    # ETag строится по версиям цен активов до загрузки данных: на 304 матрица не читается.
+    # Версии читаются до данных, поэтому при гонке с записью клиент просто получит данные ещё раз
+    ids = dict(Asset.objects.filter(ticker__in=tickers).values_list('ticker', 'id'))
+    versions = table_versions.get_versions([table_versions.asset_prices(asset_id) for asset_id in ids.values()])
+    asset_versions = [
+        f'{ticker}:{ids[ticker]}:{versions[table_versions.asset_prices(ids[ticker])]}' for ticker in tickers if ticker in ids
+    ]
+    etag = make_etag('historical_prices_bulk', ','.join(tickers), fill, start_date, end_date, *asset_versions)
+
+    def build():
+        matrix = load_price_matrix(tickers, start_date, end_date)
+        if fill == 'ffill':
+            matrix = matrix.ffill()
+        values = matrix.to_numpy()
+        dates = np.asarray(matrix.index, dtype='M8[D]')
+        # NaN (нет котировки) передаётся как null
+        columns = np.where(np.isnan(values), None, values).T.tolist()
+        return Response({
+            'tickers': tickers,
+            'missing': [ticker for ticker in tickers if ticker not in ids],
+            'dates': dates.astype(str).tolist(),
+            'prices': dict(zip(tickers, columns)),
+        })
+
+    return conditional_response(request, build, etag=etag)
+
+@api_view(['GET'])
+def get_optimization_job(request, job_id):
+    job = OptimizationJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return Response({'error': f'Job {job_id} not found'}, status=404)
+    return Response(job_payload(job))
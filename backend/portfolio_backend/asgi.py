@@ -13,4 +13,30 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'portfolio_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api import executor  # noqa: E402  (после настройки Django)
+
+
+async def application(scope, receive, send):
+    """Django-приложение с обработкой lifespan.
+
+    Синхронные представления Django под ASGI выполняются каждое в своём
+    потоке, а расчёты оптимизации — в пуле процессов api.executor, поэтому
+    тяжёлые задачи не блокируют цикл событий и быстрые запросы (get_price).
+    При старте сервера пул процессов создаётся заранее, при остановке —
+    корректно завершается.
+    """
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if executor.WORKERS:
+                executor.get_pool()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
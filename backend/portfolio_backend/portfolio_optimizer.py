@@ -18,7 +18,7 @@ def portfolio_volatility(weights, mean_returns, cov_matrix):
     """Вычисляем волатильность портфеля"""
     return np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
 
-def optimize_markowitz(target_return, mean_returns, cov_matrix):
+def optimize_markowitz(target_return, mean_returns, cov_matrix, initial_weights=None):
     """Оптимизация по Марковицу"""
     num_assets = len(mean_returns)
     args = (mean_returns, cov_matrix)
@@ -27,7 +27,8 @@ def optimize_markowitz(target_return, mean_returns, cov_matrix):
         {'type': 'eq', 'fun': lambda x: np.sum(mean_returns * x) - target_return}  # Целевая доходность
     )
     bounds = tuple((0, 1) for _ in range(num_assets))
-    result = minimize(portfolio_volatility, num_assets*[1./num_assets], args=args,
+    x0 = num_assets*[1./num_assets] if initial_weights is None else initial_weights
+    result = minimize(portfolio_volatility, x0, args=args,
                       method='SLSQP', bounds=bounds, constraints=constraints)
     if not result.success:
         raise Exception("Оптимизация не удалась")
@@ -59,12 +60,13 @@ def optimize_sharpe(mean_returns, cov_matrix, risk_free_rate=0.02):
     return weights, port_return, port_risk, sharpe
 
 def efficient_frontier(mean_returns, cov_matrix, num_portfolios=50):
-    """Строим эффективную границу"""
+    """Строим эффективную границу (каждая точка стартует с решения для предыдущей)"""
     results = []
     target_returns = np.linspace(mean_returns.min(), mean_returns.max(), num_portfolios)
+    weights = None
     for tr in target_returns:
         try:
-            weights, _, risk = optimize_markowitz(tr, mean_returns, cov_matrix)
+            weights, _, risk = optimize_markowitz(tr, mean_returns, cov_matrix, initial_weights=weights)
             results.append([risk, tr, weights])
         except:
             continue
@@ -1,7 +1,12 @@
+import os
+import sys
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Запуск тестов (manage.py test)
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 SECRET_KEY = 'django-insecure-p2u3&v3el75^@wdmscaa3ajb3p(gz7rh5*020exbtmz4vdsao)'
 
 DEBUG = False
@@ -23,6 +28,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +67,23 @@ DATABASES = {
     }
 }
 
+# Кэш результатов оптимизации: LocMemCache вытесняет давно не использованные записи (LRU).
+# Для общего кэша между процессами можно указать FileBasedCache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+    },
+    'optimization': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'optimization-results',
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 256,
+        },
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -104,6 +127,59 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
 ]
 
+MOEX_REQUEST_TIMEOUT = 10
+MOEX_MAX_CONNECTIONS = 10
+MOEX_MAX_WORKERS = 8
+MOEX_RATE_LIMIT = 20
+MOEX_PAGE_PREFETCH = 4
+
+# Интервал фонового обновления цен (manage.py ingest_prices), в секундах
+PRICE_INGEST_INTERVAL = 900
+# False — API не обращается к MOEX и отдаёт только локальные данные
+MARKET_DATA_FETCH_ON_REQUEST = True
+# Время жизни закэшированной текущей цены, в секундах
+PRICE_CACHE_TTL = 300
+
+# Колоночный архив цен (по файлу .npy на актив, чтение через mmap); None — читать цены из БД.
+# Внутри каталога архив каждой БД лежит в своём подкаталоге; в тестах архив отключён
+PRICE_ARCHIVE_DIR = None if TESTING else BASE_DIR / 'price_archive'
+
+# Качество сжатия brotli (0–11), если установлен пакет brotli; иначе ответы сжимаются gzip
+BROTLI_QUALITY = 5
+
+# Число точек эффективной границы по умолчанию и максимальное значение frontier_points
+FRONTIER_POINTS = 10
+MAX_FRONTIER_POINTS = 300
+
+# Пул процессов для расчётов оптимизации: число процессов (0 — считать в потоке запроса)
+# и предельное время одного расчёта в секундах, после которого он отменяется
+OPTIMIZATION_WORKERS = os.cpu_count() or 1
+OPTIMIZATION_TIMEOUT = 60
+# Задача в статусе running без прогресса дольше этого срока (в секундах) возвращается в очередь
+OPTIMIZATION_JOB_STALE_AFTER = 600
+
+# Число факторов статистической модели ковариации (cov_estimator=factor) и размер
+# LRU-кэша оценок ковариации и их разложений
+COVARIANCE_FACTORS = 3
+COVARIANCE_CACHE_SIZE = 64
+
+# Предельное время (в секундах) уточнения целочисленного распределения лотов при ребалансировке
+REBALANCE_TIME_LIMIT = 0.5
+
+# Моделирование (/api/simulate/): число значений в одной порции, обрабатываемой процессом пула,
+# и максимальное число портфелей или путей в запросе
+SIMULATION_CHUNK_CELLS = 2_000_000
+MAX_SIMULATIONS = 1_000_000
+# Режим paths: максимальная длина пути в торговых днях и максимум simulations × horizon
+MAX_SIMULATION_HORIZON = 2520
+MAX_SIMULATION_CELLS = 100_000_000
+
+# Бэктест (/api/backtest/, manage.py backtest) по умолчанию: окно оценки и период
+# ребалансировки в торговых днях, издержки в базисных пунктах от оборота
+BACKTEST_LOOKBACK = 120
+BACKTEST_REBALANCE_EVERY = 21
+BACKTEST_COST_BPS = 10.0
+
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [